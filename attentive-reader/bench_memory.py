@@ -0,0 +1,83 @@
+#! /usr/bin/python
+"""
+Memory against speed of the rnn_memory modes of BaseModel.rnn, training the
+AttentiveReader on random batches of T=1000 steps.
+
+    ./bench_memory.py --modes keep,swap,recompute --batch_size 128 --budget_mb 16000
+
+Every mode runs in its own process, as the peak RSS only grows. Prints the
+ms of a training step, the peak RSS, the part of it that the steps added
+over the built and initialized graph, and whether the peak fits the budget
+"""
+import sys
+import json
+import time
+import subprocess
+import tensorflow as tf
+from model.attentive_model import AttentiveReader
+from bench_scaling import random_batch
+from utils import peak_mb
+
+
+def run(mode):
+    """one mode, in this process"""
+    with tf.Session() as sess:
+        model = AttentiveReader(batch_size=FLAGS.batch_size, vocab_size=FLAGS.vocab_size,
+                                size=FLAGS.hidden_size, rnn_kernel=FLAGS.rnn_kernel,
+                                rnn_memory=mode, rnn_segment=FLAGS.segment)
+        model.build()
+        sess.run(tf.initialize_all_variables())
+        base = peak_mb()
+
+        data = random_batch(FLAGS.batch_size, FLAGS.vocab_size)
+        for _ in xrange(FLAGS.warmup):
+            model.step(sess, data, model.train_op, 0.9)
+        start = time.time()
+        for _ in xrange(FLAGS.steps):
+            model.step(sess, data, model.train_op, 0.9)
+        ms = 1000 * (time.time() - start) / FLAGS.steps
+
+    print json.dumps({'mode': mode, 'ms': ms, 'peak_mb': peak_mb(), 'base_mb': base})
+
+
+def bench(mode):
+    argv = [a for a in sys.argv if not a.startswith('--modes')]
+    out = subprocess.check_output([sys.executable] + argv + ['--run=%s' % mode])
+    return json.loads(out.strip().splitlines()[-1])
+
+
+def main(_):
+    if FLAGS.run:
+        run(FLAGS.run)
+        return
+
+    print ' [*] batch %d, hidden %d, %s kernel, segment %d, %d steps' % (
+        FLAGS.batch_size, FLAGS.hidden_size, FLAGS.rnn_kernel, FLAGS.segment, FLAGS.steps)
+    print '%10s %10s %10s %12s %8s %8s %6s' % (
+        'mode', 'ms/step', 'peak MB', 'steps MB', 'memory', 'time', 'fits')
+    first = None
+    for mode in FLAGS.modes.split(','):
+        r = bench(mode)
+        r['steps_mb'] = r['peak_mb'] - r['base_mb']
+        first = first or r
+        fits = '-' if not FLAGS.budget_mb else 'yes' if r['peak_mb'] <= FLAGS.budget_mb else 'no'
+        print '%10s %10.1f %10.0f %12.0f %8.2f %8.2f %6s' % (
+            mode, r['ms'], r['peak_mb'], r['steps_mb'],
+            r['steps_mb'] / max(first['steps_mb'], 1), r['ms'] / first['ms'], fits)
+
+
+if __name__ == '__main__':
+    flags = tf.app.flags
+    flags.DEFINE_string("modes", "keep,swap,recompute", "rnn_memory modes, the first is the baseline")
+    flags.DEFINE_string("rnn_kernel", "cell", "RNN implementation: cell, block or fused")
+    flags.DEFINE_integer("segment", 50, "Steps recomputed at once")
+    flags.DEFINE_integer("batch_size", 128, "Batch size of every step")
+    flags.DEFINE_integer("vocab_size", 50003, "The size of vocabulary")
+    flags.DEFINE_integer("hidden_size", 256, "Hidden dimension for rnn and fully connected layer")
+    flags.DEFINE_integer("budget_mb", 0, "RAM budget the peak has to fit, 0 for none")
+    flags.DEFINE_integer("steps", 5, "Timed steps")
+    flags.DEFINE_integer("warmup", 1, "Untimed steps before timing")
+    flags.DEFINE_string("run", None, "Run this one mode and print its results")
+    FLAGS = flags.FLAGS
+
+    tf.app.run()
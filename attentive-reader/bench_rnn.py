@@ -0,0 +1,70 @@
+#! /usr/bin/python
+"""
+The rnn kernels of shared/encoders.py on the document encoder of the
+readers, a bidirectional rnn over T=1000 steps.
+
+    ./bench_rnn.py --kernels cell,block,fused --cells LSTM,GRU
+
+For every cell and kernel prints the ms of the forward pass and of
+forward and backward, and checks the outputs past the sequence lengths
+are zero, as with dynamic_rnn
+"""
+import time
+import numpy as np
+import tensorflow as tf
+from utils import encode
+
+
+def timed(sess, fetch, feed):
+    for _ in xrange(FLAGS.warmup):
+        sess.run(fetch, feed)
+    start = time.time()
+    for _ in xrange(FLAGS.steps):
+        sess.run(fetch, feed)
+    return 1000 * (time.time() - start) / FLAGS.steps
+
+
+def bench(cell_type, kernel):
+    with tf.Graph().as_default(), tf.Session() as sess:
+        x = tf.placeholder(tf.float32, [None, FLAGS.nsteps, FLAGS.input_size])
+        seq_length = tf.placeholder(tf.int32, [None])
+        h_t, _ = encode(cell_type, kernel, FLAGS.hidden_size, x, seq_length)
+        h_t = tf.concat(2, h_t)
+        grads = tf.gradients(tf.reduce_sum(h_t), tf.trainable_variables())
+        sess.run(tf.initialize_all_variables())
+
+        lengths = np.random.randint(FLAGS.nsteps // 2, FLAGS.nsteps, FLAGS.batch_size)
+        feed = {x: np.random.randn(FLAGS.batch_size, FLAGS.nsteps, FLAGS.input_size),
+                seq_length: lengths}
+        out = sess.run(h_t, feed)
+        padded = np.arange(FLAGS.nsteps)[None, :] >= lengths[:, None]
+        assert not out[padded].any(), 'outputs past seq_length'
+
+        return timed(sess, h_t, feed), timed(sess, grads, feed)
+
+
+def main(_):
+    print ' [*] T %d, batch %d, input %d, hidden %d, bidirectional, %d steps' % (
+        FLAGS.nsteps, FLAGS.batch_size, FLAGS.input_size, FLAGS.hidden_size, FLAGS.steps)
+    print '%6s %8s %12s %12s %8s' % ('cell', 'kernel', 'forward ms', 'fwd+bwd ms', 'speedup')
+    for cell_type in FLAGS.cells.split(','):
+        base = None
+        for kernel in FLAGS.kernels.split(','):
+            forward, train = bench(cell_type, kernel)
+            base = base or train
+            print '%6s %8s %12.1f %12.1f %8.2f' % (cell_type, kernel, forward, train, base / train)
+
+
+if __name__ == '__main__':
+    flags = tf.app.flags
+    flags.DEFINE_string("kernels", "cell,block,fused", "Kernels to compare, the first is the baseline")
+    flags.DEFINE_string("cells", "LSTM,GRU", "Cell types")
+    flags.DEFINE_integer("nsteps", 1000, "Sequence length T")
+    flags.DEFINE_integer("batch_size", 32, "Batch size of every step")
+    flags.DEFINE_integer("input_size", 256, "Embedding size")
+    flags.DEFINE_integer("hidden_size", 256, "Hidden size of each direction")
+    flags.DEFINE_integer("steps", 5, "Timed steps")
+    flags.DEFINE_integer("warmup", 1, "Untimed steps before timing")
+    FLAGS = flags.FLAGS
+
+    tf.app.run()
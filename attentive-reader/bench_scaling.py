@@ -0,0 +1,135 @@
+#! /usr/bin/python
+"""
+Training throughput of the data parallel modes from 1 to N, on random
+batches of the usual shapes.
+
+    ./bench_scaling.py --max_towers 4
+builds the AttentiveReader with 1..4 towers in one process,
+
+    ./bench_scaling.py --max_workers 4
+runs 1..4 worker processes against a local parameter server.
+
+Prints examples/sec, speedup over 1 and parallel efficiency
+"""
+import os
+import sys
+import json
+import time
+import tempfile
+import numpy as np
+import tensorflow as tf
+from model.attentive_model import AttentiveReader
+from cluster import launch, start_server, worker_device
+
+
+def random_batch(batch_size, vocab_size, max_nsteps=1000, max_query_length=20):
+    docs = np.random.randint(4, vocab_size, [batch_size, max_nsteps])
+    queries = np.random.randint(4, vocab_size, [batch_size, max_query_length])
+    d_end = np.random.randint(max_nsteps // 2, max_nsteps, batch_size)
+    q_end = np.random.randint(max_query_length // 2, max_query_length, batch_size)
+    y = np.zeros([batch_size, vocab_size], dtype=np.float32)
+    y[np.arange(batch_size), np.random.randint(4, vocab_size, batch_size)] = 1
+    return 0, docs, d_end, queries, q_end, y
+
+
+def create_model(towers=1):
+    return AttentiveReader(batch_size=FLAGS.batch_size, vocab_size=FLAGS.vocab_size,
+                           size=FLAGS.hidden_size, towers=towers)
+
+
+def run_steps(sess, model, steps, warmup):
+    """examples/sec of the train op, after warmup steps"""
+    data = random_batch(FLAGS.batch_size, FLAGS.vocab_size)
+    for _ in xrange(warmup):
+        model.step(sess, data, model.train_op, 0.9)
+    start = time.time()
+    for _ in xrange(steps):
+        model.step(sess, data, model.train_op, 0.9)
+    return steps * FLAGS.batch_size / (time.time() - start)
+
+
+def bench_towers(k):
+    with tf.Graph().as_default(), tf.Session() as sess:
+        model = create_model(towers=k)
+        if k > 1:
+            model.build_towers()
+        else:
+            model.build()
+        sess.run(tf.initialize_all_variables())
+        return run_steps(sess, model, FLAGS.steps, FLAGS.warmup)
+
+
+def bench_workers(k):
+    """examples/sec summed over k worker processes"""
+    fd, report_file = tempfile.mkstemp(suffix='.js')
+    os.close(fd)
+    argv = [a for a in sys.argv if not a.startswith('--max_workers')]
+    argv += ['--max_workers=0', '--report_file=%s' % report_file]
+    code = launch(argv, k, FLAGS.ps_port)
+    assert code == 0, 'a worker failed with %d' % code
+    with open(report_file) as f:
+        rates = [json.loads(line)['examples_per_sec'] for line in f if line.strip()]
+    os.remove(report_file)
+    assert len(rates) == k
+    return sum(rates)
+
+
+def worker():
+    cluster, server = start_server('worker', FLAGS.task_index, FLAGS.workers, FLAGS.ps_port)
+    with tf.Session(server.target) as sess:
+        model = create_model()
+        with tf.device(worker_device(cluster, FLAGS.task_index)):
+            model.build()
+        if FLAGS.task_index == 0:
+            sess.run(tf.initialize_all_variables())
+        else:
+            uninitialized = tf.report_uninitialized_variables()
+            while len(sess.run(uninitialized)) > 0:
+                time.sleep(1)
+        rate = run_steps(sess, model, FLAGS.steps, FLAGS.warmup)
+
+    with open(FLAGS.report_file, 'a') as f:
+        f.write(json.dumps({'task': FLAGS.task_index, 'examples_per_sec': rate}) + '\n')
+
+
+def report(mode, bench, N):
+    print ' [*] %s, batch %d, %d steps' % (mode, FLAGS.batch_size, FLAGS.steps)
+    print '%8s %14s %8s %10s' % (mode, 'examples/sec', 'speedup', 'efficiency')
+    base = None
+    for k in range(1, N + 1):
+        rate = bench(k)
+        base = base or rate
+        print '%8d %14.1f %8.2f %10.2f' % (k, rate, rate / base, rate / base / k)
+
+
+def main(_):
+    if FLAGS.job_name == 'ps':
+        cluster, server = start_server('ps', 0, FLAGS.workers, FLAGS.ps_port)
+        server.join()
+    elif FLAGS.job_name == 'worker':
+        worker()
+    else:
+        if FLAGS.max_towers:
+            report('towers', bench_towers, FLAGS.max_towers)
+        if FLAGS.max_workers:
+            report('workers', bench_workers, FLAGS.max_workers)
+
+
+if __name__ == '__main__':
+    flags = tf.app.flags
+    flags.DEFINE_integer("max_towers", 0, "Benchmark 1..max_towers towers in one graph")
+    flags.DEFINE_integer("max_workers", 0, "Benchmark 1..max_workers worker processes")
+    flags.DEFINE_integer("batch_size", 32, "Batch size of every step, per worker")
+    flags.DEFINE_integer("vocab_size", 50003, "The size of vocabulary")
+    flags.DEFINE_integer("hidden_size", 256, "Hidden dimension for rnn and fully connected layer")
+    flags.DEFINE_integer("steps", 20, "Timed steps")
+    flags.DEFINE_integer("warmup", 3, "Untimed steps before timing")
+    flags.DEFINE_integer("ps_port", 2222, "Port of the parameter server")
+    # set by the launcher
+    flags.DEFINE_integer("workers", 1, "Number of workers")
+    flags.DEFINE_string("job_name", None, "ps or worker")
+    flags.DEFINE_integer("task_index", 0, "Index of this worker")
+    flags.DEFINE_string("report_file", None, "Workers append their throughput here")
+    FLAGS = flags.FLAGS
+
+    tf.app.run()
@@ -0,0 +1,54 @@
+#! /usr/bin/python
+"""
+Train step time with the embedding gradient kept sparse against the dense
+path, on the full vocabulary and random batches.
+
+    ./bench_sparse.py --optim Adam,RMS
+
+For every optimizer the AttentiveReader is built twice, with
+sparse_grads on and off, and the mean ms per step is printed
+"""
+import time
+import tensorflow as tf
+from model.attentive_model import AttentiveReader
+from bench_scaling import random_batch
+
+
+def bench(optim, sparse_grads):
+    with tf.Graph().as_default(), tf.Session() as sess:
+        model = AttentiveReader(batch_size=FLAGS.batch_size, vocab_size=FLAGS.vocab_size,
+                                size=FLAGS.hidden_size, use_optimizer=optim,
+                                sparse_grads=sparse_grads)
+        model.build()
+        sess.run(tf.initialize_all_variables())
+
+        data = random_batch(FLAGS.batch_size, FLAGS.vocab_size)
+        for _ in xrange(FLAGS.warmup):
+            model.step(sess, data, model.train_op, 0.9)
+        start = time.time()
+        for _ in xrange(FLAGS.steps):
+            model.step(sess, data, model.train_op, 0.9)
+        return 1000 * (time.time() - start) / FLAGS.steps
+
+
+def main(_):
+    print ' [*] vocab %d, hidden %d, batch %d, %d steps' % (
+        FLAGS.vocab_size, FLAGS.hidden_size, FLAGS.batch_size, FLAGS.steps)
+    print '%8s %12s %12s %8s' % ('optim', 'dense ms', 'sparse ms', 'speedup')
+    for optim in FLAGS.optim.split(','):
+        dense = bench(optim, False)
+        sparse = bench(optim, True)
+        print '%8s %12.1f %12.1f %8.2f' % (optim, dense, sparse, dense / sparse)
+
+
+if __name__ == '__main__':
+    flags = tf.app.flags
+    flags.DEFINE_string("optim", "Adam,RMS", "Optimizers to compare")
+    flags.DEFINE_integer("batch_size", 32, "Batch size of every step")
+    flags.DEFINE_integer("vocab_size", 50003, "The size of vocabulary")
+    flags.DEFINE_integer("hidden_size", 256, "Hidden dimension for rnn and fully connected layer")
+    flags.DEFINE_integer("steps", 20, "Timed steps")
+    flags.DEFINE_integer("warmup", 3, "Untimed steps before timing")
+    FLAGS = flags.FLAGS
+
+    tf.app.run()
@@ -0,0 +1,91 @@
+"""
+Local parameter server setup: one ps process holds the variables, every
+worker process trains on its own shard and pushes its updates to it.
+
+    ./main.py --workers 4
+starts the ps and 4 workers of the same command on this box, each worker
+pinned to its own set of cores.
+"""
+import os
+import sys
+import subprocess
+import tensorflow as tf
+from utils import allowed_cores
+
+
+def cluster_spec(num_workers, port=2222, host='localhost'):
+    return tf.train.ClusterSpec({
+        'ps': ['%s:%d' % (host, port)],
+        'worker': ['%s:%d' % (host, port + 1 + i) for i in range(num_workers)],
+    })
+
+
+def core_sets(num_workers, exclude=()):
+    """
+    `taskset -c` lists of the ps and of num_workers workers, from the
+    allowed cores but those in exclude, e.g. reserved for the validator.
+    The ps gets a core of its own when there is one to spare
+    """
+    cores = [c for c in allowed_cores() if c not in exclude] or allowed_cores()
+    ps = cores[:1]
+    if len(cores) > num_workers:
+        cores = cores[1:]
+    per = max(1, len(cores) // num_workers)
+    sets = []
+    for i in range(num_workers):
+        head = (i * per) % len(cores)
+        sets.append(','.join(map(str, cores[head:head + per])))
+    return ','.join(map(str, ps)), sets
+
+
+def has_taskset():
+    with open(os.devnull, 'w') as null:
+        return subprocess.call(['which', 'taskset'], stdout=null, stderr=null) == 0
+
+
+def start_server(job_name, task_index, num_workers, port=2222, config=None):
+    """config sets the thread pools the server runs this task's ops on"""
+    cluster = cluster_spec(num_workers, port)
+    server = tf.train.Server(cluster, job_name=job_name, task_index=task_index,
+                             config=config)
+    return cluster, server
+
+
+def worker_device(cluster, task_index):
+    """variables on the ps, everything else on this worker"""
+    return tf.train.replica_device_setter(
+        worker_device='/job:worker/task:%d' % task_index, cluster=cluster)
+
+
+def launch(argv, num_workers, port=2222, pin=True, exclude=()):
+    """
+    run `python argv` as one ps and num_workers workers, adding
+    --job_name, --task_index, --workers and --ps_port, and wait for the
+    workers. Processes are pinned off the cores in exclude. Returns the
+    worst exit code
+    """
+    base = [sys.executable] + list(argv) + ['--workers=%d' % num_workers,
+                                            '--ps_port=%d' % port]
+    pin = pin and has_taskset()
+    ps_cores, cores = core_sets(num_workers, exclude)
+    cmd = base + ['--job_name=ps', '--task_index=0']
+    if pin:
+        cmd = ['taskset', '-c', ps_cores] + cmd
+    ps = subprocess.Popen(cmd)
+
+    workers = []
+    for i in range(num_workers):
+        cmd = base + ['--job_name=worker', '--task_index=%d' % i]
+        if pin:
+            cmd = ['taskset', '-c', cores[i]] + cmd
+        workers.append(subprocess.Popen(cmd))
+
+    try:
+        codes = [w.wait() for w in workers]
+    finally:
+        for w in workers:
+            if w.poll() is None:
+                w.terminate()
+        ps.terminate()
+        ps.wait()
+    return max(codes)
@@ -6,7 +6,8 @@ import numpy as np
 # from attentive_model import AttentiveReader
 import json
 import tensorflow as tf
-from utils import load_dataset
+from multiprocessing import Process
+from utils import fetch_files, data_iter, append_rows, H5Data, define_resources
 from evaluate import dig_tensors, step, analyse
 # import pickle as pk
 import h5py
@@ -14,14 +15,19 @@ import h5py
 # from collections import Counter
 
 
+# gather_data.py log_path [threads per worker, 0 for a share of the idle cores] [workers]
 log_path = sys.argv[1]
-if len(sys.argv) == 3:
-    gpu = sys.argv[2]
+if len(sys.argv) >= 3:
+    threads = int(sys.argv[2])
 else:
-    gpu = 2
-
-os.environ['CUDA_VISIBLE_DEVICES']=str(gpu)
+    threads = 0
+if len(sys.argv) >= 4:
+    num_worker = int(sys.argv[3])
+else:
+    num_worker = 1
 
+OUTPUT = 'FULL_Big_BOOST.h5'
+KEYS = ['doc', 'dlen', 'que', 'qlen', 'label']
 
 # log_path = './log/concat_B/12_10_02_29/'
 ckpt = os.path.join(log_path, 'ckpts')
@@ -39,84 +45,153 @@ hidden_size = old_flag['hidden_size']
 activation = old_flag['activation']
 atten = old_flag.get('attention', 'concat')
 
-ck = tf.train.get_checkpoint_state(ckpt)
-ckfiles = list(ck.all_model_checkpoint_paths)
-
-tf.reset_default_graph()
-g = tf.get_default_graph()
-sess = tf.Session()
-
-titer, tstep, viter, vstep = load_dataset('../data', 'cnn', 
-                vocab_size, batch_size, max_nsteps, max_query_length, shuffle_data=False)
-
-if tstep == 0:
-    import ipdb; ipdb.set_trace()
-
-which = -1
-saver = tf.train.import_meta_graph(ckfiles[which]+'.meta')
-saver.restore(sess, ckfiles[which])
-M = dig_tensors(g)
-logit = tf.nn.softmax(M.score)
-print 'Load!'
-
-
-
-DOC = []
-DLEN = []
-QUE = []
-QLEN = []
-LABEL = []
-
-fetch = [M.accuracy, logit, M.attention]
-print 'Start!'
-for data in titer:
-    idx = data[0]
-    doc = data[1]
-    ans = data[-1]
-    d_len = data[2]
-    query = data[3]
-    q_len = data[4]
-
-    sys.stdout.write( '\r%d' % idx )
-    # if idx == 300:
-    #    break
-
-    acc, prob, atten = step(data, M, sess, fetch)
-    p, c, both = analyse(doc, ans, atten)
-
-    doc = doc[both]
-    d_len = d_len[both]
-    query = query[both]
-    q_len = q_len[both]
-    atten = atten[both]
-
-    # tmp = np.stack( [doc, atten], axis=2 )
-    DOC.append(doc)
-    DLEN.append(d_len)
-    QUE.append(query)
-    QLEN.append(q_len)
-
-    c = c[both]
-    p = p[both]
-    c = c.astype(np.int)
-    p = p.astype(np.int)
-    c[ c == 1 ] = 2
-    label = c + p
-    LABEL.append(label)
-
-doc_all = np.concatenate( DOC )
-dlen_all = np.concatenate( DLEN )
-que_all = np.concatenate( QUE )
-qlen_all = np.concatenate( QLEN )
-label_all = np.concatenate( LABEL )
-
-print doc_all.shape
-print label_all.shape
-print dlen_all.shape
-
-with h5py.File('FULL_Big_BOOST.h5', 'w') as hf:
-    hf.create_dataset('doc', data=doc_all)
-    hf.create_dataset('dlen', data=dlen_all)
-    hf.create_dataset('que', data=que_all)
-    hf.create_dataset('qlen', data=qlen_all)
-    hf.create_dataset('label', data=label_all)
+
+def shard(flist, worker, num_worker):
+    """contiguous, batch aligned part of flist handled by one worker"""
+    nbatch = int(np.ceil(len(flist) / float(batch_size)))
+    per = int(np.ceil(nbatch / float(num_worker)))
+    return flist[worker * per * batch_size:(worker + 1) * per * batch_size]
+
+
+def layout(flist, worker, num_worker):
+    """what a part file was gathered from, a resume has to match it"""
+    return {'worker': worker, 'num_worker': num_worker, 'num_files': len(flist),
+            'first_file': os.path.basename(flist[0]) if flist else ''}
+
+
+def resume(hf, shard_layout):
+    """
+    number of batches already written to hf. Rows appended after the
+    last checkpoint by a crashed run are dropped. A file of another shard
+    layout, other workers or files, is refused instead of mixed in.
+    """
+    progress = 'done_batch' in hf.attrs and 'done_rows' in hf.attrs
+    if not progress and any(k in hf for k in KEYS):
+        # merged, or written by an older gather_data.py
+        raise ValueError('%s has data but no progress to resume from, move it away to start over'
+                         % hf.filename)
+    if progress and 'num_worker' not in hf.attrs:
+        raise ValueError('%s has no shard layout, remove it to start over' % hf.filename)
+    for k, v in shard_layout.items():
+        if k in hf.attrs and hf.attrs[k] != v:
+            raise ValueError('%s was gathered with %s=%s, not %s, remove it to start over'
+                             % (hf.filename, k, hf.attrs[k], v))
+        hf.attrs[k] = v
+    if not progress:
+        return 0
+    rows = hf.attrs['done_rows']
+    for k in KEYS:
+        if k in hf:
+            hf[k].resize(rows, axis=0)
+    return hf.attrs['done_batch']
+
+
+def gather(flist, fname, worker=0, num_worker=1):
+    """
+    run the model over flist, shard worker of num_worker, and append the
+    filtered samples to fname
+    """
+    tf.reset_default_graph()
+    g = tf.get_default_graph()
+    # every worker takes its own share of the cores
+    config, plan = define_resources(threads, jobs=num_worker, pin=num_worker > 1)
+    sess = tf.Session(config=config)
+
+    ck = tf.train.get_checkpoint_state(ckpt)
+    ckfiles = list(ck.all_model_checkpoint_paths)
+
+    which = -1
+    saver = tf.train.import_meta_graph(ckfiles[which]+'.meta')
+    saver.restore(sess, ckfiles[which])
+    M = dig_tensors(g)
+    logit = tf.nn.softmax(M.score)
+    print 'Load!'
+
+    hf = h5py.File(fname, 'a')
+    done = resume(hf, layout(flist, worker, num_worker))
+    if done > 0:
+        print 'Resume %s from batch %d' % (fname, done)
+    titer = data_iter(flist[done * batch_size:], max_nsteps, max_query_length,
+                      batch_size=batch_size, vocab_size=vocab_size, shuffle_data=False)
+    titer.next()
+
+    fetch = [M.accuracy, logit, M.attention]
+    print 'Start!'
+    for data in titer:
+        idx = data[0]
+        doc = data[1]
+        ans = data[-1]
+        d_len = data[2]
+        query = data[3]
+        q_len = data[4]
+
+        sys.stdout.write( '\r%d' % (done + idx) )
+
+        acc, prob, atten = step(data, M, sess, fetch)
+        p, c, both = analyse(doc, ans, atten)
+
+        c = c[both]
+        p = p[both]
+        c = c.astype(np.int)
+        p = p.astype(np.int)
+        c[ c == 1 ] = 2
+        label = c + p
+
+        rows = [doc[both], d_len[both], query[both], q_len[both], label]
+        for k, r in zip(KEYS, rows):
+            append_rows(hf, k, r)
+
+        # checkpoint progress, a crash loses at most one batch
+        hf.attrs['done_batch'] = done + idx + 1
+        hf.attrs['done_rows'] = hf['label'].shape[0]
+        hf.flush()
+
+    print
+    print '%s: %d samples' % (fname, hf.attrs.get('done_rows', 0))
+    hf.close()
+    sess.close()
+
+
+def merge(parts, fname, chunk=4096):
+    """stream the worker files into fname chunk by chunk"""
+    with h5py.File(fname, 'w') as hf:
+        for p in parts:
+            with h5py.File(p, 'r') as part:
+                empty = any(k not in part for k in KEYS)
+            if empty:
+                # no batch of the shard, or none of its rows kept
+                os.remove(p)
+                continue
+            data = H5Data(p, KEYS)
+            for head in range(0, len(data), chunk):
+                rows = data.read(head, min(head + chunk, len(data)))
+                for k, r in zip(KEYS, rows):
+                    append_rows(hf, k, r)
+            data.close()
+            os.remove(p)
+        for k in KEYS:
+            print k, hf[k].shape if k in hf else 0
+
+
+if __name__ == '__main__':
+    train_files, _ = fetch_files('../data', 'cnn', vocab_size)
+    # glob order varies, the shards and resumes rely on this one
+    train_files = sorted(train_files)
+
+    if num_worker == 1:
+        gather(train_files, OUTPUT)
+    else:
+        parts = ['%s.part%d' % (OUTPUT, w) for w in range(num_worker)]
+        workers = [Process(target=gather,
+                           args=(shard(train_files, w, num_worker), parts[w], w, num_worker))
+                   for w in range(num_worker)]
+        for w in workers:
+            w.start()
+        for w in workers:
+            w.join()
+
+        failed = [p for p, w in zip(parts, workers) if w.exitcode != 0]
+        if failed:
+            print 'Workers failed, rerun to resume: %s' % failed
+            exit(1)
+        merge(parts, OUTPUT)
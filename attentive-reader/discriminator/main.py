@@ -5,10 +5,9 @@ import os
 import h5py
 import tensorflow as tf
 
-# import sys
-# sys.path.insert(0, '../utils')
-
-# from utils import define_gpu
+import sys
+sys.path.append('..')
+from utils import H5Data, append_rows, define_resources, Throughput, padded_tokens
 
 # VFILE = './Data.h5'
 # TFILE = './Validate.h5'
@@ -20,71 +19,71 @@ def Topk(array, k):
     return [_[1] for _ in pair]
 
 
-def data_iter(batch_size, data, d_len, label, k=None, shuffle_data=True):
-    N = data.shape[0]
-
-    steps = np.ceil(N / float(batch_size))
-    steps = int(steps)
+def data_iter(batch_size, data, shuffle_data=True):
+    batches = data.batch_iter(batch_size, shuffle=shuffle_data)
+    steps = batches.next()
     yield steps
 
-    if k :
-        d_topk = np.zeros( [batch_size, k, 2], dtype=np.float32 )
-    oh_label = np.zeros([batch_size, 3], dtype=np.int)
-
-    order = range(batch_size)
-    for s in range(steps):
-
-        head = s * batch_size
-        end = (s + 1) * batch_size
-        if end <= N:
-            d = data[head:end]
-            dl = d_len[head:end]
-            l = label[head:end]
-        else:
-            d = np.concatenate([data[head:], data[:end - N]], axis=0)
-            l = np.concatenate([label[head:], label[:end - N]], axis=0)
-            dl = np.concatenate([d_len[head:], d_len[:end - N]], axis=0)
+    for s, (d, dl, l) in batches:
 
-        if shuffle_data:
-            np.random.shuffle(order)
-            d = d[order]
-            dl = dl[order]
-            l = l[order]
-
-
-        oh_label.fill(0)
+        n = d.shape[0]
+        oh_label = np.zeros([n, 3], dtype=np.int)
 
         try:
-            oh_label[range(batch_size), l - 1] = 1
+            oh_label[range(n), l - 1] = 1
         except Exception, e:
             print e
             assert False 
             #import ipdb
             #ipdb.set_trace()
 
-
-        if k:
-            d_topk.fill(0)
-            for i in range(batch_size):
-                top_idx = np.argpartition(-d[i,:,1], k)[:k]
-                top_idx = sorted(top_idx)
-                d_topk[i] = d[i,top_idx,:] # i, 2, k
-
-            dl[:] = k
-
-            yield s, d_topk, dl, oh_label
-        else:
-            yield s, d,      dl, oh_label
-
-
-def prepare_data(batch_size, fname, vocab_size=50003, topk=None, shuffle=True):
-
-    with h5py.File(fname, 'r') as hf:
-        data = hf.get('data')[()]
-        dlen = hf.get('dlen')[()]
-        label = hf.get('label')[()]
-
-    itr = data_iter(batch_size, data, dlen, label, shuffle_data=shuffle, k=topk)
+        yield s, d, dl, oh_label
+
+
+def topk_features(d, k):
+    """
+    d: [n, sL, 2] of (word id, attention score)
+    keep the k highest scored positions of every row, in document order
+    """
+    top_idx = np.argpartition(-d[:, :, 1], k, axis=1)[:, :k]
+    top_idx.sort(axis=1)
+    rows = np.arange(d.shape[0])[:, None]
+    return d[rows, top_idx].astype(np.float32)  # n, k, 2
+
+
+def build_topk(fname, k, chunk=4096):
+    """
+    precompute the top k features of fname once and cache them next to it
+    return the path of the cache
+    """
+    cache = '%s.top%d' % (fname, k)
+    if os.path.exists(cache) and os.path.getmtime(cache) >= os.path.getmtime(fname):
+        return cache
+
+    print 'Building top %d cache %s' % (k, cache)
+    src = H5Data(fname, ['data', 'label'])
+    tmp = cache + '.tmp'
+    with h5py.File(tmp, 'w') as hf:
+        for head in range(0, len(src), chunk):
+            d, l = src.read(head, min(head + chunk, len(src)))
+            append_rows(hf, 'data', topk_features(d, k))
+            append_rows(hf, 'dlen', np.full([d.shape[0]], k, dtype=np.int32))
+            append_rows(hf, 'label', l)
+    src.close()
+    os.rename(tmp, cache)
+    return cache
+
+
+def open_data(fname, topk=None):
+    """open the file once, rows are read lazily by chunk"""
+    if topk:
+        fname = build_topk(fname, topk)
+    return H5Data(fname, ['data', 'dlen', 'label'])
+
+
+def prepare_data(batch_size, data, vocab_size=50003, shuffle=True):
+
+    itr = data_iter(batch_size, data, shuffle_data=shuffle)
     step = itr.next()
     return itr, step
 
@@ -93,12 +92,16 @@ def create_flag():
     flags = tf.app.flags
     flags.DEFINE_integer("epoch", 15, "Epoch to train [40]")
     flags.DEFINE_integer("batch_size", 64, "")
-    flags.DEFINE_integer("gpu", 1, "the number of gpus to use")
+    flags.DEFINE_integer("threads", 0, "Intra op threads, 0 takes a share of the idle cores")
+    flags.DEFINE_integer("inter_threads", 0, "Inter op threads, 0 uses one per socket")
+    flags.DEFINE_integer("jobs", 1, "Number of jobs sharing the idle cores of this box")
+    flags.DEFINE_boolean("pin", False, "Pin the process to the planned cores")
     flags.DEFINE_integer("data_size", None, "Number of files to train on")
     flags.DEFINE_integer("hidden_size", 64, "")
     flags.DEFINE_integer("eval_every", 400, "Eval every step")
     flags.DEFINE_integer("layer", 1, "")
     flags.DEFINE_integer("topk", None, "")
+    flags.DEFINE_integer("vocab_size", 574, "vocabulary of the onehot model")
 
     flags.DEFINE_float("learning_rate", 5e-2, "Learning rate")
     flags.DEFINE_string("log_dir", "log", "")
@@ -108,6 +111,8 @@ def create_flag():
 
     # flags.DEFINE_string("optim", 'RMS', "The optimizer to use [RMS]")
     flags.DEFINE_boolean('reuse', True, '')
+    flags.DEFINE_string("rnn_kernel", "cell", "LSTM implementation: cell, block or fused")
+    flags.DEFINE_integer("accumulate", 1, "Apply the summed gradients of that many batches as one step")
 
     FLAGS = flags.FLAGS
 
@@ -121,10 +126,8 @@ def create_flag():
 def main():
     FLAGS = create_flag()
 
-    # gpu_list = define_gpu( FLAGS.gpu )
-    gpu_list = [ FLAGS.gpu ]
-    os.environ['CUDA_VISIBLE_DEVICES'] = ",".join( map(str, gpu_list) )
-    print 'Using GPU: %s' % gpu_list
+    config, plan = define_resources(FLAGS.threads, FLAGS.inter_threads,
+                                    jobs=FLAGS.jobs, pin=FLAGS.pin)
 
     if FLAGS.model == 'origin':
         from model import RNN as m
@@ -137,12 +140,20 @@ def main():
     else:
         raise ValueError(FLAGS.model)
 
+    kwargs = {}
+    if FLAGS.model == 'onehot':
+        kwargs['vocab_size'] = FLAGS.vocab_size
+    if FLAGS.model in ('origin', 'onehot'):
+        kwargs['rnn_kernel'] = FLAGS.rnn_kernel
+
     M = m(
             FLAGS.batch_size, FLAGS.hidden_size,
             learning_rate=FLAGS.learning_rate,
             sequence_length=FLAGS.topk if FLAGS.topk else 1000,
             num_layer=FLAGS.layer,
             reuse=FLAGS.reuse,
+            accumulate=FLAGS.accumulate,
+            **kwargs
         )
     print 'Model Created'        
 
@@ -161,7 +172,10 @@ def main():
     else: 
         VFILE = './data/Validate.h5'
 
-    with tf.Session() as sess:
+    tdata = open_data(FLAGS.data_path, topk=FLAGS.topk)
+    vdata = open_data(VFILE, topk=FLAGS.topk)
+
+    with tf.Session(config=config) as sess:
         writer = tf.train.SummaryWriter(log_dir, sess.graph)
         tfetch = [M.global_step, M.loss, M.accuracy, M.train_op,
                  M.train_summary,
@@ -172,20 +186,33 @@ def main():
         vfetch = [M.loss, M.accuracy, M.validate_summary]
 
         sess.run(tf.initialize_all_variables())
+        sess.run(tf.initialize_local_variables())
 
+        # the batches of the 20 steps between two logs
+        meter = Throughput(log_dir, writer, every=20 * FLAGS.accumulate)
+        counter = 0
         running_acc = 0.0
         running_loss = 0.0
         for e in range(FLAGS.epoch):
             titer, tstep = prepare_data(
-                FLAGS.batch_size, FLAGS.data_path, shuffle=True, topk=FLAGS.topk)
+                FLAGS.batch_size, tdata, shuffle=True)
 
             print tstep
 
-            for data in titer:
+            for data in meter.wait(titer):
+                run_start = time.time()
                 gstep, loss, accuracy, _, sum_str, score = M.step(sess, data, tfetch)
-
-                running_acc += accuracy
-                running_loss += loss.mean()
+                counter += 1
+                tokens, slots = padded_tokens(data[2], data[1].shape[1])
+                meter.add(gstep, time.time() - run_start, len(data[2]), tokens, slots)
+
+                running_acc += accuracy / FLAGS.accumulate
+                running_loss += loss.mean() / FLAGS.accumulate
+                if M.apply_op is not None:
+                    # a step is accumulate batches, the rest runs once per step
+                    if counter % FLAGS.accumulate:
+                        continue
+                    sess.run(M.apply_op)
                 writer.add_summary(sum_str, gstep)
 
                 if gstep % 20 == 0:
@@ -201,7 +228,7 @@ def main():
 
                 if gstep % FLAGS.eval_every == 0:
 
-                    viter, vstep = prepare_data(FLAGS.batch_size, VFILE, shuffle=False, topk=FLAGS.topk)
+                    viter, vstep = prepare_data(FLAGS.batch_size, vdata, shuffle=False)
                     vrunning_acc = 0.0
                     vrunning_loss = 0.0
 
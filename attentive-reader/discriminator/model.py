@@ -1,23 +1,66 @@
 # /usr/bin/python
 import tensorflow as tf
 import numpy as np
+from utils import encode, GradientAccumulator
 
 
 class Base(object):
 
     def construct_intputs(self, batch_size, sequence_length):
+        # batch_size is kept for the signature, the batch dimension is open
         self.data = tf.placeholder(
-            tf.float32, [batch_size, sequence_length, 2], 'data')
-        self.d_len = tf.placeholder(tf.int32, [batch_size], 'd_len')
-        self.label = tf.placeholder(tf.int32, [batch_size, 3], 'label')
+            tf.float32, [None, sequence_length, 2], 'data')
+        self.d_len = tf.placeholder(tf.int32, [None], 'd_len')
+        self.label = tf.placeholder(tf.int32, [None, 3], 'label')
         self.global_step = tf.Variable(1, name='global_step', trainable=False)
 
-    def to_onehot(self, data, vocab_size):
+    def extract_final(self, hidden, seq_len):
+        """hidden: N, T, H, pick hidden[i, seq_len[i]-1] for every sample"""
+        with tf.name_scope('final_state'):
+            shape = tf.shape(hidden)
+            size = hidden.get_shape()[-1].value
+            flat = tf.reshape(hidden, [-1, size])  # N*T, H
+            idx = tf.range(shape[0]) * shape[1] + (seq_len - 1)
+            final = tf.gather(flat, idx)  # N, H
+        return final
+
+    def recurrent(self, inputs, hidden_size, num_layer, reuse=True, rnn_kernel='cell'):
+        """num_layer stacked LSTMs, with the kernel of shared/encoders.py"""
+        if rnn_kernel != 'cell':
+            return encode('LSTM', rnn_kernel, hidden_size, inputs, self.d_len,
+                          bidirectional=False, layers=num_layer)
+
+        if reuse:
+            self.cells = [tf.nn.rnn_cell.LSTMCell(
+                hidden_size, state_is_tuple=True)] * num_layer
+        else:
+            self.cells = [tf.nn.rnn_cell.LSTMCell(
+                hidden_size, state_is_tuple=True) for _ in range(num_layer)]
+
+        cell = tf.nn.rnn_cell.MultiRNNCell(self.cells, state_is_tuple=True)
+
+        return tf.nn.dynamic_rnn(
+            cell,
+            inputs,
+            sequence_length=self.d_len,
+            dtype=tf.float32,
+        )
+
+    def scaled_embedding(self, data, vocab_size, embed_size):
+        """
+        same as one_hot(wid) * ascore followed by a [vocab_size, embed_size]
+        linear layer, without building the N, sL, vocab_size one-hot tensor.
+        Ids out of [0, vocab_size) give zero rows, as their one-hot rows did
+        """
         wid, ascore = tf.unpack(data, axis=2)  # N, sL
         wid = tf.to_int32(wid)
-        self.one_hot = tf.one_hot(wid, vocab_size, axis=-1, name='one_hot')
+        in_vocab = tf.logical_and(wid >= 0, wid < vocab_size)
+        wid = tf.clip_by_value(wid, 0, vocab_size - 1)
+        ascore = ascore * tf.to_float(in_vocab)
+        self.emb = tf.get_variable('emb', [vocab_size, embed_size])
+        embed = tf.nn.embedding_lookup(self.emb, wid, name='embed')  # N, sL, E
         ascore = tf.expand_dims(ascore, dim=-1)
-        features = self.one_hot * ascore
+        features = embed * ascore
         return features
 
     def construct_loss_and_accuracy(self, score, label):
@@ -30,13 +73,25 @@ class Base(object):
         # optim = tf.train.GradientDescentOptimizer(learning_rate)
         self.optim = tf.train.AdamOptimizer(self.learning_rate)
 
-        self.gvs = self.optim.compute_gradients(self.loss)
+        self.raw_gvs = self.optim.compute_gradients(self.loss)
         with tf.name_scope('clip_norm'):
             self.gvs = [(tf.clip_by_norm(g, self.clip_norm), v)
-                        for g, v in self.gvs]
-
-        self.train_op = self.optim.apply_gradients(
-            self.gvs, global_step=self.global_step)
+                        for g, v in self.raw_gvs]
+
+        self.train_op = self.apply_gradients()
+
+    def apply_gradients(self):
+        """
+        the train op of gvs. With accumulate K it only adds up the unclipped
+        raw_gvs, apply_op applies their sum clipped after every K train_op
+        """
+        self.apply_op = None
+        if self.accumulate <= 1:
+            return self.optim.apply_gradients(self.gvs, global_step=self.global_step)
+        accumulator = GradientAccumulator(self.raw_gvs)
+        self.apply_op = accumulator.apply_op(
+            self.optim, lambda g: tf.clip_by_norm(g, self.clip_norm), self.global_step)
+        return accumulator.accumulate_op(name='train_op')
 
     def _construct_accuracy(self, score, label):
         self.prediction = tf.argmax(score, 1, name='prediction')
@@ -101,9 +156,9 @@ class Sigmoid(Base):
 
     def construct_intputs(self, batch_size, sequence_length):
         self.data = tf.placeholder(
-            tf.float32, [batch_size, sequence_length, 2], 'data')
-        self.d_len = tf.placeholder(tf.int32, [batch_size], 'd_len')
-        self.label = tf.placeholder(tf.float32, [batch_size, 1], 'label')
+            tf.float32, [None, sequence_length, 2], 'data')
+        self.d_len = tf.placeholder(tf.int32, [None], 'd_len')
+        self.label = tf.placeholder(tf.float32, [None, 1], 'label')
         self.global_step = tf.Variable(1, name='global_step', trainable=False)
 
     def _construct_loss(self, score, label):
@@ -112,13 +167,12 @@ class Sigmoid(Base):
         # optim = tf.train.GradientDescentOptimizer(learning_rate)
         self.optim = tf.train.AdamOptimizer(self.learning_rate)
 
-        self.gvs = self.optim.compute_gradients(self.loss)
+        self.raw_gvs = self.optim.compute_gradients(self.loss)
         with tf.name_scope('clip_norm'):
             self.gvs = [(tf.clip_by_norm(g, self.clip_norm), v)
-                        for g, v in self.gvs]
+                        for g, v in self.raw_gvs]
 
-        self.train_op = self.optim.apply_gradients(
-            self.gvs, global_step=self.global_step)
+        self.train_op = self.apply_gradients()
 
     def _construct_accuracy(self, score, label):
         self.prediction = tf.greater(score, 0, name='prediction')
@@ -154,46 +208,23 @@ class RNN(Sigmoid):
                  num_layer=2,
                  sequence_length=1000,
                  clip_norm=6,
-                 reuse=True):
+                 reuse=True,
+                 rnn_kernel='cell',
+                 accumulate=1):
 
         self.construct_intputs(batch_size, sequence_length)
 
         self.clip_norm = clip_norm
+        self.accumulate = accumulate
         self.learning_rate = learning_rate
 
-        if reuse:
-            self.cells = [tf.nn.rnn_cell.LSTMCell(
-                hidden_size, state_is_tuple=True)] * num_layer
-        else:
-            self.cells = [tf.nn.rnn_cell.LSTMCell(
-                hidden_size, state_is_tuple=True) for _ in range(num_layer)]
+        self.hidden, last_state = self.recurrent(
+            self.data, hidden_size, num_layer, reuse, rnn_kernel)
 
-        cell = tf.nn.rnn_cell.MultiRNNCell(self.cells, state_is_tuple=True)
-
-        self.hidden, last_state = tf.nn.dynamic_rnn(
-            cell,
-            self.data,
-            sequence_length=self.d_len,
-            dtype=tf.float32,
-        )
-
-        with tf.name_scope('final_state'):
-            unpack = tf.unpack(self.hidden, axis=0)
-            begins = tf.pack(
-                [self.d_len - 1, tf.zeros([batch_size], dtype=tf.int32)], axis=1)  # N, 2
-            begins = tf.unpack(begins)
-            final_state = []
-            for h, b in zip(unpack, begins):
-                f = tf.slice(h, b, [1, hidden_size])
-                # print f.get_shape()x
-                final_state.append(f)
-
-            final = tf.pack(final_state)
-
-            self.final = tf.squeeze(final_state, [1])
+        self.final = self.extract_final(self.hidden, self.d_len)
 
         self.final_sparsity = tf.nn.zero_fraction(
-            final, name='final_hidden_sparsity')
+            self.final, name='final_hidden_sparsity')
         # self.final_relu = tf.nn.relu(self.final, name='final_relu')
 
         W = tf.get_variable('W', [hidden_size, 1], dtype=tf.float32)
@@ -209,50 +240,26 @@ class One_Hot(Sigmoid):
                  sequence_length=1000,
                  clip_norm=6,
                  vocab_size=574,
-                 reuse=True):
+                 reuse=True,
+                 rnn_kernel='cell',
+                 accumulate=1):
 
         self.construct_intputs(batch_size, sequence_length)
 
         self.learning_rate = learning_rate
         self.clip_norm = clip_norm
+        self.accumulate = accumulate
 
-        wid, ascore = tf.unpack(self.data, axis=2)  # N, sL
-        wid = tf.to_int32(wid)
-        self.one_hot = tf.one_hot(wid, vocab_size, axis=-1, name='one_hot')
-        ascore = tf.expand_dims(ascore, dim=-1)
-        self.features = self.one_hot * ascore
+        self.features = self.scaled_embedding(
+            self.data, vocab_size, hidden_size)
 
-        if reuse:
-            self.cells = [tf.nn.rnn_cell.LSTMCell(
-                hidden_size, state_is_tuple=True)] * num_layer
-        else:
-            self.cells = [tf.nn.rnn_cell.LSTMCell(
-                hidden_size, state_is_tuple=True) for _ in range(num_layer)]
-
-        cell = tf.nn.rnn_cell.MultiRNNCell(self.cells, state_is_tuple=True)
-
-        self.hidden, last_state = tf.nn.dynamic_rnn(
-            cell,
-            self.features,
-            sequence_length=self.d_len,
-            dtype=tf.float32,
-        )
+        self.hidden, last_state = self.recurrent(
+            self.features, hidden_size, num_layer, reuse, rnn_kernel)
 
-        with tf.name_scope('final_state'):
-            unpack = tf.unpack(self.hidden, axis=0)
-            begins = tf.pack(
-                [self.d_len - 1, tf.zeros([batch_size], dtype=tf.int32)], axis=1)  # N, 2
-            begins = tf.unpack(begins)
-            final_state = []
-            for h, b in zip(unpack, begins):
-                f = tf.slice(h, b, [1, hidden_size])
-                final_state.append(f)
-
-            final = tf.pack(final_state)
-            self.final = tf.squeeze(final_state, [1])
+        self.final = self.extract_final(self.hidden, self.d_len)
 
         self.final_sparsity = tf.nn.zero_fraction(
-            final, name='final_hidden_sparsity')
+            self.final, name='final_hidden_sparsity')
         self.final_relu = tf.nn.relu(self.final, name='final_relu')
 
         W = tf.get_variable('W', [hidden_size, 1], dtype=tf.float32)
@@ -272,10 +279,12 @@ class CNN(Sigmoid):
                  clip_norm=6,
                  vocab_size=50003,
                  window_size=10,
-                 reuse=True):
+                 reuse=True,
+                 accumulate=1):
 
         self.learning_rate = learning_rate
         self.clip_norm = clip_norm
+        self.accumulate = accumulate
 
         self.construct_intputs(batch_size, sequence_length)
 
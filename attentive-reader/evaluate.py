@@ -1,9 +1,12 @@
 #! /usr/bin/python
 import os
+import time
+import hashlib
 import tensorflow as tf
 from glob import glob
 import pickle
-from utils import data_to_token_ids, define_gpu
+from utils import data_to_token_ids, define_resources, DocCache, doc_key
+from export import load_frozen, find_tensor, SCORE_NAMES
 import json
 import numpy as np
 # from attentive_model import AttentiveReader
@@ -51,10 +54,8 @@ def eval_iter(flist, max_nstep, max_query_step, batch_size, vocab):
     for s in range(steps):
         head = s * batch_size
         end = (s + 1) * batch_size
-        if end <= len(flist):
-            files = flist[head:end]
-        else:
-            files = flist[head:] + flist[:end - len(flist)]
+        files = flist[head:end]
+        n = len(files)
 
         y.fill(0)
         ds.fill(0)
@@ -85,7 +86,15 @@ def eval_iter(flist, max_nstep, max_query_step, batch_size, vocab):
 
             y[idx][int(answer)] = 1
 
-        yield s, ds, d_length, qs, q_length, y
+        yield s, ds[:n], d_length[:n], qs[:n], q_length[:n], y[:n]
+
+
+def group_by_document(flist):
+    """flist reordered so that questions on the same story are adjacent"""
+    def story(fname):
+        with open(fname, 'r') as f:
+            return hashlib.md5(f.read().split('\n')[2]).hexdigest()
+    return sorted(flist, key=story)
 
 
 def dig_tensors(graph, targ=TensorName, _map=name_attr_map):
@@ -98,6 +107,27 @@ def dig_tensors(graph, targ=TensorName, _map=name_attr_map):
     return tr
 
 
+def frozen_tensors(graph):
+    """
+    tensors of a frozen graph written by export.py. It only keeps the
+    inputs, score and attention, so loss and accuracy are rebuilt on top
+    """
+    get = lambda name: graph.get_tensor_by_name(name + ':0')
+    score = find_tensor(graph, SCORE_NAMES)
+    with graph.as_default():
+        # graphs trained in float16 have a float16 score
+        score = tf.cast(score, tf.float32)
+        y = tf.placeholder(tf.float32, score.get_shape(), name='Y')
+        loss = tf.nn.softmax_cross_entropy_with_logits(score, y, name='loss')
+        correct = tf.equal(tf.argmax(y, 1), tf.argmax(score, 1))
+        accuracy = tf.reduce_mean(tf.cast(correct, "float"), name='accuracy')
+
+    return Tensor(loss=loss, accuracy=accuracy, attention=get('attention'),
+                  query=get('query'), document=get('document'),
+                  d_end=get('docu-end'), q_end=get('quer-end'),
+                  y=y, dropout=None, score=score)
+
+
 def choose_ckpt(ckpt_dir):
     ck = tf.train.get_checkpoint_state(ckpt_dir)
     ckfiles = ck.all_model_checkpoint_paths[::-1]
@@ -152,8 +182,9 @@ def step(data, M, sess, fetch):
             M.d_end: d_end,
             M.q_end: q_end,
             M.y: y,
-            M.dropout: 1.0,
             }
+    if M.dropout is not None:
+        feed[M.dropout] = 1.0
     return sess.run(fetch, feed)
 
 
@@ -302,10 +333,75 @@ def test_on(_iter, M, sess, fix_attention=False, pure=False):
             break
 
 
+def document_tensors(graph):
+    """
+    query independent tensors fed from a document cache: d_t, the
+    projected keys d_t * W_ym of the concat attention and the document
+    embeddings read out by StanfordReader2, if the graph has them
+    """
+    tensors = [graph.get_tensor_by_name('d_t:0')]
+    for name in ('doc_keys:0', 'doc_embed:0'):
+        try:
+            tensors.append(graph.get_tensor_by_name(name))
+        except KeyError:
+            pass
+    return tensors
+
+
+def cached_test_on(_iter, M, doc_tensors, sess, cache):
+    """
+    test_on with the document side run once per story: doc_tensors are fed
+    from cache, so only the query encoder and the attention run per question
+    """
+    running_acc = 0.0
+    running_loss = 0.0
+    counter = 0
+    encode_time = 0.0
+    query_time = 0.0
+    questions = 0
+
+    for data in _iter:
+        counter += 1
+        sys.stdout.write('\r%d' % counter)
+        idx, doc, d_end, que, q_end, y = data
+        keys = [doc_key(doc[i, :d_end[i]]) for i in range(doc.shape[0])]
+
+        def encode(rows):
+            feed = {M.document: doc[rows], M.d_end: d_end[rows]}
+            if M.dropout is not None:
+                feed[M.dropout] = 1.0
+            return sess.run(doc_tensors, feed)
+
+        start = time.time()
+        feed = dict(zip(doc_tensors, cache.lookup(keys, encode)))
+        encode_time += time.time() - start
+
+        feed.update({M.query: que,
+                     M.q_end: q_end,
+                     M.y: y,
+                     })
+        if M.dropout is not None:
+            feed[M.dropout] = 1.0
+        start = time.time()
+        accuracy, loss = sess.run([M.accuracy, M.loss], feed)
+        query_time += time.time() - start
+        questions += que.shape[0]
+        running_loss += loss.mean()
+        running_acc += accuracy
+
+    counter = max(counter, 1)
+    print
+    print 'Overall Loss: %.8f, Overall Accuracy: %.8f' % \
+        (running_loss / counter, running_acc / counter)
+    print '  Document cache hit rate %.4f (%d hits, %d encoded)' % \
+        (cache.hit_rate, cache.hits, cache.misses)
+    print '  %.2fms per encoded document, %.2fms per additional question' % \
+        (1000 * encode_time / max(cache.misses, 1), 1000 * query_time / max(questions, 1))
+
+
 def main(FLAGS):
-    # l = define_gpu(1)
-    # print 'Using GPU %d' % l[0]
-    os.environ['CUDA_VISIBLE_DEVICES'] = str(FLAGS.gpu)
+    config, plan = define_resources(FLAGS.threads, FLAGS.inter_threads,
+                                    jobs=FLAGS.jobs, pin=FLAGS.pin)
 
     # get data
     test_path = os.path.join(
@@ -329,8 +425,45 @@ def main(FLAGS):
         TensorName.remove('attention')
 
 
+    def run_on_data(M, sess):
+        # test dataset
+        test_iter = eval_iter(test_files, max_nsteps,
+                              max_query_length, batch_size, vocab)
+        test_step = test_iter.next()
+        print 'Running on Test data'
+        test_on(test_iter, M, sess, pure=FLAGS.pure)
+
+        # validate dataset
+        validate_iter = eval_iter(
+            validate_files, max_nsteps, max_query_length, batch_size, vocab)
+        validate_step = validate_iter.next()
+        print 'Running on Validate data'
+        start = time.time()
+        test_on(validate_iter, M, sess, pure=FLAGS.pure)
+        plain = time.time() - start
+
+        if FLAGS.doc_cache:
+            # cached encodings belong to one checkpoint
+            doc_tensors = document_tensors(sess.graph)
+            cache = DocCache(max(FLAGS.doc_cache, batch_size))
+            validate_iter = eval_iter(group_by_document(validate_files), max_nsteps,
+                                      max_query_length, batch_size, vocab)
+            validate_step = validate_iter.next()
+            print 'Running on Validate data with document cache'
+            start = time.time()
+            cached_test_on(validate_iter, M, doc_tensors, sess, cache)
+            cached = time.time() - start
+            print '  %.2fs without cache, %.2fs with, speedup %.2fx' % \
+                (plain, cached, plain / cached)
+
     # eval
-    with tf.Session() as sess:
+    with tf.Session(config=config) as sess:
+
+        if FLAGS.load_path.endswith('.pb'):
+            load_frozen(FLAGS.load_path, sess.graph)
+            print 'Frozen graph imported'
+            run_on_data(frozen_tensors(sess.graph), sess)
+            return
 
         if os.path.isdir(FLAGS.load_path):
             ckfiles = choose_ckpt(os.path.join(FLAGS.load_path, 'ckpts'))
@@ -347,34 +480,25 @@ def main(FLAGS):
             saver.restore(sess, fname)
 
             M = dig_tensors(sess.graph, targ=TensorName)
-
-            # test dataset
-            test_iter = eval_iter(test_files, max_nsteps,
-                                  max_query_length, batch_size, vocab)
-            test_step = test_iter.next()
-            print 'Running on Test data'
-            test_on(test_iter, M, sess, pure=FLAGS.pure)
-
-            # validate dataset
-            validate_iter = eval_iter(
-                validate_files, max_nsteps, max_query_length, batch_size, vocab)
-            validate_step = validate_iter.next()
-            print 'Running on Validate data'
-            test_on(validate_iter, M, sess, pure=FLAGS.pure)
+            run_on_data(M, sess)
 
 
 if __name__ == '__main__':
 
     flags = tf.app.flags
     flags.DEFINE_integer("data_size", None, "")
-    flags.DEFINE_integer("gpu", 0, "")
+    flags.DEFINE_integer("threads", 0, "Intra op threads, 0 takes a share of the idle cores")
+    flags.DEFINE_integer("inter_threads", 0, "Inter op threads, 0 uses one per socket")
+    flags.DEFINE_integer("jobs", 1, "Number of jobs sharing the idle cores of this box")
+    flags.DEFINE_boolean("pin", False, "Pin the process to the planned cores")
 
     flags.DEFINE_string("data_dir", "data",
                         "The name of data directory [data]")
     flags.DEFINE_string("dataset", "cnn", "The name of dataset")
-    flags.DEFINE_string("load_path", None, "The path to old model. [None]")
+    flags.DEFINE_string("load_path", None, "The path to old model or a frozen .pb [None]")
 
     flags.DEFINE_boolean("pure", True, "")
+    flags.DEFINE_integer("doc_cache", 0, "Also evaluate with an LRU of this many encoded documents")
     FLAGS = flags.FLAGS
 
     if os.path.isdir(FLAGS.load_path):
@@ -0,0 +1,340 @@
+#! /usr/bin/python
+"""
+Export a trained reader as a frozen inference graph.
+
+Variables become constants, and the optimizer, summaries, gradient clipping
+and dropout are stripped, keeping only
+    document, query, docu-end, quer-end -> score, attention
+
+    ./export.py --load_path log/12_10_02_29
+writes log/12_10_02_29/export/frozen.pb
+
+    ./export.py --load_path log/12_10_02_29 --quantize int8 --report
+also stores the embedding as per-row int8 and the output projection as int8
+(or fp16), then compares accuracy, latency and memory with the float graph
+on the validation set. Every graph is measured in a process of its own, as
+the resident memory of one that ran a graph does not go back down
+"""
+import os
+import sys
+import json
+import time
+import subprocess
+import numpy as np
+import tensorflow as tf
+from tensorflow.python.framework import graph_util, tensor_util
+from utils import fetch_files, data_iter, rss_mb, peak_mb
+
+INPUT_NAMES = ['document', 'query', 'docu-end', 'quer-end']
+SCORE_NAMES = ['score', 'g_x_W']
+ATTENTION_NAME = 'attention'
+
+EMBED_NAMES = ['emb']
+OUTPUT_NAMES = ['W_g', 'W_pred', 'W']
+
+
+def _node_name(inp):
+    return inp.lstrip('^').split(':')[0]
+
+
+def find_tensor(graph, names):
+    """first tensor of names which exists in graph"""
+    for name in names:
+        try:
+            return graph.get_tensor_by_name(name + ':0')
+        except KeyError:
+            continue
+    raise KeyError(names)
+
+
+def output_names(graph_def):
+    names = set(n.name for n in graph_def.node)
+    score = [_ for _ in SCORE_NAMES if _ in names]
+    assert len(score) > 0, 'no score node in %s' % SCORE_NAMES
+    return [score[0], ATTENTION_NAME]
+
+
+def strip_dropout(graph_def):
+    """
+    rewire the consumers of every tf.nn.dropout output to its input.
+    dropout computes x / keep_prob * mask inside a `dropout*` name scope
+    """
+    nodes = {n.name: n for n in graph_def.node}
+    bypass = {}
+    for n in graph_def.node:
+        scope, _, op = n.name.rpartition('/')
+        if op == 'mul' and scope.split('/')[-1].startswith('dropout'):
+            div = nodes.get(scope + '/div')
+            if div is not None:
+                bypass[n.name] = div.input[0]
+
+    for n in graph_def.node:
+        for i, inp in enumerate(n.input):
+            name = _node_name(inp)
+            if name in bypass and not inp.startswith('^'):
+                n.input[i] = bypass[name]
+    return graph_def
+
+
+def freeze(sess, graph_def=None):
+    """frozen and pruned GraphDef of the reader restored in sess"""
+    if graph_def is None:
+        graph_def = sess.graph.as_graph_def()
+    outputs = output_names(graph_def)
+    frozen = graph_util.convert_variables_to_constants(sess, graph_def, outputs)
+    frozen = strip_dropout(frozen)
+    frozen = graph_util.extract_sub_graph(frozen, outputs)
+    return frozen, outputs
+
+
+def _const(name, value):
+    node = tf.NodeDef()
+    node.op = 'Const'
+    node.name = name
+    node.attr['dtype'].type = tf.as_dtype(value.dtype).as_datatype_enum
+    node.attr['value'].tensor.CopyFrom(tensor_util.make_tensor_proto(value))
+    return node
+
+
+def _cast(name, x, src, dst, node=None):
+    if node is None:
+        node = tf.NodeDef()
+    node.Clear()
+    node.op = 'Cast'
+    node.name = name
+    node.input.extend([x])
+    node.attr['SrcT'].type = src.as_datatype_enum
+    node.attr['DstT'].type = dst.as_datatype_enum
+    return node
+
+
+def _mul(name, x, y, node=None):
+    if node is None:
+        node = tf.NodeDef()
+    node.Clear()
+    node.op = 'Mul'
+    node.name = name
+    node.input.extend([x, y])
+    node.attr['T'].type = tf.float32.as_datatype_enum
+    return node
+
+
+def _gather(name, params, ids, src, tindices):
+    node = tf.NodeDef()
+    node.op = 'Gather'
+    node.name = name
+    node.input.extend([params, ids])
+    node.attr['Tparams'].type = src.as_datatype_enum
+    node.attr['Tindices'].CopyFrom(tindices)
+    node.attr['validate_indices'].b = True
+    return node
+
+
+def quantize_int8(w, axis):
+    """symmetric int8 with one scale per slice along axis"""
+    scale = np.abs(w).max(axis=axis, keepdims=True) / 127.0
+    scale[scale == 0] = 1.0
+    q = np.round(w / scale).clip(-127, 127).astype(np.int8)
+    return q, scale.astype(np.float32)
+
+
+def quantize(graph_def, outputs, out_type='int8'):
+    """
+    rewrite the float constants of a frozen reader:
+    embeddings become per-row int8, gathers look up int8 rows and only
+    dequantize the rows they read. Output projections become fp16 or
+    per-column int8 and are cast back to float where they are used.
+    """
+    nodes = {n.name: n for n in graph_def.node}
+    value = lambda n: tensor_util.MakeNdarray(n.attr['value'].tensor)
+    new = []
+
+    for name in EMBED_NAMES:
+        if name not in nodes or nodes[name].op != 'Const':
+            continue
+        q, scale = quantize_int8(value(nodes[name]), axis=1)
+        new += [_const(name + '/q', q), _const(name + '/scale', scale)]
+        # dense fallback, pruned if nothing but gathers reads it
+        _mul(name, name + '/dense', name + '/scale', node=nodes[name])
+        new.append(_cast(name + '/dense', name + '/q', tf.int8, tf.float32))
+
+        params = set([name, name + '/read'])
+        for n in graph_def.node:
+            if n.op != 'Gather' or _node_name(n.input[0]) not in params:
+                continue
+            ids, tindices = n.input[1], n.attr['Tindices']
+            new += [_gather(n.name + '/q', name + '/q', ids, tf.int8, tindices),
+                    _gather(n.name + '/scale', name + '/scale', ids, tf.float32, tindices),
+                    _cast(n.name + '/cast', n.name + '/q', tf.int8, tf.float32)]
+            _mul(n.name, n.name + '/cast', n.name + '/scale', node=n)
+
+    for name in OUTPUT_NAMES:
+        if name not in nodes or nodes[name].op != 'Const':
+            continue
+        w = value(nodes[name])
+        if out_type == 'fp16':
+            new.append(_const(name + '/half', w.astype(np.float16)))
+            _cast(name, name + '/half', tf.float16, tf.float32, node=nodes[name])
+        elif out_type == 'int8':
+            q, scale = quantize_int8(w, axis=0)
+            new += [_const(name + '/q', q), _const(name + '/scale', scale),
+                    _cast(name + '/dense', name + '/q', tf.int8, tf.float32)]
+            _mul(name, name + '/dense', name + '/scale', node=nodes[name])
+        else:
+            raise ValueError(out_type)
+
+    graph_def.node.extend(new)
+    return graph_util.extract_sub_graph(graph_def, outputs)
+
+
+def measure(graph_def, batches):
+    """
+    accuracy, mean seconds per batch, and the resident MB graph_def added
+    and the peak MB of this process. Only meaningful in a fresh process
+    """
+    graph = tf.Graph()
+    before = rss_mb()
+    with graph.as_default():
+        tf.import_graph_def(graph_def, name='')
+    sess = tf.Session(graph=graph)
+    score = find_tensor(graph, SCORE_NAMES)
+    feeds = [graph.get_tensor_by_name(_ + ':0') for _ in INPUT_NAMES]
+
+    correct = 0.0
+    count = 0
+    elapsed = 0.0
+    for data in batches:
+        batch_idx, docs, d_end, queries, q_end, y = data
+        start = time.time()
+        pred = sess.run(score, dict(zip(feeds, [docs, queries, d_end, q_end])))
+        elapsed += time.time() - start
+        correct += (pred.argmax(1) == y.argmax(1)).sum()
+        count += y.shape[0]
+    rss = rss_mb() - before
+    sess.close()
+    return correct / max(count, 1), elapsed / max(len(batches), 1), rss, peak_mb()
+
+
+def measured(fname):
+    """measure of the frozen graph in fname, run in a fresh process"""
+    argv = [a for a in sys.argv if not a.startswith('--measure')]
+    out = subprocess.check_output([sys.executable] + argv + ['--measure=%s' % fname])
+    return json.loads(out.strip().splitlines()[-1])
+
+
+def report(float_path, quant_path):
+    f, q = measured(float_path), measured(quant_path)
+    size = lambda path: os.path.getsize(path) / 1e6
+    print '          accuracy   ms/batch    RSS MB   peak MB   graph MB'
+    for name, r, path in (('float', f, float_path), ('quant', q, quant_path)):
+        print '  %s   %.6f %10.2f %9.1f %9.1f %10.1f' % (
+            name, r['accuracy'], r['latency'] * 1000, r['rss_mb'], r['peak_mb'], size(path))
+    print '  delta   %+.6f %+10.2f %+9.1f %+9.1f %+10.1f' % (
+        q['accuracy'] - f['accuracy'], (q['latency'] - f['latency']) * 1000,
+        q['rss_mb'] - f['rss_mb'], q['peak_mb'] - f['peak_mb'],
+        size(quant_path) - size(float_path))
+
+
+def validation_batches(log_dir):
+    """the validation batches of --data_size files, as the run in log_dir read them"""
+    with open(os.path.join(log_dir, 'Flags.js'), 'r') as f:
+        old_flag = json.load(f)
+    vocab_size = old_flag['vocab_size']
+    _, validate_files = fetch_files(FLAGS.data_dir, FLAGS.dataset, vocab_size)
+    if FLAGS.data_size:
+        validate_files = validate_files[:FLAGS.data_size]
+    viter = data_iter(validate_files, 1000, 20, batch_size=old_flag['batch_size'],
+                      vocab_size=vocab_size, shuffle_data=False)
+    viter.next()
+    # data_iter refills the same arrays for every batch
+    return [tuple(np.array(a) if isinstance(a, np.ndarray) else a for a in b)
+            for b in viter]
+
+
+def load_frozen(fname, graph=None):
+    """import a frozen reader into graph, keeping the original tensor names"""
+    graph_def = tf.GraphDef()
+    with open(fname, 'rb') as f:
+        graph_def.ParseFromString(f.read())
+    if graph is None:
+        graph = tf.get_default_graph()
+    with graph.as_default():
+        tf.import_graph_def(graph_def, name='')
+    return graph
+
+
+def main(_):
+    if os.path.isdir(FLAGS.load_path):
+        log_dir = FLAGS.load_path
+        fname = tf.train.latest_checkpoint(os.path.join(log_dir, 'ckpts'))
+        assert fname is not None
+    else:
+        fname = FLAGS.load_path
+        log_dir = os.path.abspath(os.path.join(fname, '../..'))
+
+    if FLAGS.measure:
+        graph_def = tf.GraphDef()
+        with open(FLAGS.measure, 'rb') as f:
+            graph_def.ParseFromString(f.read())
+        accuracy, latency, rss, peak = measure(graph_def, validation_batches(log_dir))
+        print json.dumps({'accuracy': accuracy, 'latency': latency,
+                          'rss_mb': rss, 'peak_mb': peak})
+        return
+
+    out_dir = FLAGS.output_dir or os.path.join(log_dir, 'export')
+    if not os.path.exists(out_dir):
+        os.makedirs(out_dir)
+
+    with tf.Session() as sess:
+        saver = tf.train.import_meta_graph(fname + '.meta')
+        saver.restore(sess, fname)
+        graph_def = sess.graph.as_graph_def()
+        print ' [*] Restored %s, %d nodes' % (fname, len(graph_def.node))
+
+        start = time.time()
+        frozen, outputs = freeze(sess, graph_def)
+        print ' [*] Frozen to %d nodes in %4.4f' % (len(frozen.node), time.time() - start)
+
+    float_def = frozen
+    if FLAGS.quantize:
+        frozen = tf.GraphDef()
+        frozen.CopyFrom(float_def)
+        frozen = quantize(frozen, outputs, FLAGS.quantize)
+        print ' [*] Quantized embedding to int8, output to %s' % FLAGS.quantize
+
+    tf.train.write_graph(frozen, out_dir, FLAGS.name, as_text=False)
+    with open(os.path.join(out_dir, FLAGS.name + '.js'), 'w') as f:
+        json.dump({'checkpoint': fname, 'inputs': INPUT_NAMES,
+                   'outputs': outputs, 'quantize': FLAGS.quantize}, f, indent=4)
+
+    path = os.path.join(out_dir, FLAGS.name)
+    ckpt_files = [fname] + tf.gfile.Glob(fname + '.*')
+    ckpt_size = sum(os.path.getsize(_) for _ in ckpt_files
+                    if os.path.exists(_) and not _.endswith('.meta'))
+    print ' [*] Checkpoint %.1fMB -> %s %.1fMB' % (
+        ckpt_size / 1e6, path, os.path.getsize(path) / 1e6)
+
+    if FLAGS.quantize and FLAGS.report:
+        float_name = FLAGS.name + '.float'
+        tf.train.write_graph(float_def, out_dir, float_name, as_text=False)
+        print ' [*] Comparing on the validation set, every graph in a process of its own'
+        try:
+            report(os.path.join(out_dir, float_name), path)
+        finally:
+            os.remove(os.path.join(out_dir, float_name))
+
+
+if __name__ == '__main__':
+    flags = tf.app.flags
+    flags.DEFINE_string("load_path", None, "Log dir or checkpoint to export")
+    flags.DEFINE_string("output_dir", None, "Defaults to <log_dir>/export")
+    flags.DEFINE_string("name", "frozen.pb", "File name of the frozen graph")
+    flags.DEFINE_string("quantize", None, "Store the output projection as fp16 or int8, embedding as int8")
+    flags.DEFINE_boolean("report", False, "Compare the quantized graph with the float one")
+    flags.DEFINE_string("data_dir", "data", "The name of data directory [data]")
+    flags.DEFINE_string("dataset", "cnn", "The name of dataset")
+    flags.DEFINE_integer("data_size", 3000, "Number of validation files to compare on")
+    flags.DEFINE_string("measure", None, "Measure this frozen graph and print the results")
+    FLAGS = flags.FLAGS
+
+    tf.app.run()
@@ -1,15 +1,20 @@
 #! /usr/bin/python
 import os
+import sys
 import tensorflow as tf
 import time
 import json
-from utils import pp, define_gpu
+from utils import pp, define_resources, reserve_cores, launch_validator, stop_validator
+from cluster import launch, start_server, worker_device
 
 flags = tf.app.flags
 flags.DEFINE_integer("epoch", 15, "Epoch to train [40]")
 flags.DEFINE_integer("vocab_size", 50003, "The size of vocabulary [10000]")
 flags.DEFINE_integer("batch_size", 128, "The size of batch images [32]")
-flags.DEFINE_integer("gpu", 1, "the number of gpus to use")
+flags.DEFINE_integer("threads", 0, "Intra op threads, 0 takes a share of the idle cores")
+flags.DEFINE_integer("inter_threads", 0, "Inter op threads, 0 uses one per socket")
+flags.DEFINE_integer("jobs", 1, "Number of jobs sharing the idle cores of this box")
+flags.DEFINE_boolean("pin", False, "Pin the process to the planned cores")
 flags.DEFINE_integer("data_size", None, "Number of files to train on")
 flags.DEFINE_integer("hidden_size", 256, "Hidden dimension for rnn and fully connected layer")
 flags.DEFINE_integer("eval_every", 500, "Eval every step")
@@ -28,6 +33,26 @@ flags.DEFINE_string("attention", "bilinear", "Attention Mechanism")
 flags.DEFINE_string("model", "attentive", "model")
 flags.DEFINE_string("activation", 'tanh', "The the last activation layer to use before Softmax loss")
 flags.DEFINE_bool("bidirect", True, "Whether use bidirection rnn")
+flags.DEFINE_string("precision", "float32", "float32, or float16 activations with float32 master weights")
+flags.DEFINE_float("loss_scale", 128.0, "Loss scale used with float16")
+flags.DEFINE_boolean("sparse_grads", True, "Clip and update only the looked up embedding rows")
+flags.DEFINE_string("rnn_kernel", "cell", "RNN implementation: cell, block or fused")
+flags.DEFINE_string("rnn_memory", "keep", "RNN activations for backprop: keep, swap to host or recompute")
+flags.DEFINE_integer("rnn_segment", 50, "Steps recomputed at once with --rnn_memory recompute")
+flags.DEFINE_integer("towers", 1, "Number of data parallel towers in one graph")
+flags.DEFINE_integer("accumulate", 1, "Apply the summed gradients of that many batches at once")
+flags.DEFINE_integer("workers", 1, "Number of worker processes sharing one local parameter server")
+flags.DEFINE_integer("ps_port", 2222, "Port of the parameter server, workers use the next ones")
+flags.DEFINE_string("graph_cache", None, "Directory of built graphs, reused by runs with the same architecture")
+flags.DEFINE_string("profile_steps", None, "Trace these training steps, e.g. 100-110")
+flags.DEFINE_integer("monitor_every", 10, "Check the gradient norms every that many steps, 0 never")
+flags.DEFINE_boolean("background_save", True, "Write checkpoints on a background thread")
+flags.DEFINE_integer("snapshot_every", 0, "Also write weights only snapshots every that many steps, 0 never")
+flags.DEFINE_integer("validator", 0, "Cores of a process validating the checkpoints, 0 validates inline")
+flags.DEFINE_string("follow", None, "Validate the checkpoints of this log dir as they are written")
+flags.DEFINE_integer("validate_mb", 256, "Memory cap of the validation set, a fixed smaller sample beyond it, 0 no cap")
+flags.DEFINE_string("job_name", None, "ps or worker, set by the launcher")
+flags.DEFINE_integer("task_index", 0, "Index of this worker, set by the launcher")
 
 FLAGS = flags.FLAGS
 
@@ -50,39 +75,106 @@ def fetch_model(_type):
   return Reader
 
 
+def create_model(towers=1):
+  reader = fetch_model(FLAGS.model)
+  return reader(batch_size=FLAGS.batch_size, l2_rate=FLAGS.l2_rate,
+                vocab_size=FLAGS.vocab_size,
+                momentum=FLAGS.momentum, decay=FLAGS.decay,
+                size=FLAGS.hidden_size,
+                use_optimizer=FLAGS.optim,
+                activation=FLAGS.activation,
+                attention=FLAGS.attention,
+                D=FLAGS.D,
+                bidirection=FLAGS.bidirect,
+                precision=FLAGS.precision,
+                loss_scale=FLAGS.loss_scale,
+                towers=towers,
+                sparse_grads=FLAGS.sparse_grads,
+                rnn_kernel=FLAGS.rnn_kernel,
+                rnn_memory=FLAGS.rnn_memory,
+                rnn_segment=FLAGS.rnn_segment,
+                accumulate=FLAGS.accumulate)
+
+
 def main(_):
   pp.pprint(flags.FLAGS.__flags)
 
-  if FLAGS.gpu is not None:
-    gpu_list  = define_gpu(FLAGS.gpu)
-    os.environ['CUDA_VISIBLE_DEVICES']= ",".join(map(str,gpu_list))
+  if FLAGS.follow:
+    # a launched follower is already pinned to its cores
+    config, plan = define_resources(FLAGS.threads, FLAGS.inter_threads, pin=FLAGS.pin)
+    with tf.Session(config=config) as sess:
+      model = create_model()
+      model.follow(sess, FLAGS.follow, FLAGS.data_dir, FLAGS.dataset,
+                   FLAGS.data_size, validate_mb=FLAGS.validate_mb)
+    return
+
+  if FLAGS.accumulate > 1 and FLAGS.workers > 1:
+    # the accumulators would live on the parameter server, shared by every worker
+    raise ValueError('--accumulate does not work with --workers, use --towers')
 
-  log_dir = "%s/%s"%(FLAGS.log_dir, time.strftime("%m_%d_%H_%M"))
-  if not os.path.exists(log_dir):
-    os.makedirs(log_dir)
-    with open(log_dir+'/Flags.js','w') as f:
-      json.dump(FLAGS.__flags, f, indent=4)
+  if FLAGS.job_name == 'ps':
+    cluster, server = start_server('ps', 0, FLAGS.workers, FLAGS.ps_port)
+    server.join()
+    return
+
+  reserved = ()
+  validator = None
+  if FLAGS.job_name == 'worker':
+    # created by the launcher
+    log_dir = FLAGS.log_dir
   else:
-    print('log_dir exist %s' % log_dir)
-    exit(2)
-
-
-  with tf.Session() as sess:
-    reader = fetch_model(FLAGS.model)
-    model = reader(batch_size=FLAGS.batch_size, l2_rate=FLAGS.l2_rate,
-                                    vocab_size=FLAGS.vocab_size, 
-                                    momentum=FLAGS.momentum, decay=FLAGS.decay,
-                                    size=FLAGS.hidden_size,
-                                    use_optimizer=FLAGS.optim,
-                                    activation=FLAGS.activation,
-                                    attention=FLAGS.attention,
-                                    D=FLAGS.D,
-                                    bidirection=FLAGS.bidirect)
-    print " [*] Using GPU: ", str(gpu_list)
+    log_dir = "%s/%s"%(FLAGS.log_dir, time.strftime("%m_%d_%H_%M"))
+    if not os.path.exists(log_dir):
+      os.makedirs(log_dir)
+      with open(log_dir+'/Flags.js','w') as f:
+        json.dump(FLAGS.__flags, f, indent=4)
+    else:
+      print('log_dir exist %s' % log_dir)
+      exit(2)
+
+    if FLAGS.validator:
+      reserved = reserve_cores(FLAGS.validator)
+      validator = launch_validator(sys.argv + ['--follow=%s' % log_dir, '--validator=0',
+                                               '--threads=%d' % len(reserved)], reserved)
+
+    if FLAGS.workers > 1:
+      code = launch(sys.argv + ['--log_dir=%s' % log_dir], FLAGS.workers, FLAGS.ps_port,
+                    exclude=reserved)
+      if validator is not None:
+        stop_validator(log_dir, validator)
+      exit(code)
+
+  # workers are already pinned by the launcher, each plans inside its cores
+  config, plan = define_resources(FLAGS.threads, FLAGS.inter_threads,
+                                  jobs=FLAGS.jobs, pin=FLAGS.pin and FLAGS.job_name is None,
+                                  exclude=reserved)
+
+  target = ''
+  kwargs = {}
+  if FLAGS.job_name == 'worker':
+    cluster, server = start_server('worker', FLAGS.task_index, FLAGS.workers, FLAGS.ps_port,
+                                   config=config)
+    target = server.target
+    kwargs = dict(device=worker_device(cluster, FLAGS.task_index),
+                  is_chief=(FLAGS.task_index == 0),
+                  shard=(FLAGS.task_index, FLAGS.workers))
+
+  with tf.Session(target, config=config) as sess:
+    model = create_model(FLAGS.towers)
 
     model.train(sess, FLAGS.vocab_size, FLAGS.epoch,
                   FLAGS.data_dir, FLAGS.dataset, log_dir, FLAGS.load_path,
-                  FLAGS.data_size, FLAGS.eval_every, FLAGS.dropout)
+                  FLAGS.data_size, FLAGS.eval_every, dropout_rate=FLAGS.dropout,
+                  graph_cache=FLAGS.graph_cache, profile_steps=FLAGS.profile_steps,
+                  monitor_every=FLAGS.monitor_every,
+                  background_save=FLAGS.background_save,
+                  snapshot_every=FLAGS.snapshot_every,
+                  inline_eval=not FLAGS.validator,
+                  validate_mb=FLAGS.validate_mb,
+                  **kwargs)
+
+  if validator is not None:
+    stop_validator(log_dir, validator)
 
 if __name__ == '__main__':
   tf.app.run()
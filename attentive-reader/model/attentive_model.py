@@ -13,8 +13,8 @@ class AttentiveReader(BaseModel):
 
         # Embeding
         self.emb = tf.get_variable("emb", [self.vocab_size, self.size])
-        embed_d = tf.nn.embedding_lookup(self.emb, self.document, name='embed_d')
-        embed_q = tf.nn.embedding_lookup(self.emb, self.query, name='embed_q')
+        embed_d = self.lookup(self.document, 'embed_d')
+        embed_q = self.lookup(self.query, 'embed_q')
 
         embed_d = tf.nn.dropout(embed_d, keep_prob=self.dropout)
         embed_q = tf.nn.dropout(embed_q, keep_prob=self.dropout)
@@ -32,6 +32,8 @@ class AttentiveReader(BaseModel):
 
         d_t = tf.nn.dropout(d_t, keep_prob=self.dropout)
         u = tf.nn.dropout(u, keep_prob=self.dropout)
+        # query independent, fed from a cache when evaluating
+        d_t = tf.identity(d_t, name='d_t')
         self.d_t = d_t
         self.u = u
 
@@ -53,6 +55,6 @@ class AttentiveReader(BaseModel):
         # afact_sum = tf.scalar_summary(
         #     'before activitation_after', tf.reduce_mean(g))
 
-        self.construct_loss_and_summary(self.score)
+        self.construct_loss_and_summary(self.score, parallel)
 
    
@@ -1,18 +1,73 @@
 import time
 import os
+import resource
 import numpy as np
 import tensorflow as tf
 from tensorflow.python.ops import rnn_cell
 
 import sys
 sys.path.insert(0, '..')
-from utils import fetch_files, data_iter #apply_attention
+from utils import fetch_files, data_iter, read_questions #apply_attention
+from utils import GraphProfile, profiled, graph_key, load_graph, save_graph, StepProfiler
+from utils import clip_gradient, summary_tensor, LazyAdamOptimizer, AsyncCheckpointer
+from utils import GradientAccumulator, Throughput, padded_tokens
+from utils import float32_master, scaled_gradients
+from utils import follow_checkpoints, checkpoint_step, scalar_summary, fixed_sample, ValidationSet
+from utils import encode
 from utils.attention import local_attention
 
-def norm(x):
-    if not isinstance(x, np.ndarray):
-        x = x.values
-    return np.sqrt((x**2).sum())
+def gradient_norms(gvs):
+    """
+    l2 norm of every gradient and their global norm, computed in the graph
+    so a step only fetches scalars. Sparse gradients are not densified,
+    their duplicate rows count separately
+    """
+    norms = []
+    for g, v in gvs:
+        if g is None:
+            continue
+        if isinstance(g, tf.IndexedSlices):
+            g = g.values
+        norms.append(tf.sqrt(tf.reduce_sum(tf.square(tf.cast(g, tf.float32)))))
+    norms = tf.pack(norms, name='grad_norms')
+    return norms, tf.sqrt(tf.reduce_sum(tf.square(norms)), name='global_norm')
+
+
+def model_rnn(model, hidden_size, input_tensor, seq_length, dtype, use_bidirection, cell_type):
+    """
+    the encoder of a model, with its rnn_kernel, rnn_memory and rnn_segment.
+    Unidirectional encoders get 2 * hidden_size units
+    """
+    size = hidden_size if use_bidirection else 2 * hidden_size
+    return encode(cell_type, model.rnn_kernel, size, input_tensor, seq_length,
+                  bidirectional=use_bidirection, dtype=dtype,
+                  memory=model.rnn_memory, segment=model.rnn_segment)
+
+
+def combine_gradients(tower_gvs, max_norm=None, clip=clip_gradient):
+    """
+    sum the unclipped gradients of every tower and clip the sum once, not
+    at all without max_norm. Losses are summed over rows, so the update
+    matches one tower on the whole batch, clipping included
+    """
+    combined = []
+    for gv in zip(*tower_gvs):
+        v = gv[0][1]
+        gs = [g for g, _ in gv if g is not None]
+        if not gs:
+            combined.append((None, v))
+            continue
+        if isinstance(gs[0], tf.IndexedSlices):
+            g = tf.IndexedSlices(tf.concat(0, [_.values for _ in gs]),
+                                 tf.concat(0, [_.indices for _ in gs]),
+                                 gs[0].dense_shape)
+        else:
+            g = tf.add_n(gs)
+        combined.append((g if max_norm is None else clip(g, max_norm), v))
+    return combined
+
+
+TOWER_INPUTS = ['document', 'query', 'd_end', 'q_end', 'y']
 
 
 class BaseModel(object):
@@ -29,6 +84,14 @@ class BaseModel(object):
                  bidirection=True,
                  D=5,
                  max_norm=6,
+                 precision='float32',
+                 loss_scale=128.0,
+                 towers=1,
+                 sparse_grads=True,
+                 rnn_kernel='cell',
+                 rnn_memory='keep',
+                 rnn_segment=50,
+                 accumulate=1,
                  ):
 
         self.size = size
@@ -47,84 +110,241 @@ class BaseModel(object):
         self.bidirection = bidirection
         self.D = D
         self.max_norm=max_norm
+        # float16 keeps float32 master weights and scales the loss
+        self.dtype = tf.as_dtype(precision)
+        self.loss_scale = loss_scale
+        # data parallel towers, each on a slice of the batch
+        self.towers = towers
+        self.tower = None
+        # keep the embedding gradient sparse through clipping and the update
+        self.sparse_grads = sparse_grads
+        # cell, block or fused, see shared/encoders.py
+        self.rnn_kernel = rnn_kernel
+        # keep, swap or recompute the encoder activations for backprop
+        self.rnn_memory = rnn_memory
+        self.rnn_segment = rnn_segment
+        # apply the gradients of that many steps at once, see shared/accumulate.py
+        self.accumulate = accumulate
+        self.apply_op = None
 
         self.saver = None
+        self.checkpointer = None
+        self.snapshotter = None
+        self.profile = GraphProfile()
 
     def construct_inputs(self):
+        if self.tower is not None:
+            return self.slice_inputs(*self.tower)
+
+        # batch dimension is left open, the last batch may be smaller
         self.document = tf.placeholder(
-            tf.int32, [self.batch_size, self.max_nsteps], name='document')
+            tf.int32, [None, self.max_nsteps], name='document')
         self.query = tf.placeholder(
-            tf.int32, [self.batch_size, self.max_query_length], name='query')
-        self.d_end = tf.placeholder(tf.int32, self.batch_size, name='docu-end')
-        self.q_end = tf.placeholder(tf.int32, self.batch_size, name='quer-end')
+            tf.int32, [None, self.max_query_length], name='query')
+        self.d_end = tf.placeholder(tf.int32, [None], name='docu-end')
+        self.q_end = tf.placeholder(tf.int32, [None], name='quer-end')
         self.y = tf.placeholder(
-            tf.float32, [self.batch_size, self.vocab_size], name='Y')
-        self.dropout = tf.placeholder(tf.float32, name='dropout_rate')
+            tf.float32, [None, self.vocab_size], name='Y')
+        self.dropout = tf.placeholder(self.dtype, name='dropout_rate')
+
+    def slice_inputs(self, i, k):
+        """rows [i*N/k, (i+1)*N/k) of the shared placeholders"""
+        N = tf.shape(self.document)[0]
+        idx = tf.range(N * i // k, N * (i + 1) // k)
+        with tf.name_scope('inputs'):
+            for name in TOWER_INPUTS:
+                setattr(self, name, tf.gather(getattr(self, name), idx))
+
+    def build(self, parallel=False):
+        """
+        prepare_model, with float32 master weights in reduced precision.
+        parallel 'forward' stops at the loss, 'tower' at the unclipped
+        gradients, see build_towers
+        """
+        if self.dtype == tf.float32:
+            return self.prepare_model(parallel)
+        with tf.variable_scope(tf.get_variable_scope(),
+                               custom_getter=float32_master(self.dtype)):
+            return self.prepare_model(parallel)
+
+    def build_graph(self, device=None, graph_cache=None):
+        """
+        build the train graph, or import it from graph_cache when a graph
+        with the same hyperparameters was built before
+        """
+        key = None
+        if graph_cache and device is None:
+            key = graph_key(self)
+            if load_graph(self, graph_cache, key):
+                print(" [*] Imported cached graph %s" % key)
+                return
+
+        self.profile.reset()
+        with self.profile.total(), tf.device(device):
+            if self.towers > 1:
+                self.build_towers()
+            else:
+                self.build()
+        self.profile.report()
+
+        if key is not None:
+            save_graph(self, graph_cache, key)
+            print(" [*] Cached graph as %s" % key)
+
+    def build_towers(self):
+        """
+        data parallel graph. The model is built once on the full batch, which
+        keeps the usual tensor names for evaluation, export and serving, and
+        once per tower on a slice of the batch, sharing the variables. The
+        train op applies the combined gradients of the towers
+        """
+        assert self.construct_inputs.im_func is BaseModel.construct_inputs.im_func, \
+            '%s has its own inputs, towers are not supported' % type(self).__name__
+
+        # forward and loss only, the towers compute the gradients
+        self.build(parallel='forward')
+        full = dict((name, getattr(self, name)) for name in TOWER_INPUTS)
+
+        losses = []
+        corrects = []
+        tower_gvs = []
+        tower_norms = []
+        for i in range(self.towers):
+            self.tower = (i, self.towers)
+            with tf.name_scope('tower_%d' % i):
+                with tf.variable_scope(tf.get_variable_scope(), reuse=True):
+                    self.build(parallel='tower')
+            losses.append(self.loss)
+            corrects.append(self.accuracy * tf.to_float(tf.shape(self.loss)[0]))
+            tower_gvs.append(self.raw_grad_and_var)
+            tower_norms.append((self.grad_norms, self.global_norm))
+            for name, tensor in full.items():
+                setattr(self, name, tensor)
+        self.tower = None
+
+        with tf.name_scope('towers'):
+            # the worst tower
+            norms, global_norms = zip(*tower_norms)
+            self.grad_norms = tf.reduce_max(tf.pack(norms), 0, name='grad_norms')
+            self.global_norm = tf.reduce_max(tf.pack(global_norms), name='global_norm')
+            self.loss = tf.concat(0, losses, name='loss')
+            self.accuracy = tf.div(tf.add_n(corrects), tf.to_float(tf.shape(self.loss)[0]),
+                                   name='accuracy')
+        with self.profile.section('optimizer'), tf.name_scope('towers'):
+            # accumulated unclipped, see apply_gradients
+            self.raw_grad_and_var = combine_gradients(tower_gvs)
+            self.grad_and_var = [(None if g is None else self.clip(g, self.max_norm), v)
+                                 for g, v in self.raw_grad_and_var]
+            self.train_op = self.apply_gradients()
+
+        self.vname = [v.name for g, v in self.grad_and_var]
+        self.vars = [v for g, v in self.grad_and_var]
+        self.gras = [g for g, v in self.grad_and_var if g is not None]
+        self.gname = [v.name for g, v in self.grad_and_var if g is not None]
+
+        with self.profile.section('summaries'):
+            loss_sum = tf.scalar_summary("T_loss", tf.reduce_mean(self.loss))
+            acc_sum = tf.scalar_summary("T_accuracy", self.accuracy)
+            self.train_sum = tf.merge_summary([loss_sum, acc_sum])
+
+            v_loss_sum = tf.scalar_summary("V_loss", tf.reduce_mean(self.loss))
+            v_acc_sum = tf.scalar_summary("V_accuracy", self.accuracy)
+            self.embed_sum = tf.histogram_summary("embed", self.emb)
+            self.validate_sum = tf.merge_summary([self.embed_sum, v_loss_sum, v_acc_sum])
+
+    @profiled('embedding')
+    def lookup(self, ids, name):
+        """rows of self.emb in the compute precision"""
+        embed = tf.nn.embedding_lookup(self.emb, ids, name=name)
+        if self.dtype != tf.float32:
+            embed = tf.cast(embed, self.dtype, name=name + '_cast')
+        return embed
+
+    def compute_gradients(self, loss):
+        """
+        gradients of loss. In reduced precision the loss is scaled up before
+        the backward pass so small gradients do not flush to zero
+        """
+        return scaled_gradients(self.optim, loss, self.dtype, self.loss_scale)
 
     def construct_loss_and_summary(self, score, parallel=False):
 
-        self.loss = tf.nn.softmax_cross_entropy_with_logits(
-            score, self.y, name='loss')
-        loss_sum = tf.scalar_summary("T_loss", tf.reduce_mean(self.loss))
+        with self.profile.section('loss'):
+            score = tf.cast(score, tf.float32)
+            self.loss = tf.nn.softmax_cross_entropy_with_logits(
+                score, self.y, name='loss')
+
+            correct_prediction = tf.equal(tf.argmax(self.y, 1), tf.argmax(score, 1))
+            self.accuracy = tf.reduce_mean(
+                tf.cast(correct_prediction, "float"), name='accuracy')
 
-        correct_prediction = tf.equal(tf.argmax(self.y, 1), tf.argmax(score, 1))
-        self.accuracy = tf.reduce_mean(
-            tf.cast(correct_prediction, "float"), name='accuracy')
-        acc_sum = tf.scalar_summary("T_accuracy", self.accuracy)
+        # the full batch copy of build_towers has no backward pass
+        if parallel == 'forward':
+            return
 
         # optimize
-        self.optim = self.get_optimizer()
-
-        self.grad_and_var = self.optim.compute_gradients(self.loss)
-        with tf.name_scope('clip_norm'):
-            new = []
-            for _g, v in self.grad_and_var:
-                if _g is not None:
-                    new.append( (tf.clip_by_norm(_g, self.max_norm), v) )
-                else:
-                    new.append( (_g,v) )
-
-            self.grad_and_var = new                            
-
-        if not parallel:
-            self.train_op = self.optim.apply_gradients(
-                self.grad_and_var, name='train_op')
-        else:
-            self.train_op = None
-
-        # train_sum
-        gv_sum = []
-        zf = []
-        for g, v in self.grad_and_var:
-            v_sum = tf.scalar_summary(
-                "I_{}-var/mean".format(v.name), tf.reduce_mean(v))
-            gv_sum.append(v_sum)
-            if g is not None:
-                g_sum = tf.scalar_summary(
-                    "I_{}-grad/mean".format(v.name), tf.reduce_mean(g))
-                zero_frac = tf.scalar_summary(
-                    "I_{}-grad/sparsity".format(v.name), tf.nn.zero_fraction(g))
-                gv_sum.append(g_sum)
-                zf.append(zero_frac)
+        with self.profile.section('optimizer'):
+            self.optim = self.get_optimizer()
+
+            self.grad_and_var = self.compute_gradients(self.loss)
+            # towers sum these and clip once
+            self.raw_grad_and_var = self.grad_and_var
+            # before clipping, to see what the clip hides
+            self.grad_norms, self.global_norm = gradient_norms(self.grad_and_var)
+            if parallel:
+                # a tower, build_towers clips the sum and adds the summaries
+                return
+            with tf.name_scope('clip_norm'):
+                new = []
+                for _g, v in self.grad_and_var:
+                    if _g is not None:
+                        new.append( (self.clip(_g, self.max_norm), v) )
+                    else:
+                        new.append( (_g,v) )
+
+                self.grad_and_var = new                            
+
+            self.train_op = self.apply_gradients()
 
         self.vname = [v.name for g, v in self.grad_and_var]
         self.vars = [v for g, v in self.grad_and_var]
         self.gras = [g for g, v in self.grad_and_var if g is not None]
         self.gname = [ v.name for g, v in self.grad_and_var if g is not None ]
 
-        if self.attention == 'local':
-            self.train_sum = tf.merge_summary([loss_sum, acc_sum])
-        else:
-            self.train_sum = tf.merge_summary([loss_sum, acc_sum])
+        with self.profile.section('summaries'):
+            loss_sum = tf.scalar_summary("T_loss", tf.reduce_mean(self.loss))
+            acc_sum = tf.scalar_summary("T_accuracy", self.accuracy)
+
+            # train_sum
+            gv_sum = []
+            zf = []
+            for g, v in self.grad_and_var:
+                v_sum = tf.scalar_summary(
+                    "I_{}-var/mean".format(v.name), tf.reduce_mean(v))
+                gv_sum.append(v_sum)
+                if g is not None:
+                    g = summary_tensor(g)
+                    g_sum = tf.scalar_summary(
+                        "I_{}-grad/mean".format(v.name), tf.reduce_mean(g))
+                    zero_frac = tf.scalar_summary(
+                        "I_{}-grad/sparsity".format(v.name), tf.nn.zero_fraction(g))
+                    gv_sum.append(g_sum)
+                    zf.append(zero_frac)
+
+            if self.attention == 'local':
+                self.train_sum = tf.merge_summary([loss_sum, acc_sum])
+            else:
+                self.train_sum = tf.merge_summary([loss_sum, acc_sum])
 
-        # validation sum
-        v_loss_sum = tf.scalar_summary("V_loss", tf.reduce_mean(self.loss))
-        v_acc_sum = tf.scalar_summary("V_accuracy", self.accuracy)
+            # validation sum
+            v_loss_sum = tf.scalar_summary("V_loss", tf.reduce_mean(self.loss))
+            v_acc_sum = tf.scalar_summary("V_accuracy", self.accuracy)
 
-        embed_sum = tf.histogram_summary("embed", self.emb)
-        self.validate_sum = tf.merge_summary(
-            [embed_sum, v_loss_sum, v_acc_sum])
+            self.embed_sum = tf.histogram_summary("embed", self.emb)
+            self.validate_sum = tf.merge_summary(
+                [self.embed_sum, v_loss_sum, v_acc_sum])
 
+    @profiled('attention')
     def apply_attention( self, _type, size, d_t, u, local_D=25):
 
         if _type == 'concat':
@@ -149,28 +369,29 @@ class BaseModel(object):
 
         return r
 
+    @profiled('attention')
     def concat_attention( self, size, d_t, u, return_attention=False):
         W_ym = tf.get_variable('W_ym', [ size, size])
         W_um = tf.get_variable('W_um', [ size, size])
         W_ms = tf.get_variable('W_ms', [ size ])
-        m_t = []
         U = tf.matmul(u, W_um)  # N,H
 
-        d_t = tf.unpack(d_t, axis=1)
-        for d in d_t:
-            m_t.append(tf.matmul(d, W_ym) + U)  # N,H
-        m = tf.pack(m_t, 1)  # N,T,H
-        m = tf.tanh(m)
+        # document side keys do not depend on the query, they are computed
+        # in one matmul and can be fed from a cache with d_t
+        keys = tf.matmul(tf.reshape(d_t, [-1, size]), W_ym)  # N*T,H
+        keys = tf.reshape(keys, tf.shape(d_t), name='doc_keys')  # N,T,H
+        keys.set_shape(d_t.get_shape())
+        m = tf.tanh(keys + tf.expand_dims(U, 1))  # N,T,H
         ms = tf.reduce_sum(m * W_ms, 2, keep_dims=True, name='ms')  # N,T,1
         s = tf.nn.softmax(ms, 1)  # N,T,1
         atten = tf.squeeze(s, [-1], name='attention')
-        d = tf.pack(d_t, axis=1)  # N,T,2E
         if return_attention:
             return atten
         else:
-            r = tf.reduce_sum(s * d, 1, name='r')  # N, 2E
+            r = tf.reduce_sum(s * d_t, 1, name='r')  # N, 2E
             return r
 
+    @profiled('attention')
     def bilinear_attention( self, size, d_t, u, return_attention=False):
         W = tf.get_variable('W_bilinear', [ size, size ])
         atten = []
@@ -190,70 +411,76 @@ class BaseModel(object):
             r = tf.reduce_sum(atten * d, 1, name='r')
             return r
 
-    def _extract_state(self, state, seq_end, need_unpack=True):
-        if need_unpack:
-            state = tf.unpack(state, axis=0)
-        begins = tf.pack(
-            [seq_end - 1, tf.zeros([self.batch_size], dtype=tf.int32)], axis=1)  # N, 2
-        begins = tf.unpack(begins)
-
-        size = state[0].get_shape()[-1].value
+    def _extract_state(self, state, seq_end):
+        """state: N, T, H, pick state[i, seq_end[i]-1] for every sample"""
+        shape = tf.shape(state)
+        size = state.get_shape()[-1].value
 
-        final_state = []
-        for h, b in zip(state, begins):
-            f = tf.slice(h, b, [1, size])
-            final_state.append(f)
-
-        final = tf.pack(final_state)
-        final = tf.squeeze(final, [1])
+        flat = tf.reshape(state, [-1, size])  # N*T, H
+        idx = tf.range(shape[0]) * shape[1] + (seq_end - 1)
+        final = tf.gather(flat, idx)  # N, H
         return final
 
     def extract_rnn_state(self, bidirection, state, seq_end):
         if bidirection:
-            f = self._extract_state(state[0], seq_end, need_unpack=True)
+            f = self._extract_state(state[0], seq_end)
             b = tf.unpack( state[1], axis=1 )[0]
             final = tf.concat(1, [f, b])  # N, Hidden*2
         else:
-            final = self._extract_state( state, need_unpack=False )
+            final = self._extract_state( state, seq_end )
 
         return final
 
-    def rnn(self, hidden_size, input_tensor, seq_length, dtype=tf.float32, use_bidirection=True, cell_type='LSTM'):
-
-        if cell_type == 'LSTM':
-            cell = lambda size: rnn_cell.LSTMCell(size, state_is_tuple=True)
-        elif cell_type == 'GRU':
-            cell = rnn_cell.GRU
-        else:
-            raise ValueError(cell_type)
-
-        if use_bidirection:            
-            h_t, final_state, = tf.nn.bidirectional_dynamic_rnn(
-                cell(hidden_size),
-                cell(hidden_size),
-                input_tensor,
-                sequence_length=seq_length, dtype=dtype)
-
-        else:
-            h_t, final_state = tf.nn.dynamic_rnn(
-                cell(2 * hidden_size),
-                input_tensor,
-                sequence_length=seq_length, dtype=dtype)
-        return h_t, final_state
+    @profiled('encoders')
+    def rnn(self, hidden_size, input_tensor, seq_length, dtype=None, use_bidirection=True, cell_type='LSTM'):
+        return model_rnn(self, hidden_size, input_tensor, seq_length, dtype or self.dtype,
+                         use_bidirection, cell_type)
 
     def get_optimizer(self):
         if self.use_optimizer == 'SGD':
             optim = tf.train.GradientDescentOptimizer(
                 self.learning_rate, name='optimizer')
         elif self.use_optimizer == 'Adam':
-            optim = tf.train.AdamOptimizer(
-                self.learning_rate, name='optimizer')
+            # RMSProp and SGD already update only the rows of a sparse gradient
+            adam = LazyAdamOptimizer if self.sparse_grads else tf.train.AdamOptimizer
+            optim = adam(self.learning_rate, name='optimizer')
         elif self.use_optimizer == 'RMS':
             optim = tf.train.RMSPropOptimizer(
                 self.learning_rate, momentum=self.momentum, decay=self.decay, name='optimizer')
         return optim
 
-    def step(self, sess, data, fetch, dropout_rate):
+    def apply_gradients(self):
+        """
+        the train op of grad_and_var. With accumulate K it only adds up the
+        unclipped gradients, apply_op applies their sum clipped after every
+        K train_op
+        """
+        if self.accumulate <= 1:
+            return self.optim.apply_gradients(self.grad_and_var, name='train_op')
+        accumulator = GradientAccumulator(self.raw_grad_and_var)
+        self.apply_op = accumulator.apply_op(self.optim, lambda g: self.clip(g, self.max_norm))
+        return accumulator.accumulate_op(name='train_op')
+
+    def apply_accumulated(self, sess, counter):
+        """after train_op of step counter, apply every accumulate steps"""
+        if self.apply_op is not None and (counter + 1) % self.accumulate == 0:
+            sess.run(self.apply_op)
+
+    def clip(self, g, max_norm):
+        if self.sparse_grads:
+            return clip_gradient(g, max_norm)
+        return tf.clip_by_norm(g, max_norm)
+
+    def check_gradients(self, norms, global_norm, writer=None, step=0):
+        """log the gradients over max_norm, fetched from grad_norms"""
+        for name, n in zip(self.gname, norms):
+            if n > self.max_norm:
+                print('EXPLODE %s %f' % (name, n))
+        if writer is not None:
+            writer.add_summary(tf.Summary(value=[
+                tf.Summary.Value(tag='T_grad_norm', simple_value=float(global_norm))]), step)
+
+    def step(self, sess, data, fetch, dropout_rate, **run_args):
         """sess, data, fetch"""
         batch_idx, docs, d_end, queries, q_end, y = data
         rslt = sess.run( fetch,
@@ -263,28 +490,54 @@ class BaseModel(object):
                             self.q_end: q_end,
                             self.y: y,
                             self.dropout: dropout_rate,
-                             }
-                           )
+                             },
+                **run_args)
         return rslt
                         
         
 
     def train(self, sess, vocab_size, epoch=25, data_dir="data", dataset_name="cnn",
-              log_dir='log/tmp/', load_path=None, data_size=3000, eval_every=1500, val_rate=0.1, dropout_rate=0.9):
+              log_dir='log/tmp/', load_path=None, data_size=3000, eval_every=1500, val_rate=0.1, dropout_rate=0.9,
+              device=None, is_chief=True, shard=None, graph_cache=None, profile_steps=None,
+              monitor_every=10, background_save=True, snapshot_every=0, inline_eval=True,
+              validate_mb=256):
+        """
+        device, is_chief and shard are set by a worker of a local cluster:
+        variables are placed by device, every worker trains on its shard
+        (index, count) of the files, only the chief inits, validates and saves
+
+        graph_cache is a directory of built graphs, see utils/graph_cache.py
+        profile_steps 'first-last' traces those steps, see shared/step_profile.py
+        monitor_every fetches the gradient norms and the embedding histogram
+        every that many steps, 0 never
+        background_save and snapshot_every, see create_checkpointers
+        without inline_eval checkpoints are still written every eval_every
+        steps, for a validator following them, see follow
+        validate_mb caps the memory of the validation set, see validation_set
+        throughput every 10 steps goes to log_dir/throughput.jsonl, see
+        shared/throughput.py
+        """
 
         print(" [*] Building Network...")
         start = time.time()
-        self.prepare_model()
+        self.build_graph(device, graph_cache)
         print(" [*] Preparing model finished. Use %4.4f" %
               (time.time() - start))
 
         # Summary
+        if not is_chief:
+            log_dir = os.path.join(log_dir, 'worker%d' % shard[0])
         writer = tf.train.SummaryWriter(log_dir, sess.graph)
         print(" [*] Writing log to %s" % log_dir)
 
         # Saver and Load
         self.saver = tf.train.Saver(max_to_keep=15)
-        if load_path is not None:
+        if not is_chief:
+            uninitialized = tf.report_uninitialized_variables()
+            while len(sess.run(uninitialized)) > 0:
+                print(" [*] Waiting for the chief to init variables")
+                time.sleep(1)
+        elif load_path is not None:
             if os.path.isdir(load_path):
                 fname = tf.train.latest_checkpoint(
                     os.path.join(load_path, 'ckpts'))
@@ -298,9 +551,14 @@ class BaseModel(object):
         else:
             sess.run(tf.initialize_all_variables())
             print(" [*] No checkpoint to load, all variable inited")
+        # gradient accumulators, never in a checkpoint
+        sess.run(tf.initialize_local_variables())
+        if is_chief:
+            self.create_checkpointers(log_dir, background_save, snapshot_every)
 
         counter = 0
-        vcounter = 0
+        profiler = StepProfiler(log_dir, profile_steps, part_of=self.profile.names)
+        meter = Throughput(log_dir, writer, every=10)
         start_time = time.time()
         ACC = []
         LOSS = []
@@ -308,9 +566,11 @@ class BaseModel(object):
             data_dir, dataset_name, vocab_size)
         if data_size:
             train_files = train_files[:data_size]
-        validate_size = int(
-            min(max(20.0, float(len(train_files)) * val_rate), len(validate_files)))
-        print(" [*] Validate_size %d" % validate_size)
+        if shard is not None:
+            train_files = train_files[shard[0]::shard[1]]
+        if is_chief and inline_eval:
+            validate_size = self.validation_size(data_dir, dataset_name, data_size, val_rate)
+            vset = self.validation_set(data_dir, dataset_name, validate_size, validate_mb)
 
         for epoch_idx in xrange(epoch):
             # load data
@@ -323,14 +583,25 @@ class BaseModel(object):
             # train
             running_acc = 0
             running_loss = 0
-            for data in train_iter:
+            for data in meter.wait(train_iter):
                 batch_idx, docs, d_end, queries, q_end, y = data
-                _, summary_str, cost, accuracy, gs = self.step( sess, data, 
-                                [self.train_op, self.train_sum, self.loss, self.accuracy,
-                                    self.gras,
-                                ],
-                                dropout_rate, 
-                                )
+                fetch = [self.train_op, self.train_sum, self.loss, self.accuracy]
+                monitor = monitor_every and counter % monitor_every == 0
+                if monitor:
+                    fetch += [self.grad_norms, self.global_norm, self.embed_sum]
+                run_args = profiler.before_run(counter)
+                run_start = time.time()
+                rslt = self.step( sess, data, fetch, dropout_rate, **run_args)
+                run_time = time.time() - run_start
+                profiler.after_run(counter, run_args)
+                d_tokens, d_slots = padded_tokens(d_end, self.max_nsteps)
+                q_tokens, q_slots = padded_tokens(q_end, self.max_query_length)
+                meter.add(counter, run_time, len(d_end), d_tokens + q_tokens, d_slots + q_slots)
+                self.apply_accumulated(sess, counter)
+                _, summary_str, cost, accuracy = rslt[:4]
+                if monitor:
+                    self.check_gradients(rslt[4], rslt[5], writer, counter)
+                    writer.add_summary(rslt[6], counter)
 
                 writer.add_summary(summary_str, counter)
                 running_acc += accuracy
@@ -342,49 +613,124 @@ class BaseModel(object):
                     running_acc = 0
                 counter += 1
 
-                if False:
-                    for name, g in zip(self.gname, gs):
-                        _n = norm(g)
-                        if _n > self.max_norm:
-                            print 'EXPLODE %s %f' % ( name, _n )
-
-                if (counter + 1) % eval_every == 0:
+                if is_chief and inline_eval and (counter + 1) % eval_every == 0:
                     # validate
-                    running_acc = 0
-                    running_loss = 0
-
-                    idxs = np.random.choice(
-                        len(validate_files), size=validate_size)
-                    files = [validate_files[idx] for idx in idxs]
-                    validate_iter = data_iter(files, self.max_nsteps, self.max_query_length,
-                                              batch_size=self.batch_size,
-                                              vocab_size=self.vocab_size,
-                                              shuffle_data=True)
-                    vsteps = validate_iter.next()
-
-                    for data in validate_iter:
-                        batch_idx, docs, d_end, queries, q_end, y = data
-                        validate_sum_str, cost, accuracy = self.step( sess, data, 
-                                                                     [self.validate_sum, self.loss, self.accuracy],
-                                                                     1.0,
-                                                                     )
-                        writer.add_summary(validate_sum_str, vcounter)
-                        running_acc += accuracy
-                        running_loss += np.mean(cost)
-                        vcounter += 1
-
-                    ACC.append(running_acc / vsteps)
-                    LOSS.append(running_loss / vsteps)
-                    vcounter += vsteps
-                    print("Epoch: [%2d] Validation time: %4.4f, loss: %.8f, accuracy: %.8f"
-                          % (epoch_idx, time.time() - start_time, running_loss / vsteps, running_acc / vsteps))
+                    vloss, vaccuracy = self.evaluate(sess, self.eval_batches(vset))
+                    writer.add_summary(scalar_summary(V_loss=vloss, V_accuracy=vaccuracy), counter)
+                    ACC.append(vaccuracy)
+                    LOSS.append(vloss)
+                    print("Epoch: [%2d] Validation time: %4.4f, loss: %.8f, accuracy: %.8f, max RSS: %dMB"
+                          % (epoch_idx, time.time() - start_time, vloss, vaccuracy,
+                             resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024))
 
                     # save
                     self.save(sess, log_dir, global_step=counter)
 
+                elif is_chief and (counter + 1) % eval_every == 0:
+                    # validated by a follower
+                    self.save(sess, log_dir, global_step=counter)
+
+                if is_chief and snapshot_every and (counter + 1) % snapshot_every == 0:
+                    self.snapshotter.save(sess, counter)
+
             print('\n\n')
 
+        if is_chief:
+            self.checkpointer.join()
+            if self.snapshotter is not None:
+                self.snapshotter.join()
+
+    def validation_size(self, data_dir, dataset_name, data_size, val_rate):
+        """
+        validation questions of a run on data_size training files: val_rate
+        of them, at least 20. The same for the chief and a follower, however
+        the training files are sharded
+        """
+        train_files, validate_files = fetch_files(data_dir, dataset_name, self.vocab_size)
+        if data_size:
+            train_files = train_files[:data_size]
+        return int(min(max(20.0, float(len(train_files)) * val_rate), len(validate_files)))
+
+    def validation_set(self, data_dir, dataset_name, size, max_mb=0, seed=1234):
+        """
+        size validation questions, the same ones for a seed, read and padded
+        once. Beyond max_mb a smaller fixed sample is kept
+        """
+        start = time.time()
+        _, validate_files = fetch_files(data_dir, dataset_name, self.vocab_size)
+        row_bytes = 4 * (self.max_nsteps + self.max_query_length + 3)
+        idx = fixed_sample(len(validate_files), size, row_bytes, max_mb, seed)
+        files = sorted(validate_files)
+        vset = ValidationSet(read_questions([files[i] for i in idx],
+                                            self.max_nsteps, self.max_query_length))
+        print(" [*] Validation set of %d questions, %.1fMB, read in %.2fs"
+              % (len(vset), vset.nbytes / 2.0 ** 20, time.time() - start))
+        return vset
+
+    def eval_batches(self, vset):
+        """batches of vset as fed by step, answers one hot"""
+        for s, docs, d_end, queries, q_end, answers in vset.batches(self.batch_size):
+            y = np.zeros([len(answers), self.vocab_size], dtype=np.float32)
+            y[np.arange(len(answers)), answers] = 1
+            yield s, docs, d_end, queries, q_end, y
+
+    def evaluate(self, sess, batches):
+        """loss and accuracy over batches, weighted by their sizes"""
+        loss, correct, n = 0.0, 0.0, 0
+        for data in batches:
+            cost, accuracy = self.step(sess, data, [self.loss, self.accuracy], 1.0)
+            loss += np.sum(cost)
+            correct += accuracy * len(cost)
+            n += len(cost)
+        return loss / max(n, 1), correct / max(n, 1)
+
+    def follow(self, sess, log_dir, data_dir="data", dataset_name="cnn", data_size=3000,
+               val_rate=0.1, validate_mb=256, interval=10, timeout=0):
+        """
+        validate every checkpoint written to log_dir/ckpts, in a process of
+        its own, see shared/follow.py. data_size and val_rate are those of
+        train, so the follower validates the questions inline validation
+        would. V_loss and V_accuracy go to log_dir/validation at the
+        training step of the checkpoint
+        """
+        print(" [*] Building Network...")
+        self.build_graph()
+        saver = tf.train.Saver()
+        writer = tf.train.SummaryWriter(os.path.join(log_dir, 'validation'))
+
+        validate_size = self.validation_size(data_dir, dataset_name, data_size, val_rate)
+        vset = self.validation_set(data_dir, dataset_name, validate_size, validate_mb)
+        for fname in follow_checkpoints(os.path.join(log_dir, 'ckpts'), interval, timeout):
+            try:
+                saver.restore(sess, fname)
+            except tf.errors.NotFoundError:
+                print(" [*] %s was removed before it was validated" % fname)
+                continue
+            start = time.time()
+            loss, accuracy = self.evaluate(sess, self.eval_batches(vset))
+            writer.add_summary(scalar_summary(V_loss=loss, V_accuracy=accuracy),
+                               checkpoint_step(fname))
+            writer.flush()
+            print(" [*] %s validation time: %4.4f, loss: %.8f, accuracy: %.8f"
+                  % (fname, time.time() - start, loss, accuracy))
+
+    def create_checkpointers(self, log_dir, background=True, snapshot_every=0):
+        """
+        full checkpoints go to log_dir/ckpts, written on a background thread
+        unless background is False. With snapshot_every, weights only
+        snapshots for inference go to log_dir/weights in between
+        """
+        self.checkpointer = AsyncCheckpointer(self.saver, os.path.join(log_dir, 'ckpts'),
+                                              max_to_keep=15, background=background)
+        if snapshot_every:
+            weights = tf.trainable_variables()
+            self.snapshotter = AsyncCheckpointer(tf.train.Saver(weights), os.path.join(log_dir, 'weights'),
+                                                 var_list=weights, prefix='weights',
+                                                 max_to_keep=5, background=background)
+
     def save(self, sess, log_dir, global_step=None):
+        if self.checkpointer is not None:
+            return self.checkpointer.save(sess, global_step)
         assert self.saver is not None
         print(" [*] Saving checkpoints...")
         checkpoint_dir = os.path.join(log_dir, "ckpts")
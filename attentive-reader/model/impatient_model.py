@@ -4,6 +4,7 @@ import numpy as np
 import tensorflow as tf
 from tensorflow.python.ops import rnn_cell
 from utils import load_dataset, fetch_files, data_iter
+from base import model_rnn
 
 class ImpatientReader():
 
@@ -17,6 +18,9 @@ class ImpatientReader():
                  attention='bilinear',
                  bidirection=True,
                  D=25,
+                 rnn_kernel='cell',
+                 rnn_memory='keep',
+                 rnn_segment=50,
                  ):
 
         self.size = size
@@ -34,6 +38,9 @@ class ImpatientReader():
         self.attention = attention
         self.bidirection = bidirection
         self.D = D
+        self.rnn_kernel = rnn_kernel
+        self.rnn_memory = rnn_memory
+        self.rnn_segment = rnn_segment
 
         self.saver = None
 
@@ -174,29 +181,8 @@ class ImpatientReader():
         # import ipdb; ipdb.set_trace()
 
     def rnn(self, input_tensor, seq_length, dtype=tf.float32, use_bidirection=True, cell_type='LSTM'):
-
-        if cell_type == 'LSTM':
-            cell = lambda size: rnn_cell.LSTMCell(size, state_is_tuple=True)
-        elif cell_type == 'GRU':
-            cell = rnn_cell.GRU
-        else:
-            raise ValueError(cell_type)
-
-        if use_bidirection:            
-            # (TODO) change
-            h_t, final_state, = tf.nn.bidirectional_dynamic_rnn(
-                cell(self.size),
-                cell(self.size),
-                input_tensor,
-                sequence_length=seq_length, dtype=dtype)
-
-        else:
-            h_t, final_state = tf.nn.dynamic_rnn(
-                cell(2 * self.size),
-                input_tensor,
-                sequence_length=seq_length, dtype=dtype)
-
-        return h_t, final_state
+        return model_rnn(self, self.size, input_tensor, seq_length, dtype,
+                         use_bidirection, cell_type)
 
     def get_optimizer(self):
         if self.use_optimizer == 'SGD':
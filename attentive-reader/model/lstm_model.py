@@ -1,6 +1,7 @@
 import tensorflow as tf
 from tensorflow.python.ops import rnn_cell
 from base import BaseModel
+from utils import encode
 import numpy as np
 
 
@@ -9,11 +10,11 @@ class LSTMReader(BaseModel):
 
     def construct_inputs(self):
         self.text = tf.placeholder(
-            tf.int32, [self.batch_size, self.max_nsteps + self.max_query_length + 1], name='text')
-        self.text_end = tf.placeholder(tf.int32, self.batch_size, name='text-end')
+            tf.int32, [None, self.max_nsteps + self.max_query_length + 1], name='text')
+        self.text_end = tf.placeholder(tf.int32, [None], name='text-end')
         self.y = tf.placeholder(
-            tf.float32, [self.batch_size, self.vocab_size], name='Y')
-        self.dropout = tf.placeholder(tf.float32, name='dropout_rate')
+            tf.float32, [None, self.vocab_size], name='Y')
+        self.dropout = tf.placeholder(self.dtype, name='dropout_rate')
 
     def prepare_model(self, parallel=False):
 
@@ -21,22 +22,29 @@ class LSTMReader(BaseModel):
 
         # Embeding
         self.emb = tf.get_variable("emb", [self.vocab_size, self.size])
-        embed = tf.nn.embedding_lookup(self.emb, self.text, name='embed_d')
+        embed = self.lookup(self.text, 'embed_d')
         embed = tf.nn.dropout( embed, keep_prob=self.dropout)
 
 
-        self.cell = rnn_cell.BasicLSTMCell(self.size, forget_bias=0.0)
-        self.cell = rnn_cell.DropoutWrapper( self.cell, output_keep_prob=self.dropout )
-        self.stacked_cell = rnn_cell.MultiRNNCell([self.cell] * 2)
+        if self.rnn_kernel == 'cell' and self.rnn_memory != 'recompute':
+            self.cell = rnn_cell.BasicLSTMCell(self.size, forget_bias=0.0)
+            self.cell = rnn_cell.DropoutWrapper( self.cell, output_keep_prob=self.dropout )
+            self.stacked_cell = rnn_cell.MultiRNNCell([self.cell] * 2)
 
-        # self.initial_state = self.stacked_cell.zero_state( self.batch_size, tf.float32)
+            # self.initial_state = self.stacked_cell.zero_state( self.batch_size, tf.float32)
 
-        hidden, states = tf.nn.bidirectional_dynamic_rnn(
-                                            self.stacked_cell, self.stacked_cell,
-                                            embed,
-                                            sequence_length=self.text_end,
-                                            dtype=tf.float32,
-                                            )
+            hidden, states = tf.nn.bidirectional_dynamic_rnn(
+                                                self.stacked_cell, self.stacked_cell,
+                                                embed,
+                                                sequence_length=self.text_end,
+                                                dtype=self.dtype,
+                                                swap_memory=self.rnn_memory == 'swap',
+                                                )
+        else:
+            hidden, states = encode('LSTM', self.rnn_kernel, self.size, embed, self.text_end,
+                                    dtype=self.dtype, forget_bias=0.0,
+                                    layers=2, keep_prob=self.dropout,
+                                    memory=self.rnn_memory, segment=self.rnn_segment)
 
         final = self.extract_rnn_state( True, hidden, self.text_end )
 
@@ -49,18 +57,19 @@ class LSTMReader(BaseModel):
         g = tf.matmul(final, W, name='g_x_W') + B
         self.score = g
 
-        self.construct_loss_and_summary(self.score)
+        self.construct_loss_and_summary(self.score, parallel)
 
-    def step(self, sess, data, fetch, dropout_rate):
+    def step(self, sess, data, fetch, dropout_rate, **run_args):
         """sess, data, fetch"""
 
         # use stop id as delimiter, which is 2
 
         batch_idx, docs, d_end, queries, q_end, y = data
 
-        text = np.zeros( [self.batch_size, self.max_nsteps + self.max_query_length + 1], dtype=np.int )
-        end = np.zeros( self.batch_size, dtype=np.int )
-        for b in range(self.batch_size):
+        N = docs.shape[0]
+        text = np.zeros( [N, self.max_nsteps + self.max_query_length + 1], dtype=np.int )
+        end = np.zeros( N, dtype=np.int )
+        for b in range(N):
             ql = q_end[b]
             dl = d_end[b]
             text[b, :ql] = queries[b, :ql]
@@ -73,8 +82,8 @@ class LSTMReader(BaseModel):
                             self.text_end: end,
                             self.y: y,
                             self.dropout: dropout_rate,
-                             }
-                           )
+                             },
+                **run_args)
         return rslt
 
    
@@ -1,22 +1,16 @@
 import tensorflow as tf
 # from tensorflow.python.ops import rnn_cell
-from base import BaseModel
+from base import BaseModel, gradient_norms
+from utils import H5Data, StepProfiler, summary_tensor, scalar_summary, fixed_sample, ValidationSet
+from utils import Throughput, padded_tokens
 import numpy as np
-import h5py
 
 import time, os
 
 def fetch_data(fname='./FULL_BIG_BOOST.h5', val_size=3000):
-    with h5py.File(fname, 'r') as hf:
-        doc = hf['doc'][()]
-        dlen = hf['dlen'][()]
-        que = hf['que'][()]
-        qlen = hf['qlen'][()]
-        y = hf['label'][()]
-    
-    data = [ doc, dlen, que, qlen, y ]
-    train_data = [ _[val_size:] for _ in data ]
-    validate_data = [ _[:val_size] for _ in data ]
+    data = H5Data(fname, ['doc', 'dlen', 'que', 'qlen', 'label'])
+    train_data = data.view(val_size)
+    validate_data = data.view(0, val_size)
     return train_data, validate_data
 
 class Selector(BaseModel):
@@ -29,8 +23,8 @@ class Selector(BaseModel):
 
         # Embeding
         self.emb = tf.get_variable("emb", [self.vocab_size, self.size])
-        embed_d = tf.nn.embedding_lookup(self.emb, self.document, name='embed_d')
-        embed_q = tf.nn.embedding_lookup(self.emb, self.query, name='embed_q')
+        embed_d = self.lookup(self.document, 'embed_d')
+        embed_q = self.lookup(self.query, 'embed_q')
 
         embed_d = tf.nn.dropout(embed_d, keep_prob=self.dropout)
         embed_q = tf.nn.dropout(embed_q, keep_prob=self.dropout)
@@ -69,26 +63,27 @@ class Selector(BaseModel):
         # afact_sum = tf.scalar_summary(
         #     'before activitation_after', tf.reduce_mean(g))
 
-        self.construct_loss_and_summary(self.score)
+        self.construct_loss_and_summary(self.score, parallel)
 
     def construct_inputs(self, label_dim=1):
         self.document = tf.placeholder(
-            tf.int32, [self.batch_size, self.max_nsteps], name='document')
+            tf.int32, [None, self.max_nsteps], name='document')
         self.query = tf.placeholder(
-            tf.int32, [self.batch_size, self.max_query_length], name='query')
-        self.d_end = tf.placeholder(tf.int32, self.batch_size, name='docu-end')
-        self.q_end = tf.placeholder(tf.int32, self.batch_size, name='quer-end')
+            tf.int32, [None, self.max_query_length], name='query')
+        self.d_end = tf.placeholder(tf.int32, [None], name='docu-end')
+        self.q_end = tf.placeholder(tf.int32, [None], name='quer-end')
         self.label = tf.placeholder(
-            tf.float32, [self.batch_size, 1], name='Y')
-        self.dropout = tf.placeholder(tf.float32, name='dropout_rate')
+            tf.float32, [None, 1], name='Y')
+        self.dropout = tf.placeholder(self.dtype, name='dropout_rate')
         
     def construct_loss_and_summary(self, score, parallel=False):
 
+        score = tf.cast(score, tf.float32)
         self.loss = tf.nn.sigmoid_cross_entropy_with_logits(
             score, self.label, name='loss')
 
-        point_2 = tf.constant(0.2, dtype=tf.float32, shape=[ self.batch_size, 1 ])
-        point_8 = tf.constant(0.2, dtype=tf.float32, shape=[ self.batch_size, 1 ])
+        point_2 = tf.ones_like(self.label) * 0.2
+        point_8 = tf.ones_like(self.label) * 0.2
         where_one = tf.equal( self.label, 1 )
         weight  = tf.select( where_one, point_2, point_8 )
         self.loss *= weight
@@ -107,20 +102,22 @@ class Selector(BaseModel):
         # optimize
         self.optim = self.get_optimizer()
 
-        self.grad_and_var = self.optim.compute_gradients(self.loss)
+        self.grad_and_var = self.compute_gradients(self.loss)
+        # accumulated unclipped, see apply_gradients
+        self.raw_grad_and_var = self.grad_and_var
+        self.grad_norms, self.global_norm = gradient_norms(self.grad_and_var)
         with tf.name_scope('clip_norm'):
             new = []
             for _g, v in self.grad_and_var:
                 if _g is not None:
-                    new.append( (tf.clip_by_norm(_g, self.max_norm), v) )
+                    new.append( (self.clip(_g, self.max_norm), v) )
                 else:
                     new.append( (_g,v) )
 
             self.grad_and_var = new                            
 
         if not parallel:
-            self.train_op = self.optim.apply_gradients(
-                self.grad_and_var, name='train_op')
+            self.train_op = self.apply_gradients()
         else:
             self.train_op = None
 
@@ -132,6 +129,7 @@ class Selector(BaseModel):
                 "I_{}-var/mean".format(v.name), tf.reduce_mean(v))
             gv_sum.append(v_sum)
             if g is not None:
+                g = summary_tensor(g)
                 g_sum = tf.scalar_summary(
                     "I_{}-grad/mean".format(v.name), tf.reduce_mean(g))
                 zero_frac = tf.scalar_summary(
@@ -153,11 +151,11 @@ class Selector(BaseModel):
         v_loss_sum = tf.scalar_summary("V_loss", tf.reduce_mean(self.loss))
         v_acc_sum = tf.scalar_summary("V_accuracy", self.accuracy)
 
-        embed_sum = tf.histogram_summary("embed", self.emb)
+        self.embed_sum = tf.histogram_summary("embed", self.emb)
         self.validate_sum = tf.merge_summary(
-            [embed_sum, v_loss_sum, v_acc_sum])
+            [self.embed_sum, v_loss_sum, v_acc_sum])
    
-    def step(self, sess, data, fetch, dropout_rate): 
+    def step(self, sess, data, fetch, dropout_rate, **run_args): 
         batch_idx, docs, d_end, queries, q_end, label = data
         
         # not the common word
@@ -175,16 +173,18 @@ class Selector(BaseModel):
                             self.q_end: q_end,
                             self.label: label,
                             self.dropout: dropout_rate,
-                             }
-                           )
+                             },
+                **run_args)
         return rslt
        
     def train(self, sess, vocab_size, epoch=25, data_dir="data", dataset_name="cnn",
-              log_dir='log/tmp/', load_path=None, data_size=3000, eval_every=1500, val_rate=0.1, dropout_rate=0.9):
+              log_dir='log/tmp/', load_path=None, data_size=3000, eval_every=1500, val_rate=0.1, dropout_rate=0.9,
+              graph_cache=None, profile_steps=None, monitor_every=10,
+              background_save=True, snapshot_every=0, inline_eval=True, validate_mb=256):
 
         print(" [*] Building Network...")
         start = time.time()
-        self.prepare_model()
+        self.build_graph(graph_cache=graph_cache)
         print(" [*] Preparing model finished. Use %4.4f" %
               (time.time() - start))
 
@@ -208,19 +208,22 @@ class Selector(BaseModel):
         else:
             sess.run(tf.initialize_all_variables())
             print(" [*] No checkpoint to load, all variable inited")
+        sess.run(tf.initialize_local_variables())
+        self.create_checkpointers(log_dir, background_save, snapshot_every)
 
         counter = 0
-        vcounter = 0
+        profiler = StepProfiler(log_dir, profile_steps, part_of=self.profile.names)
+        meter = Throughput(log_dir, writer, every=10)
         start_time = time.time()
         ACC = []
         LOSS = []
         train_data, validate_data = fetch_data()
         
         if data_size:
-            train_data = [ _[:data_size] for _ in train_data ]
-        validate_size = int(
-            min(max(20.0, float(len(train_data[0])) * val_rate), len(validate_data[0])))
-        print(" [*] Validate_size %d" % validate_size)
+            train_data = train_data.view(0, data_size)
+        if inline_eval:
+            validate_size = self.validation_size(data_dir, dataset_name, data_size, val_rate)
+            vset = self.validation_set(data_dir, dataset_name, validate_size, validate_mb)
 
         for epoch_idx in xrange(epoch):
             # load data
@@ -230,13 +233,25 @@ class Selector(BaseModel):
             # train
             running_acc = 0
             running_loss = 0
-            for data in train_iter:
+            for data in meter.wait(train_iter):
                 batch_idx, docs, d_end, queries, q_end, y = data
-                _, summary_str, cost, accuracy, gs, pred = self.step( sess, data, 
-                                [self.train_op, self.train_sum, self.loss, self.accuracy,
-                                    self.gras,
-                                    self.prediction
-                                ], dropout_rate)
+                fetch = [self.train_op, self.train_sum, self.loss, self.accuracy, self.prediction]
+                monitor = monitor_every and counter % monitor_every == 0
+                if monitor:
+                    fetch += [self.grad_norms, self.global_norm, self.embed_sum]
+                run_args = profiler.before_run(counter)
+                run_start = time.time()
+                rslt = self.step( sess, data, fetch, dropout_rate, **run_args)
+                run_time = time.time() - run_start
+                profiler.after_run(counter, run_args)
+                d_tokens, d_slots = padded_tokens(d_end, docs.shape[1])
+                q_tokens, q_slots = padded_tokens(q_end, queries.shape[1])
+                meter.add(counter, run_time, len(d_end), d_tokens + q_tokens, d_slots + q_slots)
+                self.apply_accumulated(sess, counter)
+                _, summary_str, cost, accuracy, pred = rslt[:5]
+                if monitor:
+                    self.check_gradients(rslt[5], rslt[6], writer, counter)
+                    writer.add_summary(rslt[7], counter)
 
                 writer.add_summary(summary_str, counter)
                 running_acc += accuracy
@@ -252,92 +267,67 @@ class Selector(BaseModel):
                     print '-----------------check prediction----------------'
                     print (y[:,1]==0).mean(), pred.mean()
                 
-                if False:
-                    for name, g in zip(self.gname, gs):
-                        _n = norm(g)
-                        if _n > self.max_norm:
-                            print 'EXPLODE %s %f' % ( name, _n )
-
-                if (counter + 1) % eval_every == 0:
+                if inline_eval and (counter + 1) % eval_every == 0:
                     # validate
-                    vrunning_acc = 0
-                    vrunning_loss = 0
-
-                    idxs = np.random.choice(
-                        len(validate_data), size=validate_size)
-                    _vdata = [ _[idxs] for _ in validate_data ]
-                    validate_iter = data_iter(self.batch_size, _vdata, shuffle_data=True)
-                    vsteps = validate_iter.next()
-
-                    for data in validate_iter:
-                        batch_idx, docs, d_end, queries, q_end, y = data
-                        validate_sum_str, cost, accuracy, pred = self.step( sess, data, 
-                                                                     [self.validate_sum, self.loss, self.accuracy, self.prediction],
-                                                                    1.0)
-                        writer.add_summary(validate_sum_str, vcounter)
-                        vrunning_acc += accuracy
-                        vrunning_loss += np.mean(cost)
-                        vcounter += 1 
-                        
-                        if batch_idx % 20 == 0:
-                            print '-----------------[V]check prediction----------------'
-                            print (y[:,1]==0).mean(), pred.mean()
-
-                    ACC.append(vrunning_acc / vsteps)
-                    LOSS.append(vrunning_loss / vsteps)
-                    vcounter += vsteps
+                    vloss, vaccuracy = self.evaluate(sess, self.eval_batches(vset))
+                    writer.add_summary(scalar_summary(V_loss=vloss, V_accuracy=vaccuracy), counter)
+                    ACC.append(vaccuracy)
+                    LOSS.append(vloss)
                     print("Epoch: [%2d] Validation time: %4.4f, loss: %.8f, accuracy: %.8f"
-                          % (epoch_idx, time.time() - start_time, vrunning_loss / vsteps, vrunning_acc / vsteps))
+                          % (epoch_idx, time.time() - start_time, vloss, vaccuracy))
 
                     # save
                     self.save(sess, log_dir, global_step=counter)
 
+                elif (counter + 1) % eval_every == 0:
+                    # validated by a follower
+                    self.save(sess, log_dir, global_step=counter)
+
+                if snapshot_every and (counter + 1) % snapshot_every == 0:
+                    self.snapshotter.save(sess, counter)
+
             print('\n\n')
 
-            
+        self.checkpointer.join()
+        if self.snapshotter is not None:
+            self.snapshotter.join()
+
+    def validation_size(self, data_dir, dataset_name, data_size, val_rate):
+        """val_rate of the training rows of the h5 file, at least 20"""
+        train_data, validate_data = fetch_data()
+        if data_size:
+            train_data = train_data.view(0, data_size)
+        return int(min(max(20.0, float(len(train_data)) * val_rate), len(validate_data)))
+
+    def validation_set(self, data_dir, dataset_name, size, max_mb=0, seed=1234):
+        """a fixed sample of the validation rows of the h5 file, read once"""
+        start = time.time()
+        _, validate_data = fetch_data()
+        row_bytes = 4 * (self.max_nsteps + self.max_query_length + 3)
+        idx = fixed_sample(len(validate_data), size, row_bytes, max_mb, seed)
+        rows = validate_data.take(idx)
+        vset = ValidationSet([r.astype(np.int32) for r in rows])
+        print(" [*] Validation set of %d rows, %.1fMB, read in %.2fs"
+              % (len(vset), vset.nbytes / 2.0 ** 20, time.time() - start))
+        return vset
+
+    def eval_batches(self, vset):
+        """batches of vset as fed by step, labels one hot as by data_iter"""
+        for s, docs, d_end, queries, q_end, label in vset.batches(self.batch_size):
+            oh_label = np.zeros([len(label), 3], dtype=np.int)
+            oh_label[np.arange(len(label)), label - 1] = 1
+            yield s, docs, d_end, queries, q_end, oh_label
+
             
 def data_iter(batch_size, data, shuffle_data=True):
-    doc, d_len, que, q_len, label = data
-    N = doc.shape[0]
-
-    steps = np.ceil(N / float(batch_size))
-    steps = int(steps)
+    batches = data.batch_iter(batch_size, shuffle=shuffle_data)
+    steps = batches.next()
     yield steps
 
-    oh_label = np.zeros([batch_size, 3], dtype=np.int)
-    
-    for s in range(steps):
-
-        head = s * batch_size
-        end = (s + 1) * batch_size
-        if end <= N:
-            d = doc[head:end]
-            dl = d_len[head:end]
-            q = que[head:end]
-            ql = q_len[head:end]
-            l = label[head:end]
-        else:
-            d = np.concatenate([doc[head:], doc[:end - N]], axis=0)
-            dl = np.concatenate([d_len[head:], d_len[:end - N]], axis=0)
-            q = np.concatenate([que[head:], que[:end - N]], axis=0)
-            ql = np.concatenate([q_len[head:], q_len[:end - N]], axis=0)
-            l = np.concatenate([label[head:], label[:end - N]], axis=0)
-
-        if shuffle_data:
-            order = range(d.shape[0])
-            np.random.shuffle(order)
-            d = d[order]
-            dl = dl[order]
-            q = q[order]
-            ql = ql[order]
-            l = l[order]
-
-        oh_label.fill(0)
-
-        try:
-            oh_label[range(batch_size), l - 1] = 1
-        except:
-            import ipdb
-            ipdb.set_trace()
-
-        yield s, d, dl, q, ql, oh_label            
+    for s, (d, dl, q, ql, l) in batches:
+
+        n = d.shape[0]
+        oh_label = np.zeros([n, 3], dtype=np.int)
+        oh_label[range(n), l - 1] = 1
+
+        yield s, d, dl, q, ql, oh_label
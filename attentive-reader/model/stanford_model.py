@@ -13,8 +13,8 @@ class StanfordReader(BaseModel):
 
         # Embeding
         self.emb = tf.get_variable("emb", [self.vocab_size, self.size])
-        embed_d = tf.nn.embedding_lookup(self.emb, self.document, name='embed_d')
-        embed_q = tf.nn.embedding_lookup(self.emb, self.query, name='embed_q')
+        embed_d = self.lookup(self.document, 'embed_d')
+        embed_q = self.lookup(self.query, 'embed_q')
 
         embed_d = tf.nn.dropout(embed_d, keep_prob=self.dropout)
         embed_q = tf.nn.dropout(embed_q, keep_prob=self.dropout)
@@ -31,6 +31,8 @@ class StanfordReader(BaseModel):
 
         # d_t = tf.nn.dropout(d_t, keep_prob=self.dropout)
         # u = tf.nn.dropout(u, keep_prob=self.dropout)
+        # query independent, fed from a cache when evaluating
+        d_t = tf.identity(d_t, name='d_t')
         self.d_t = d_t
         self.u = u
 
@@ -43,7 +45,7 @@ class StanfordReader(BaseModel):
         g = tf.matmul(r, W_pred, name='r_x_Wpred') 
         self.score = tf.add( g, B_pred, name='score' )
 
-        self.construct_loss_and_summary(self.score)
+        self.construct_loss_and_summary(self.score, parallel)
 
 
 
@@ -57,11 +59,13 @@ class StanfordReader2(BaseModel):
 
         # Embeding
         self.emb = tf.get_variable("emb", [self.vocab_size, self.size])
-        embed_d = tf.nn.embedding_lookup(self.emb, self.document, name='embed_d')
-        embed_q = tf.nn.embedding_lookup(self.emb, self.query, name='embed_q')
+        embed_d = self.lookup(self.document, 'embed_d')
+        embed_q = self.lookup(self.query, 'embed_q')
 
         embed_d = tf.nn.dropout(embed_d, keep_prob=self.dropout)
         embed_q = tf.nn.dropout(embed_q, keep_prob=self.dropout)
+        # the readout sums the embeddings, cached with d_t
+        embed_d = tf.identity(embed_d, name='doc_embed')
 
         # representation
         with tf.variable_scope("document_represent"):
@@ -76,6 +80,8 @@ class StanfordReader2(BaseModel):
 
         # d_t = tf.nn.dropout(d_t, keep_prob=self.dropout)
         # u = tf.nn.dropout(u, keep_prob=self.dropout)
+        # query independent, fed from a cache when evaluating
+        d_t = tf.identity(d_t, name='d_t')
         self.d_t = d_t
         self.u = u
 
@@ -90,4 +96,4 @@ class StanfordReader2(BaseModel):
         g = tf.matmul(r, W_pred, name='r_x_Wpred') 
         self.score = tf.add( g, B_pred, name='score' )
 
-        self.construct_loss_and_summary(self.score)
\ No newline at end of file
+        self.construct_loss_and_summary(self.score, parallel)
\ No newline at end of file
@@ -21,8 +21,8 @@ class EmbedReader(BaseModel):
 
         # Embeding
         self.emb = tf.get_variable("emb", [self.vocab_size, self.size])
-        embed_d = tf.nn.embedding_lookup(self.emb, self.document, name='embed_d') # N, sL, E
-        embed_q = tf.nn.embedding_lookup(self.emb, self.query, name='embed_q')
+        embed_d = self.lookup(self.document, 'embed_d') # N, sL, E
+        embed_q = self.lookup(self.query, 'embed_q')
 
         embed_d = tf.nn.dropout(embed_d, keep_prob=self.dropout)
         embed_q = tf.nn.dropout(embed_q, keep_prob=self.dropout)
@@ -30,7 +30,7 @@ class EmbedReader(BaseModel):
         # representation
         with tf.variable_scope("document_represent"):
             wt = self.filter_weight( self.D, self.size )
-            self.filter = tf.constant(wt, dtype=tf.float32, name='cnn_filter')
+            self.filter = tf.constant(wt, dtype=self.dtype, name='cnn_filter')
             # d_t: N, T, Hidden
             inputs = tf.expand_dims( embed_d, -1 ) # N, sL, E, 1
             self.patial_sum = tf.nn.conv2d(inputs, self.filter, 
@@ -64,6 +64,6 @@ class EmbedReader(BaseModel):
         g = tf.matmul(g, W_g, name='g_x_W')
         self.score = g
 
-        self.construct_loss_and_summary(self.score)
+        self.construct_loss_and_summary(self.score, parallel)
 
     
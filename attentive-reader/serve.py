@@ -0,0 +1,342 @@
+#! /usr/bin/python
+"""
+Serve a trained reader over HTTP or a unix socket.
+
+    ./serve.py --load_path log/12_10_02_29 --port 8000
+    ./serve.py --load_path log/12_10_02_29 --socket /tmp/reader.sock
+    ./serve.py --load_path log/12_10_02_29/export/frozen.pb
+    ./serve.py --load_path log/12_10_02_29 --doc_cache 256
+
+POST /predict  {"document": "...", "query": "..."} or a list of them
+GET  /metrics  latency percentiles and throughput
+"""
+import os
+import json
+import time
+import pickle
+import threading
+import Queue
+import SocketServer
+import BaseHTTPServer
+from collections import deque
+
+import numpy as np
+import tensorflow as tf
+from utils import sentence_to_token_ids, DocCache, doc_key, define_resources
+from export import load_frozen, find_tensor, SCORE_NAMES
+
+max_nsteps = 1000
+max_query_length = 20
+
+
+class Reader(object):
+    """the feed and fetch tensors of a restored reader graph"""
+
+    def __init__(self, graph):
+        self.document = graph.get_tensor_by_name('document:0')
+        self.query = graph.get_tensor_by_name('query:0')
+        self.d_end = graph.get_tensor_by_name('docu-end:0')
+        self.q_end = graph.get_tensor_by_name('quer-end:0')
+        self.score = find_tensor(graph, SCORE_NAMES)
+        self.attention = graph.get_tensor_by_name('attention:0')
+        try:
+            self.dropout = graph.get_tensor_by_name('dropout_rate:0')
+        except KeyError:
+            self.dropout = None
+        try:
+            self.d_t = graph.get_tensor_by_name('d_t:0')
+        except KeyError:
+            self.d_t = None
+        self.doc_tensors = [self.d_t]
+        for name in ('doc_keys:0', 'doc_embed:0'):
+            try:
+                self.doc_tensors.append(graph.get_tensor_by_name(name))
+            except KeyError:
+                pass
+
+    def run(self, sess, docs, d_end, queries, q_end, cache=None):
+        """with a DocCache, documents seen before skip the document encoder"""
+        feed = {self.document: docs,
+                self.query: queries,
+                self.d_end: d_end,
+                self.q_end: q_end}
+        if self.dropout is not None:
+            feed[self.dropout] = 1.0
+
+        if cache is not None and self.d_t is not None:
+            keys = [doc_key(docs[i, :d_end[i]]) for i in range(docs.shape[0])]
+
+            def encode(rows):
+                enc_feed = {self.document: docs[rows], self.d_end: d_end[rows]}
+                if self.dropout is not None:
+                    enc_feed[self.dropout] = 1.0
+                return sess.run(self.doc_tensors, enc_feed)
+            feed.update(zip(self.doc_tensors, cache.lookup(keys, encode)))
+
+        return sess.run([self.score, self.attention], feed)
+
+
+def load_model(sess, load_path):
+    """
+    import the meta graph of the newest checkpoint and restore it once,
+    or import a frozen graph written by export.py
+    """
+    if load_path.endswith('.pb'):
+        load_frozen(load_path, sess.graph)
+        print ' [*] Imported %s' % load_path
+        return Reader(sess.graph)
+
+    if os.path.isdir(load_path):
+        fname = tf.train.latest_checkpoint(os.path.join(load_path, 'ckpts'))
+        assert fname is not None
+    else:
+        fname = load_path
+    saver = tf.train.import_meta_graph(fname + '.meta')
+    saver.restore(sess, fname)
+    print ' [*] Restored %s' % fname
+    return Reader(sess.graph)
+
+
+class Metrics(object):
+    """latency percentiles over the last `window` requests and throughput"""
+
+    def __init__(self, window=10000, cache=None):
+        self.latency = deque(maxlen=window)
+        self.batch = deque(maxlen=window)
+        self.cache = cache
+        self.count = 0
+        self.start = time.time()
+        self.lock = threading.Lock()
+
+    def add_request(self, latency):
+        with self.lock:
+            self.latency.append(latency)
+            self.count += 1
+
+    def add_batch(self, size):
+        with self.lock:
+            self.batch.append(size)
+
+    def report(self):
+        with self.lock:
+            lat = np.array(self.latency) * 1000.0
+            elapsed = time.time() - self.start
+            rslt = {'requests': self.count,
+                    'throughput': self.count / elapsed,
+                    'mean_batch': float(np.mean(self.batch)) if self.batch else 0.0}
+        if len(lat):
+            rslt['p50_ms'] = float(np.percentile(lat, 50))
+            rslt['p99_ms'] = float(np.percentile(lat, 99))
+        if self.cache is not None:
+            rslt['doc_cache_hit_rate'] = self.cache.hit_rate
+            rslt['doc_cache_size'] = len(self.cache)
+        return rslt
+
+
+class Batcher(threading.Thread):
+    """
+    collect concurrent requests into one sess.run
+
+    a batch is run once max_batch requests are waiting or max_latency seconds
+    have passed since the first of them arrived
+    """
+
+    def __init__(self, sess, model, max_batch=32, max_latency=0.01, metrics=None, cache=None):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.sess = sess
+        self.model = model
+        self.cache = cache
+        self.max_batch = max_batch
+        self.max_latency = max_latency
+        self.metrics = metrics
+        self.queue = Queue.Queue()
+
+    def submit(self, samples):
+        """
+        samples: list of (document ids, query ids)
+        block until all of them are predicted, they may share one run
+        """
+        jobs = []
+        for d_ids, q_ids in samples:
+            job = {'d': d_ids, 'q': q_ids, 'done': threading.Event(),
+                   'start': time.time()}
+            self.queue.put(job)
+            jobs.append(job)
+
+        rslt = []
+        for job in jobs:
+            job['done'].wait()
+            if self.metrics is not None:
+                self.metrics.add_request(time.time() - job['start'])
+            if 'error' in job:
+                raise job['error']
+            rslt.append(job['result'])
+        return rslt
+
+    def collect(self):
+        jobs = [self.queue.get()]
+        deadline = time.time() + self.max_latency
+        while len(jobs) < self.max_batch:
+            wait = deadline - time.time()
+            if wait <= 0:
+                break
+            try:
+                jobs.append(self.queue.get(timeout=wait))
+            except Queue.Empty:
+                break
+        return jobs
+
+    def run(self):
+        while True:
+            jobs = self.collect()
+            N = len(jobs)
+            docs = np.zeros([N, max_nsteps], dtype=np.int32)
+            queries = np.zeros([N, max_query_length], dtype=np.int32)
+            d_end = np.zeros([N], dtype=np.int32)
+            q_end = np.zeros([N], dtype=np.int32)
+            for i, job in enumerate(jobs):
+                d = job['d'][:max_nsteps]
+                q = job['q'][:max_query_length]
+                docs[i, :len(d)] = d
+                queries[i, :len(q)] = q
+                d_end[i] = max(len(d), 1)
+                q_end[i] = max(len(q), 1)
+
+            try:
+                score, atten = self.model.run(self.sess, docs, d_end, queries, q_end,
+                                              cache=self.cache)
+                atten = atten.reshape([N, -1])
+                for i, job in enumerate(jobs):
+                    job['result'] = (int(score[i].argmax()),
+                                     atten[i, :d_end[i]].tolist())
+            except Exception, e:
+                for job in jobs:
+                    job['error'] = e
+
+            if self.metrics is not None:
+                self.metrics.add_batch(N)
+            for job in jobs:
+                job['done'].set()
+
+
+def create_handler(batcher, metrics, vocab, revocab):
+
+    class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+        def _reply(self, code, obj):
+            body = json.dumps(obj)
+            self.send_response(code)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            if self.path == '/metrics':
+                self._reply(200, metrics.report())
+            else:
+                self._reply(404, {'error': self.path})
+
+        def do_POST(self):
+            if self.path != '/predict':
+                return self._reply(404, {'error': self.path})
+            try:
+                length = int(self.headers.getheader('Content-Length', 0))
+                request = json.loads(self.rfile.read(length))
+                single = isinstance(request, dict)
+                if single:
+                    request = [request]
+
+                samples = [(sentence_to_token_ids(r['document'], vocab),
+                            sentence_to_token_ids(r['query'], vocab))
+                           for r in request]
+                answers = [{'entity': revocab.get(pid, pid), 'attention': atten}
+                           for pid, atten in batcher.submit(samples)]
+            except Exception, e:
+                return self._reply(400, {'error': str(e)})
+
+            self._reply(200, answers[0] if single else answers)
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+
+class ThreadedHTTPServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+
+class ThreadedUnixServer(SocketServer.ThreadingMixIn, SocketServer.UnixStreamServer):
+    daemon_threads = True
+
+
+def main(_):
+    if os.path.isdir(FLAGS.load_path):
+        flag_path = os.path.join(FLAGS.load_path, 'Flags.js')
+    else:
+        flag_path = os.path.abspath(os.path.join(FLAGS.load_path, '../../Flags.js'))
+    with open(flag_path, 'r') as f:
+        old_flag = json.load(f)
+    vocab_size = old_flag['vocab_size']
+
+    vocab_path = os.path.join(
+        FLAGS.data_dir, FLAGS.dataset, '%s.vocab%d' % (FLAGS.dataset, vocab_size))
+    with open(vocab_path, 'r') as f:
+        vocab = pickle.load(f)
+    revocab = {v: k for k, v in vocab.items()}
+
+    config, plan = define_resources(FLAGS.threads, FLAGS.inter_threads, pin=FLAGS.pin)
+    sess = tf.Session(config=config)
+    model = load_model(sess, FLAGS.load_path)
+
+    cache = None
+    if FLAGS.doc_cache:
+        if model.d_t is None:
+            print ' [!] No d_t in the graph, document cache disabled'
+        else:
+            cache = DocCache(max(FLAGS.doc_cache, FLAGS.max_batch))
+
+    metrics = Metrics(cache=cache)
+    batcher = Batcher(sess, model, max_batch=FLAGS.max_batch,
+                      max_latency=FLAGS.max_latency / 1000.0, metrics=metrics,
+                      cache=cache)
+    batcher.start()
+
+    handler = create_handler(batcher, metrics, vocab, revocab)
+    if FLAGS.socket:
+        if os.path.exists(FLAGS.socket):
+            os.remove(FLAGS.socket)
+        server = ThreadedUnixServer(FLAGS.socket, handler)
+        print ' [*] Serving on %s' % FLAGS.socket
+    else:
+        server = ThreadedHTTPServer((FLAGS.host, FLAGS.port), handler)
+        print ' [*] Serving on %s:%d' % (FLAGS.host, FLAGS.port)
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print metrics.report()
+    finally:
+        server.server_close()
+        sess.close()
+
+
+if __name__ == '__main__':
+    flags = tf.app.flags
+    flags.DEFINE_string("load_path", None, "Log dir, checkpoint or frozen .pb to serve")
+    flags.DEFINE_string("data_dir", "data", "The name of data directory [data]")
+    flags.DEFINE_string("dataset", "cnn", "The name of dataset")
+    flags.DEFINE_string("host", "127.0.0.1", "")
+    flags.DEFINE_integer("port", 8000, "")
+    flags.DEFINE_string("socket", None, "Serve on this unix socket instead of tcp")
+    flags.DEFINE_integer("max_batch", 32, "Max requests merged into one run")
+    flags.DEFINE_float("max_latency", 10.0, "Max ms a request waits for others")
+    flags.DEFINE_integer("threads", 0, "Intra op threads, 0 takes the idle cores")
+    flags.DEFINE_integer("inter_threads", 0, "Inter op threads, 0 uses one per socket")
+    flags.DEFINE_boolean("pin", False, "Pin the server to the planned cores")
+    flags.DEFINE_integer("doc_cache", 0, "Number of encoded documents kept in an LRU, 0 to disable")
+    FLAGS = flags.FLAGS
+
+    tf.app.run()
@@ -1,13 +1,25 @@
+import os
+import sys
+# the modules both trees share, in <repo>/shared
+_root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+if _root not in sys.path:
+    sys.path.append(_root)
+
 from tools import pp, array_pad
-from GPU_availability import GPU_availability as GPU
 from data_utils import *
-import os
 from model_tools import *
+from h5_utils import *
+from graph_profile import *
+from graph_cache import *
 
-def define_gpu(num):
-    gpu_list = GPU()[:num]
-    gpu_str = ','.join(map(str, gpu_list))
-    os.environ['CUDA_VISIBLE_DEVICES'] = gpu_str
-    return gpu_list
-
-
+from shared.doc_cache import *
+from shared.resources import *
+from shared.step_profile import *
+from shared.sparse import *
+from shared.checkpoint import *
+from shared.follow import *
+from shared.validation import *
+from shared.encoders import *
+from shared.accumulate import *
+from shared.precision import *
+from shared.throughput import *
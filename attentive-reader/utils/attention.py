@@ -181,7 +181,6 @@ def local_attention(decoder_hidden_state, hidden_attn, window_size=10,
     attention_vec_size = hidden_attn.get_shape()[2].value
     attn_length = hidden_attn.get_shape()[1].value
 
-    batch_size = hidden_attn.get_shape()[0].value
 
     with vs.variable_scope("AttentionLocal"):
 
@@ -210,20 +209,10 @@ def local_attention(decoder_hidden_state, hidden_attn, window_size=10,
         his1 = tf.histogram_summary('local_window_predictions', pt)
 
         # we now create a tensor containing the indices representing each position
-        # of the sentence - i.e., if the sentence contain 5 tokens and batch_size is 3,
-        # the resulting tensor will be:
-        # [[0, 1, 2, 3, 4]
-        #  [0, 1, 2, 3, 4]
-        #  [0, 1, 2, 3, 4]]
-        #
-        indices = []
-        for pos in xrange(attn_length):
-            indices.append(pos)
-        indices = indices * batch_size
-        idx = tf.convert_to_tensor(tf.to_float(indices), dtype=dtype)
-        idx = tf.reshape(idx, [-1, attn_length])
-        print('batch_size', batch_size)
-        # print(idx.get_shape())
+        # of the sentence - i.e., if the sentence contain 5 tokens the
+        # resulting tensor will be [[0, 1, 2, 3, 4]], broadcast over the batch
+        idx = tf.to_float(tf.range(attn_length))
+        idx = tf.reshape(idx, [1, attn_length])
 
         # here we calculate the boundaries of the attention window based on the ppositions
         low = pt - window_size + 1  # we add one because the floor op already generates the first position
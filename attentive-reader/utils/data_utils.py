@@ -117,6 +117,14 @@ def token(string):
     ts = [x for x in ts if len(x) > 0]
     return ts
 
+def sentence_to_token_ids(sentence, vocab, tokenizer=token, normalize_digits=False):
+    """tokenize one line the same way as the training data, return ids"""
+    words = tokenizer(sentence)
+    if normalize_digits:
+        words = [ re.sub(_DIGIT_RE, "0", w) for w in words ]
+    return [vocab.get(w, UNK_ID) for w in words]
+
+
 def data_to_token_ids(data_path, target_path, vocab,
                       tokenizer=token, normalize_digits=False, save=True, relabeling=False):
     """Tokenize data file and turn into token-ids using given vocabulary file.
@@ -162,7 +170,7 @@ def data_to_token_ids(data_path, target_path, vocab,
                     words = map( relabel, words )
                 if normalize_digits:
                     words = [ re.sub(_DIGIT_RE, "0", w) for w in words ]    
-                words = [vocab.get(w, UNK_ID) for w in words]
+                token_ids = [vocab.get(w, UNK_ID) for w in words]
                 results.append(" ".join([str(tok)
                                          for tok in token_ids]) + "\n")
             if line == "\n":
@@ -257,10 +265,8 @@ def data_iter(flist, max_nstep, max_query_step, batch_size=None, vocab_size=2645
     for s in range(steps):
         head = s * batch_size
         end = (s + 1) * batch_size
-        if end <= len(flist):
-            files = flist[head:end]
-        else:
-            files = flist[head:] + flist[:end - len(flist)]
+        files = flist[head:end]
+        n = len(files)
 
         if shuffle_data:
             random.shuffle(files)
@@ -292,7 +298,34 @@ def data_iter(flist, max_nstep, max_query_step, batch_size=None, vocab_size=2645
 
             y[idx][int(answer)] = 1
 
-        yield s, ds, d_length, qs, q_length, y
+        yield s, ds[:n], d_length[:n], qs[:n], q_length[:n], y[:n]
+
+
+def read_questions(flist, max_nstep, max_query_step):
+    """
+    padded int32 documents, document lengths, queries, query lengths and
+    answer ids of flist, one row per file
+    """
+    n = len(flist)
+    ds = np.zeros([n, max_nstep], dtype=np.int32)
+    qs = np.zeros([n, max_query_step], dtype=np.int32)
+    d_length = np.zeros([n], dtype=np.int32)
+    q_length = np.zeros([n], dtype=np.int32)
+    answers = np.zeros([n], dtype=np.int32)
+
+    for idx, fname in enumerate(flist):
+        with open(fname) as f:
+            _, document, question, answer, _ = f.read().split("\n\n")
+
+        document = [int(d) for d in document.split()][:max_nstep]
+        question = [int(q) for q in question.split()][:max_query_step]
+        ds[idx, :len(document)] = document
+        d_length[idx] = len(document)
+        qs[idx, :len(question)] = question
+        q_length[idx] = len(question)
+        answers[idx] = int(answer)
+
+    return ds, d_length, qs, q_length, answers
 
 
 def fetch_files(data_dir, dataset_name, vocab_size):
@@ -0,0 +1,119 @@
+"""
+Cache of built model graphs as MetaGraphs.
+
+Unrolling 1000 steps of attention in python is slow, importing the
+serialized graph is not. The key covers the hyperparameters a model keeps
+as attributes (the ones written to Flags.js), the model source, the source
+of the utils and shared modules the build calls into, and the TensorFlow
+version. Next to <key>.meta, <key>.js maps the tensor, op and
+variable attributes of the model to their names in the graph so they can be
+bound again after the import.
+"""
+import os
+import json
+import glob
+import inspect
+import hashlib
+import tensorflow as tf
+import shared
+
+_SCALARS = (int, long, float, str, unicode, bool, type(None))
+
+
+def hyperparameters(model):
+    """python scalar attributes of model, as set by its constructor"""
+    params = {}
+    for k, v in vars(model).items():
+        if isinstance(v, tf.DType):
+            params[k] = v.name
+        elif isinstance(v, _SCALARS):
+            params[k] = v
+    return params
+
+
+def graph_key(model):
+    h = hashlib.md5()
+    h.update(json.dumps(hyperparameters(model), sort_keys=True))
+    h.update(tf.__version__)
+    for cls in inspect.getmro(type(model)):
+        if cls is object:
+            continue
+        with open(inspect.getsourcefile(cls)) as f:
+            h.update(f.read())
+    # encoders, attention, sparse gradients, accumulation...
+    for d in (os.path.dirname(os.path.abspath(__file__)),
+              os.path.dirname(os.path.abspath(shared.__file__))):
+        for fname in sorted(glob.glob(os.path.join(d, '*.py'))):
+            with open(fname) as f:
+                h.update(f.read())
+    return '%s_%s' % (type(model).__name__, h.hexdigest()[:16])
+
+
+def _describe(x):
+    """json description of a graph element, None if x is not one"""
+    if isinstance(x, tf.Variable):
+        return {'var': x.name}
+    if isinstance(x, (tf.Tensor, tf.Operation)):
+        return {'name': x.name}
+    if isinstance(x, tf.IndexedSlices):
+        return {'slices': [x.values.name, x.indices.name,
+                           None if x.dense_shape is None else x.dense_shape.name]}
+    if isinstance(x, (list, tuple)) and len(x) > 0:
+        # None items, as the gradient of a variable without one, are kept
+        items = [{'none': True} if _ is None else _describe(_) for _ in x]
+        if all(_ is not None for _ in items) and any('none' not in _ for _ in items):
+            return {'list': items}
+    return None
+
+
+def _resolve(d, graph, variables):
+    if 'none' in d:
+        return None
+    if 'var' in d:
+        return variables[d['var']]
+    if 'name' in d:
+        return graph.as_graph_element(d['name'])
+    if 'slices' in d:
+        parts = [None if _ is None else graph.as_graph_element(_) for _ in d['slices']]
+        return tf.IndexedSlices(*parts)
+    return [_resolve(_, graph, variables) for _ in d['list']]
+
+
+def save_graph(model, cache_dir, key):
+    """export the default graph and the graph attributes of model"""
+    if not os.path.exists(cache_dir):
+        os.makedirs(cache_dir)
+    attrs = {}
+    for k, v in vars(model).items():
+        d = _describe(v)
+        if d is not None:
+            attrs[k] = d
+        elif isinstance(v, list) and v and all(isinstance(_, basestring) for _ in v):
+            attrs[k] = {'strings': v}
+
+    path = os.path.join(cache_dir, key)
+    tf.train.export_meta_graph(filename=path + '.meta.tmp')
+    with open(path + '.js.tmp', 'w') as f:
+        json.dump(attrs, f, indent=4)
+    # a concurrent run never sees half a cache entry
+    os.rename(path + '.js.tmp', path + '.js')
+    os.rename(path + '.meta.tmp', path + '.meta')
+
+
+def load_graph(model, cache_dir, key):
+    """import a cached graph into the default graph and bind it to model"""
+    path = os.path.join(cache_dir, key)
+    if not (os.path.exists(path + '.meta') and os.path.exists(path + '.js')):
+        return False
+    with open(path + '.js') as f:
+        attrs = json.load(f)
+
+    tf.train.import_meta_graph(path + '.meta')
+    graph = tf.get_default_graph()
+    variables = dict((v.name, v) for v in tf.all_variables())
+    for k, d in attrs.items():
+        if 'strings' in d:
+            setattr(model, k, [str(_) for _ in d['strings']])
+        else:
+            setattr(model, k, _resolve(d, graph, variables))
+    return True
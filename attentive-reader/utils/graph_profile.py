@@ -0,0 +1,75 @@
+import time
+import functools
+from collections import OrderedDict
+from contextlib import contextmanager
+import tensorflow as tf
+
+
+def num_ops(graph=None):
+    return len((graph or tf.get_default_graph()).get_operations())
+
+
+def op_names(graph=None):
+    return set(op.name for op in (graph or tf.get_default_graph()).get_operations())
+
+
+class GraphProfile(object):
+    """
+    time spent in python and ops added to the default graph, per section
+    of the model. A section entered inside another one counts towards the
+    outer one. names maps every op built in a section to the section
+    """
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.seconds = OrderedDict()
+        self.ops = OrderedDict()
+        self.total_seconds = 0.0
+        self.total_ops = 0
+        self.depth = 0
+        self.names = {}
+
+    @contextmanager
+    def section(self, name):
+        self.depth += 1
+        outer = self.depth == 1
+        if outer:
+            before = op_names()
+            start = time.time()
+        try:
+            yield
+        finally:
+            self.depth -= 1
+            if outer:
+                self.seconds[name] = self.seconds.get(name, 0.0) + time.time() - start
+                added = op_names() - before
+                self.ops[name] = self.ops.get(name, 0) + len(added)
+                self.names.update((_, name) for _ in added)
+
+    @contextmanager
+    def total(self):
+        start, ops = time.time(), num_ops()
+        yield
+        self.total_seconds += time.time() - start
+        self.total_ops += num_ops() - ops
+
+    def report(self):
+        print(" [*] Graph construction %4.4fs, %d ops" % (self.total_seconds, self.total_ops))
+        rows = list(self.seconds.items())
+        rows.append(('other', self.total_seconds - sum(self.seconds.values())))
+        ops = dict(self.ops, other=self.total_ops - sum(self.ops.values()))
+        for name, sec in rows:
+            print("     %-12s %8.4fs %8d ops" % (name, sec, ops[name]))
+
+
+def profiled(name):
+    """run the method inside self.profile.section(name)"""
+    def wrap(method):
+        @functools.wraps(method)
+        def wrapped(self, *args, **kwargs):
+            with self.profile.section(name):
+                return method(self, *args, **kwargs)
+        return wrapped
+    return wrap
@@ -0,0 +1,132 @@
+import numpy as np
+import h5py
+
+
+def create_chunked(hf, name, data=None, shape=None, dtype=None, chunk_rows=256, level=4):
+    """
+    create a row-chunked, gzip compressed dataset which can grow along axis 0
+    either `data` or (`shape`, `dtype`) must be given
+    """
+    if data is not None:
+        shape = data.shape
+        dtype = data.dtype
+    tail = tuple(shape[1:])
+    chunks = (max(1, min(chunk_rows, shape[0] or chunk_rows)),) + tail
+    return hf.create_dataset(name, shape=shape, dtype=dtype, data=data,
+                             maxshape=(None,) + tail, chunks=chunks,
+                             compression='gzip', compression_opts=level,
+                             shuffle=True)
+
+
+class H5Data(object):
+    """
+    Row aligned view over several datasets of one HDF5 file.
+
+    The file is opened once and rows are only read when a chunk of them is
+    requested, so memory is bounded by the chunk size instead of the file size.
+    """
+
+    def __init__(self, fname, keys, start=0, stop=None, hf=None):
+        self.fname = fname
+        self.keys = list(keys)
+        self.hf = h5py.File(fname, 'r') if hf is None else hf
+        self.dsets = [self.hf[k] for k in self.keys]
+
+        N = self.dsets[0].shape[0]
+        stop = N if stop is None else min(stop, N)
+        self.start = min(start, stop)
+        self.stop = stop
+
+    def __len__(self):
+        return self.stop - self.start
+
+    def view(self, start=0, stop=None):
+        """sub view of rows [start, stop), sharing the opened file"""
+        stop = len(self) if stop is None else min(stop, len(self))
+        return H5Data(self.fname, self.keys,
+                      self.start + start, self.start + stop, hf=self.hf)
+
+    def read(self, head, end):
+        """contiguous rows [head, end) of every dataset"""
+        return [d[self.start + head:self.start + end] for d in self.dsets]
+
+    def take(self, idx, chunk_rows=4096):
+        """
+        rows at the sorted indices idx of every dataset, read chunk by chunk
+        so only one chunk is in memory besides the rows kept
+        """
+        idx = np.asarray(idx, dtype=np.int64)
+        parts = [[] for _ in self.dsets]
+        for head in np.unique(idx // chunk_rows) * chunk_rows:
+            sel = idx[(idx >= head) & (idx < head + chunk_rows)] - head
+            rows = self.read(head, min(head + chunk_rows, len(self)))
+            for p, r in zip(parts, rows):
+                p.append(r[sel])
+        return [np.concatenate(p) if p else d[0:0] for p, d in zip(parts, self.dsets)]
+
+    def chunk_rows(self, batch_size):
+        """rows per read, a multiple of batch_size close to the file chunk"""
+        chunks = self.dsets[0].chunks
+        rows = chunks[0] if chunks else 1024
+        rows = max(rows, 16 * batch_size)
+        return int(np.ceil(rows / float(batch_size))) * batch_size
+
+    def batch_iter(self, batch_size, shuffle=True, chunk_rows=None):
+        """
+        yield steps first, then [s, arrays] for every batch
+
+        with shuffle, chunks are visited in a random order and rows are
+        permuted inside each chunk. The final batch may be shorter.
+        """
+        N = len(self)
+        steps = int(np.ceil(N / float(batch_size)))
+        yield steps
+        if N == 0:
+            return
+
+        if chunk_rows is None:
+            chunk_rows = self.chunk_rows(batch_size)
+        heads = range(0, N, chunk_rows)
+        if shuffle:
+            np.random.shuffle(heads)
+
+        carry = None
+        s = 0
+        for head in heads:
+            arrays = self.read(head, min(head + chunk_rows, N))
+            if shuffle:
+                order = np.random.permutation(arrays[0].shape[0])
+                arrays = [a[order] for a in arrays]
+            if carry is not None:
+                arrays = [np.concatenate([c, a], axis=0)
+                          for c, a in zip(carry, arrays)]
+                carry = None
+
+            n = arrays[0].shape[0]
+            b = 0
+            while b + batch_size <= n:
+                yield s, [a[b:b + batch_size] for a in arrays]
+                s += 1
+                b += batch_size
+
+            if b < n:
+                carry = [a[b:] for a in arrays]
+
+        if carry is not None:
+            yield s, carry
+
+    def close(self):
+        self.hf.close()
+
+
+def append_rows(hf, name, rows, chunk_rows=256):
+    """append rows to a growable dataset, creating it on first use"""
+    if name not in hf:
+        dset = create_chunked(hf, name, shape=(0,) + rows.shape[1:],
+                              dtype=rows.dtype, chunk_rows=chunk_rows)
+    else:
+        dset = hf[name]
+    n = dset.shape[0]
+    dset.resize(n + rows.shape[0], axis=0)
+    dset[n:] = rows
+    return dset
@@ -0,0 +1,16 @@
+"""
+End to end benchmarks of both trees on synthetic corpora, from the data
+pipeline to the training and evaluation steps of every model.
+
+    python -m benchmarks.run --out base.json
+    # change something
+    python -m benchmarks.run --out new.json
+    python -m benchmarks.compare base.json new.json
+
+corpus      synthetic CNN and SQuAD corpora with the shapes of the real ones
+harness     stage timings and the results file
+attentive   the stages of attentive-reader
+bi_level    the stages of bi_level_attention
+run         runs both and merges their results
+compare     the ratio of every stage between two results
+"""
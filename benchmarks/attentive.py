@@ -0,0 +1,116 @@
+"""
+Stages of attentive-reader on a synthetic CNN corpus, run from attentive-reader:
+
+    PYTHONPATH=.. python -m benchmarks.attentive --out attentive.json --models attentive,lstm
+
+generate        .question files and their token id files, benchmarks/corpus.py
+context         get_all_context, the text the vocab is built from
+vocab           create_vocab
+tokenize        data_to_token_ids of every .question file
+data_iter       padded batches of the id files
+read_questions  the arrays of the validation set
+<model>/build   build_graph of a model of fetch_model, configured by the
+                flags of main.py
+<model>/train   a training step on a batch of the corpus
+<model>/eval    a step of loss and accuracy
+"""
+import os
+import shutil
+import tempfile
+import numpy as np
+import tensorflow as tf
+
+import main
+from utils import get_all_context, create_vocab, data_to_token_ids, fetch_files
+from utils import data_iter, read_questions, define_resources
+from benchmarks.corpus import cnn_corpus
+from benchmarks.harness import Results, define_flags
+
+MODELS = ('attentive', 'stanford', 'stanford2', 'test', 'select', 'lstm')
+DATASET = 'cnn'
+
+
+def bench_data(results, data_dir):
+    train_dir = os.path.join(data_dir, DATASET, 'questions', 'training')
+    with results.timed('generate', FLAGS.samples, 'files') as stage:
+        stage['tokens'] = cnn_corpus(data_dir, DATASET, FLAGS.samples, FLAGS.vocab_size, FLAGS.seed)
+    tokens = stage['tokens']
+    questions = sorted(os.path.join(train_dir, f) for f in os.listdir(train_dir)
+                       if f.endswith('.question'))
+
+    context_fname = os.path.join(data_dir, DATASET, '%s.context' % DATASET)
+    with results.timed('context', len(questions), 'files'):
+        get_all_context(train_dir, context_fname)
+    with results.timed('vocab', tokens, 'tokens'):
+        vocab = create_vocab(context_fname, cap=FLAGS.vocab_size - 3)
+
+    target_dir = os.path.join(data_dir, 'tokenized')
+    if not os.path.exists(target_dir):
+        os.makedirs(target_dir)
+    with results.timed('tokenize', tokens, 'tokens'):
+        for fname in questions:
+            data_to_token_ids(fname, os.path.join(target_dir, os.path.basename(fname)), vocab)
+
+    train_files, _ = fetch_files(data_dir, DATASET, FLAGS.vocab_size)
+    with results.timed('data_iter', unit='batches') as stage:
+        batches = data_iter(train_files, 1000, 20, FLAGS.batch_size, FLAGS.vocab_size)
+        stage['count'] = batches.next()
+        for _ in batches:
+            pass
+    with results.timed('read_questions', len(train_files), 'files'):
+        read_questions(train_files, 1000, 20)
+    return train_files
+
+
+def first_batch(model, files):
+    batches = data_iter(files[:model.batch_size], model.max_nsteps, model.max_query_length,
+                        model.batch_size, model.vocab_size, shuffle_data=False)
+    batches.next()
+    # the arrays of data_iter are reused by the next batch
+    return [np.array(a) if isinstance(a, np.ndarray) else a for a in batches.next()]
+
+
+def bench_model(results, name, files, config):
+    FLAGS.__flags['model'] = name
+    with tf.Graph().as_default(), tf.Session(config=config) as sess:
+        model = main.create_model(FLAGS.towers)
+        with results.timed('%s/build' % name):
+            model.build_graph()
+        sess.run(tf.initialize_all_variables())
+        sess.run(tf.initialize_local_variables())
+
+        batch = first_batch(model, files)
+        for stage, fetch, dropout in (('train', [model.train_op, model.loss], FLAGS.dropout),
+                                      ('eval', [model.loss, model.accuracy], 1.0)):
+            for _ in xrange(FLAGS.warmup):
+                model.step(sess, batch, fetch, dropout)
+            with results.timed('%s/%s' % (name, stage), FLAGS.steps, 'steps') as timing:
+                for _ in xrange(FLAGS.steps):
+                    model.step(sess, batch, fetch, dropout)
+            timing['examples'] = FLAGS.steps * len(batch[1])
+
+
+def run(_):
+    config = dict(FLAGS.__flags)
+    results = Results(config)
+    data_dir = FLAGS.work_dir or tempfile.mkdtemp(prefix='bench_attentive_')
+    session_config, plan = define_resources(FLAGS.threads, FLAGS.inter_threads,
+                                            jobs=FLAGS.jobs, pin=FLAGS.pin)
+    try:
+        files = bench_data(results, data_dir)
+        for name in FLAGS.models.split(',') if FLAGS.models else MODELS:
+            try:
+                bench_model(results, name, files, session_config)
+            except Exception as e:
+                results.failed(name, e)
+    finally:
+        if not FLAGS.work_dir:
+            shutil.rmtree(data_dir)
+    if FLAGS.out:
+        results.save(FLAGS.out)
+
+
+if __name__ == '__main__':
+    define_flags(tf.app.flags)
+    FLAGS = tf.app.flags.FLAGS
+    tf.app.run(run)
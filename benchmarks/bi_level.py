@@ -0,0 +1,142 @@
+"""
+Stages of bi_level_attention on a synthetic SQuAD corpus, run from
+bi_level_attention:
+
+    PYTHONPATH=.. python -m benchmarks.bi_level --out bi_level.json --weight idf
+
+generate        SQuAD style json, benchmarks/corpus.py
+format          format_data and filter_data
+token_sample    token_sample of every kept question
+vocab           create_vocab
+ids             tokens2id and the weights of --weight
+save            id_save and weight_save, the id and weight files of main.py
+load            prepare_data of those files
+batchIter       padded batches
+<model>/build   a model of create_model, configured by the flags of main.py
+<model>/train   a training step on a batch of the corpus
+<model>/eval    a step of loss and accuracy
+"""
+import os
+import time
+import shutil
+import tempfile
+import tensorflow as tf
+
+import main
+from mdu import format_data, filter_data, token_sample, create_vocab, tokens2id
+from mdu import idf, token2cst, token2idf, token2tfidf, id_save, weight_save
+from mdu import prepare_data, batchIter
+from utils import define_resources
+from benchmarks.corpus import squad_json
+from benchmarks.harness import Results, define_flags
+
+MODELS = ('bow', 'rr', 'test')
+QUESTIONS = 5
+
+
+def weights(tokens):
+    if FLAGS.weight == 'one':
+        return token2cst(tokens)
+    docs = []
+    for sen, que, sid, ans in tokens:
+        d = list(que) * 3
+        for s in sen:
+            d += s
+        docs.append(d)
+    idf_map = idf(docs)
+    if FLAGS.weight == 'idf':
+        return token2idf(tokens, idf_map)
+    return token2tfidf(tokens, idf_map)
+
+
+def bench_data(results, data_dir):
+    with results.timed('generate', unit='questions') as stage:
+        js = squad_json(max(1, FLAGS.samples // QUESTIONS), QUESTIONS, FLAGS.seed)
+        stage['count'] = FLAGS.samples
+    with results.timed('format', FLAGS.samples, 'questions'):
+        good = filter_data(format_data(js))[0]
+    with results.timed('token_sample', len(good), 'questions'):
+        tokens = [token_sample(_) for _ in good]
+    with results.timed('vocab', len(tokens), 'questions'):
+        vocab, freq = create_vocab(tokens, cap=FLAGS.vocab_size or None)
+    if not FLAGS.vocab_size:
+        FLAGS.__flags['vocab_size'] = len(vocab)
+
+    with results.timed('ids', len(tokens), 'questions'):
+        ids = tokens2id(tokens, vocab)
+        wts = weights(tokens)
+
+    id_path = os.path.join(data_dir, 'ids_train.txt')
+    wt_path = os.path.join(data_dir, 'train_%s.txt' % FLAGS.weight)
+    with results.timed('save', len(ids), 'questions'):
+        id_save(id_path, ids)
+        weight_save(wt_path, wts)
+    with results.timed('load', len(ids), 'questions'):
+        train_data, train_wt, _, _, _ = prepare_data(id_path, wt_path, size=max(1, len(ids) // 10))
+
+    with results.timed('batchIter', unit='batches') as stage:
+        batches = batchIter(FLAGS.batch_size, train_data, train_wt, main.sN, main.sL, main.qL,
+                            stop_id=main.stop_id, add_stop=False)
+        stage['count'] = batches.next()
+        for _ in batches:
+            pass
+    return train_data, train_wt
+
+
+def feed(model, batch, dropout):
+    batch_idx, P, p_wt, p_len, Q, q_wt, q_len, A = batch
+    return {model.passage: P, model.p_len: p_len, model.p_wt: p_wt,
+            model.query: Q, model.q_len: q_len, model.q_wt: q_wt,
+            model.answer: A, model.dropout: dropout}
+
+
+def bench_model(results, name, data, config):
+    FLAGS.__flags['model'] = name
+    with tf.Graph().as_default(), tf.Session(config=config) as sess:
+        start = time.time()
+        model = main.create_model(FLAGS)
+        results.add('%s/build' % name, time.time() - start)
+        sess.run(tf.initialize_all_variables())
+        sess.run(tf.initialize_local_variables())
+
+        batches = batchIter(FLAGS.batch_size, data[0], data[1], main.sN, main.sL, main.qL,
+                            stop_id=main.stop_id, add_stop=False)
+        batches.next()
+        batch = batches.next()
+        for stage, fetch, dropout in (('train', [model.train_op, model.loss], FLAGS.dropout),
+                                      ('eval', [model.loss, model.accuracy], 1.0)):
+            feed_dict = feed(model, batch, dropout)
+            for _ in xrange(FLAGS.warmup):
+                sess.run(fetch, feed_dict)
+            with results.timed('%s/%s' % (name, stage), FLAGS.steps, 'steps') as timing:
+                for _ in xrange(FLAGS.steps):
+                    sess.run(fetch, feed_dict)
+            timing['examples'] = FLAGS.steps * len(batch[1])
+
+
+def run(_):
+    config = dict(FLAGS.__flags)
+    results = Results(config)
+    data_dir = FLAGS.work_dir or tempfile.mkdtemp(prefix='bench_bi_level_')
+    if not os.path.exists(data_dir):
+        os.makedirs(data_dir)
+    session_config, plan = define_resources(FLAGS.threads, FLAGS.inter_threads,
+                                            jobs=FLAGS.jobs, pin=FLAGS.pin)
+    try:
+        data = bench_data(results, data_dir)
+        for name in FLAGS.models.split(',') if FLAGS.models else MODELS:
+            try:
+                bench_model(results, name, data, session_config)
+            except Exception as e:
+                results.failed(name, e)
+    finally:
+        if not FLAGS.work_dir:
+            shutil.rmtree(data_dir)
+    if FLAGS.out:
+        results.save(FLAGS.out)
+
+
+if __name__ == '__main__':
+    define_flags(tf.app.flags)
+    FLAGS = tf.app.flags.FLAGS
+    tf.app.run(run)
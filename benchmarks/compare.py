@@ -0,0 +1,76 @@
+"""
+Compares two results of benchmarks.run stage by stage:
+
+    python -m benchmarks.compare base.json new.json [threshold]
+
+A stage regresses when its ms per unit grows by more than threshold, 0.1 by
+default, when it failed in new, or when new does not have it. Exits with 1 if
+any stage regressed, so a script can gate on it.
+"""
+import sys
+
+from benchmarks.harness import load
+
+
+def ms(stage):
+    return None if 'error' in stage else stage['ms']
+
+
+def compare(base, new, threshold=0.1):
+    """prints a table of the stages, returns the names of the regressed ones"""
+    regressed = []
+    print('%-40s %12s %12s %8s' % ('stage', 'base ms', 'new ms', 'ratio'))
+    for name, stage in new['stages'].items():
+        if name not in base['stages']:
+            continue
+        b, n = ms(base['stages'][name]), ms(stage)
+        if b is None or n is None:
+            print('%-40s %12s %12s %8s  failed' % (name, b if b is not None else '-',
+                                                   n if n is not None else '-', '-'))
+            if n is None:
+                regressed.append(name)
+            continue
+        ratio = n / b if b > 0 else float('inf')
+        mark = ''
+        if ratio > 1 + threshold:
+            mark = 'REGRESSION'
+            regressed.append(name)
+        elif ratio < 1 - threshold:
+            mark = 'faster'
+        print('%-40s %12.2f %12.2f %8.2f  %s' % (name, b, n, ratio, mark))
+
+    only_base = [_ for _ in base['stages'] if _ not in new['stages']]
+    only_new = [_ for _ in new['stages'] if _ not in base['stages']]
+    if only_base:
+        # a stage that no longer runs could hide any slowdown
+        print('only in base: %s' % ', '.join(only_base))
+        regressed += only_base
+    if only_new:
+        print('only in new: %s' % ', '.join(only_new))
+    return regressed
+
+
+def main():
+    if len(sys.argv) < 3:
+        print(__doc__)
+        sys.exit(2)
+    base = load(sys.argv[1])
+    new = load(sys.argv[2])
+    threshold = 0.1
+    if len(sys.argv) > 3:
+        threshold = float(sys.argv[3])
+
+    for key in ('revision', 'tensorflow', 'host', 'cpus'):
+        b, n = base['environment'].get(key), new['environment'].get(key)
+        if b != n:
+            print('%s: %s -> %s' % (key, b, n))
+
+    regressed = compare(base, new, threshold)
+    if regressed:
+        print(' [!] %d stages regressed by more than %d%%, failed or are missing'
+              % (len(regressed), 100 * threshold))
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
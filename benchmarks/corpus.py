@@ -0,0 +1,169 @@
+"""
+Synthetic corpora with the shapes of the real ones.
+
+    cnn_corpus(data_dir, 'cnn', 2000, vocab_size=50003)
+writes CNN style questions under data_dir/cnn/questions/training: the
+.question files read by get_all_context and data_to_token_ids, and their
+token id files in ids<vocab_size>/, named and laid out as fetch_files and
+data_iter expect.
+
+    squad_json(500)
+a SQuAD v1.1 style dict, as format_data reads the json of the dataset.
+bi_level_attention turns it into its id and weight files with its own
+token_sample, tokens2id, id_save and weight_save.
+
+Words are made up and zipfian. Documents have the lengths of the CNN
+corpus, about 760 tokens with a long tail, with @entity markers and a query
+of about 13 tokens around @placeholder. SQuAD paragraphs have about 5
+sentences of 25 words, questions about 11 words, and answers a span of
+one sentence.
+"""
+import os
+import numpy as np
+
+LETTERS = np.array(list('etaoinshrdlcumwfgypbvkjxqz'))
+LETTER_P = np.array([12.7, 9.1, 8.2, 7.5, 7.0, 6.7, 6.3, 6.1, 6.0, 4.3, 4.0, 2.8, 2.8,
+                     2.4, 2.4, 2.2, 2.0, 2.0, 1.9, 1.5, 1.0, 0.8, 0.2, 0.2, 0.1, 0.1])
+LETTER_P /= LETTER_P.sum()
+
+# ids below this are <PAD>, <UNK> and <STOP> in the vocab of data_utils
+FIRST_ID = 3
+
+
+class Words(object):
+    """a zipfian vocabulary of made up lowercase words, the rank is the id"""
+
+    def __init__(self, size=30000, rng=None, exponent=1.1):
+        self.rng = rng or np.random.RandomState(1234)
+        words = set()
+        while len(words) < size:
+            n = self.rng.randint(2, 11)
+            words.add(''.join(self.rng.choice(LETTERS, n, p=LETTER_P)))
+        self.words = sorted(words, key=len)
+        p = 1.0 / np.arange(1, size + 1) ** exponent
+        self.cdf = np.cumsum(p / p.sum())
+
+    def ranks(self, n):
+        return np.minimum(np.searchsorted(self.cdf, self.rng.rand(n)), len(self.words) - 1)
+
+    def sample(self, n):
+        return [self.words[r] for r in self.ranks(n)]
+
+
+def lognormal_length(rng, median, sigma, low, high):
+    return int(np.clip(rng.lognormal(np.log(median), sigma), low, high))
+
+
+def cnn_question(words, rng):
+    """
+    (lines of the .question file, document tokens, query tokens, answer) of
+    one question
+    """
+    n_entities = max(2, rng.poisson(26))
+    names = [' '.join(words.sample(rng.randint(1, 3))).title() for _ in range(n_entities)]
+
+    length = lognormal_length(rng, 700, 0.45, 50, 2000)
+    document = words.sample(length)
+    for i in range(30, length, 25):
+        document[i] = '.'
+    # every 15th token or so is an entity, each one is in the document
+    n_entities = min(n_entities, length // 2)
+    names = names[:n_entities]
+    free = [i for i in range(length) if document[i] != '.']
+    marks = rng.choice(free, max(n_entities, length // 15), replace=False)
+    for i, m in enumerate(marks):
+        document[m] = '@entity%d' % (i if i < n_entities else rng.randint(n_entities))
+
+    answer = rng.randint(n_entities)
+    query = words.sample(int(np.clip(rng.normal(12.5, 4), 4, 40)))
+    query[rng.randint(len(query))] = '@placeholder'
+    if len(query) > 6:
+        query[rng.randint(len(query))] = '@entity%d' % rng.randint(n_entities)
+
+    lines = ['http://www.cnn.com/%d' % rng.randint(1 << 30), '',
+             ' '.join(document), '',
+             ' '.join(query), '',
+             '@entity%d' % answer, '']
+    lines += ['@entity%d:%s' % (i, name) for i, name in enumerate(names)]
+    return '\n'.join(lines) + '\n', document, query, answer
+
+
+def to_ids(tokens, ranks, vocab_size, n_entities=600):
+    """the id of a word is its rank, entities come first as they are frequent"""
+    ids = []
+    for t in tokens:
+        if t.startswith('@entity'):
+            i = FIRST_ID + int(t[7:])
+        elif t == '@placeholder':
+            i = FIRST_ID + n_entities
+        elif t == '.':
+            i = FIRST_ID + n_entities + 1
+        else:
+            i = FIRST_ID + n_entities + 2 + ranks[t]
+        ids.append(i if i < vocab_size else 1)
+    return ids
+
+
+def cnn_corpus(data_dir, dataset, n, vocab_size=50003, seed=1234):
+    """
+    writes n .question files and their id files, returns the number of
+    document tokens
+    """
+    rng = np.random.RandomState(seed)
+    words = Words(rng=rng)
+    ranks = dict((w, r) for r, w in enumerate(words.words))
+    train_dir = os.path.join(data_dir, dataset, 'questions', 'training')
+    ids_dir = os.path.join(train_dir, 'ids%d' % vocab_size)
+    if not os.path.exists(ids_dir):
+        os.makedirs(ids_dir)
+
+    tokens = 0
+    for k in range(n):
+        text, document, query, answer = cnn_question(words, rng)
+        name = '%08d.question' % k
+        with open(os.path.join(train_dir, name), 'w') as f:
+            f.write(text)
+
+        d_ids = to_ids(document, ranks, vocab_size)
+        q_ids = to_ids(query, ranks, vocab_size)
+        a_id = to_ids(['@entity%d' % answer], ranks, vocab_size)[0]
+        with open(os.path.join(ids_dir, '%s.ids%d_%d' % (name, vocab_size, len(d_ids) + len(q_ids))), 'w') as f:
+            f.write('http://www.cnn.com/%d\n\n%s\n\n%s\n\n%d\n\n' % (
+                k, ' '.join(map(str, d_ids)), ' '.join(map(str, q_ids)), a_id))
+        tokens += len(document)
+    return tokens
+
+
+def squad_paragraph(words, rng, questions=5):
+    sentences = []
+    for _ in range(max(1, rng.poisson(4) + 1)):
+        s = words.sample(lognormal_length(rng, 23, 0.4, 4, 80))
+        s[0] = s[0].title()
+        sentences.append(s)
+    context = ' '.join(' '.join(s) + '.' for s in sentences)
+
+    qas = []
+    for q in range(questions):
+        # a span of one sentence, located in the context
+        i = rng.randint(len(sentences))
+        s = sentences[i]
+        head = rng.randint(len(s))
+        span = s[head:head + rng.randint(1, 4)]
+        start = sum(len(' '.join(_)) + 2 for _ in sentences[:i]) + len(' '.join(s[:head] + ['']))
+        text = ' '.join(span)
+        assert context[start:start + len(text)] == text
+        question = words.sample(int(np.clip(rng.normal(11, 3.5), 3, 30)))
+        qas.append({'id': '%x' % rng.randint(1 << 30),
+                    'question': ' '.join(question).capitalize() + '?',
+                    'answers': [{'text': text, 'answer_start': start}]})
+    return {'context': context, 'qas': qas}
+
+
+def squad_json(n_paragraphs, questions=5, seed=1234):
+    """a SQuAD style dataset of n_paragraphs * questions questions"""
+    rng = np.random.RandomState(seed)
+    words = Words(rng=rng)
+    paragraphs = [squad_paragraph(words, rng, questions) for _ in range(n_paragraphs)]
+    articles = [{'title': 'article%d' % i, 'paragraphs': paragraphs[i:i + 20]}
+                for i in range(0, n_paragraphs, 20)]
+    return {'version': '1.1', 'data': articles}
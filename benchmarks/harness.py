@@ -0,0 +1,93 @@
+"""
+Stage timings of a benchmark run and the flags every tree shares.
+
+A stage records seconds, a count of the units it processed and the derived
+ms per unit and units per second, plus anything the stage adds:
+
+    with results.timed('data_iter', unit='batches') as stage:
+        stage['count'] = run()
+"""
+import os
+import sys
+import json
+import time
+import socket
+import platform
+import traceback
+import subprocess
+import multiprocessing
+from collections import OrderedDict
+from contextlib import contextmanager
+
+
+def define_flags(flags):
+    """the flags of every tree, next to those of its main.py"""
+    flags.DEFINE_string("out", None, "Write the results as json here")
+    flags.DEFINE_string("work_dir", None, "Directory of the synthetic corpus, a removed temporary one if None")
+    flags.DEFINE_integer("samples", 2000, "Questions of the synthetic corpus")
+    flags.DEFINE_string("models", None, "Models to build and step, comma separated, all if None")
+    flags.DEFINE_integer("steps", 5, "Timed steps of every model")
+    flags.DEFINE_integer("warmup", 1, "Untimed steps before timing")
+    flags.DEFINE_integer("seed", 1234, "Seed of the synthetic corpus")
+
+
+def git_revision():
+    try:
+        with open(os.devnull, 'w') as null:
+            return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'],
+                                           stderr=null).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def environment():
+    import tensorflow as tf
+    return {'revision': git_revision(),
+            'tensorflow': tf.__version__,
+            'python': platform.python_version(),
+            'host': socket.gethostname(),
+            'cpus': multiprocessing.cpu_count(),
+            'time': time.strftime('%Y-%m-%d %H:%M:%S')}
+
+
+class Results(object):
+
+    def __init__(self, config=None):
+        self.config = config or {}
+        self.stages = OrderedDict()
+
+    def add(self, name, seconds, count=1, unit='calls', **extra):
+        stage = {'seconds': seconds, 'count': count, 'unit': unit,
+                 'ms': 1000.0 * seconds / max(count, 1),
+                 'per_sec': count / seconds if seconds > 0 else None}
+        stage.update(extra)
+        self.stages[name] = stage
+        print(' [*] %-32s %10.2f ms/%s' % (name, stage['ms'], unit.rstrip('s')))
+        sys.stdout.flush()
+        return stage
+
+    @contextmanager
+    def timed(self, name, count=1, unit='calls'):
+        """times the block, which may set the 'count' of the stage and add keys"""
+        stage = {'count': count}
+        start = time.time()
+        yield stage
+        seconds = time.time() - start
+        count = stage.pop('count')
+        self.add(name, seconds, count, unit, **stage)
+
+    def failed(self, name, e):
+        """a stage that raised, recorded instead of ending the run"""
+        traceback.print_exc()
+        self.stages[name] = {'error': '%s: %s' % (type(e).__name__, e)}
+
+    def save(self, path):
+        with open(path, 'w') as f:
+            json.dump({'environment': environment(), 'config': self.config,
+                       'stages': self.stages}, f, indent=4)
+        print(' [*] Results written to %s' % path)
+
+
+def load(path):
+    with open(path) as f:
+        return json.load(f, object_pairs_hook=OrderedDict)
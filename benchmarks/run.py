@@ -0,0 +1,67 @@
+"""
+Runs the benchmarks of every tree, each in its own process as both have a
+utils package, and merges their stages as <tree>/<stage>:
+
+    python -m benchmarks.run --out base.json --samples 500 --batch_size 16
+
+Flags other than --out and --trees go to the benchmark of every tree, which
+also reads the flags of the main.py of its tree.
+"""
+import os
+import sys
+import json
+import tempfile
+import subprocess
+import tensorflow as tf
+from collections import OrderedDict
+
+from benchmarks.harness import environment, load
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TREES = OrderedDict([('attentive', 'attentive-reader'),
+                     ('bi_level', 'bi_level_attention')])
+
+flags = tf.app.flags
+flags.DEFINE_string("out", "benchmark.json", "Write the merged results as json here")
+flags.DEFINE_string("trees", ",".join(TREES), "Trees to benchmark, comma separated")
+FLAGS = flags.FLAGS
+
+
+def bench(tree, out):
+    argv = [a for a in sys.argv[1:] if not a.startswith(('--out', '--trees'))]
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join([ROOT] + [p for p in [env.get('PYTHONPATH')] if p])
+    code = subprocess.call([sys.executable, '-m', 'benchmarks.%s' % tree, '--out=%s' % out] + argv,
+                           cwd=os.path.join(ROOT, TREES[tree]), env=env)
+    if code != 0 or not os.path.exists(out):
+        print(' [!] %s exited with %d' % (tree, code))
+        return None
+    return load(out)
+
+
+def main(_):
+    merged = OrderedDict([('environment', environment()), ('config', OrderedDict()),
+                          ('stages', OrderedDict())])
+    tmp = tempfile.mkdtemp(prefix='bench_')
+    try:
+        for tree in FLAGS.trees.split(','):
+            out = os.path.join(tmp, '%s.json' % tree)
+            results = bench(tree, out)
+            if results is None:
+                merged['stages'][tree] = {'error': 'exited without results'}
+                continue
+            merged['config'][tree] = results['config']
+            for name, stage in results['stages'].items():
+                merged['stages']['%s/%s' % (tree, name)] = stage
+    finally:
+        for f in os.listdir(tmp):
+            os.remove(os.path.join(tmp, f))
+        os.rmdir(tmp)
+
+    with open(FLAGS.out, 'w') as f:
+        json.dump(merged, f, indent=4)
+    print(' [*] Results written to %s' % FLAGS.out)
+
+
+if __name__ == '__main__':
+    tf.app.run()
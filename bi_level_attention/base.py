@@ -1,6 +1,8 @@
 import tensorflow as tf
 from tensorflow.python.ops import rnn_cell
 import numpy as np
+from utils import clip_gradient, summary_tensor, LazyAdamOptimizer, GradientAccumulator
+from utils import scaled_gradients
 
 
 def orthogonal_initializer(scale=1.1):
@@ -57,19 +59,34 @@ class BaseModel(object):
     def __init__(self, *args, **kwargs):
         pass
 
-    def create_placeholder(self, batch_size, sN, sL, qL):
+    def create_placeholder(self, batch_size, sN, sL, qL, dtype=tf.float32):
+        # batch dimension is left open, the last batch may be smaller
         self.passage = tf.placeholder(
-            tf.int32, [batch_size, sN, sL], name='passage')
-        self.p_len = tf.placeholder(tf.int32, [batch_size, sN], name='p_len')
-        self.query = tf.placeholder(tf.int32, [batch_size, qL], name='query')
-        self.q_len = tf.placeholder(tf.int32, [batch_size], name='q_len')
-        self.answer = tf.placeholder(tf.int64, [batch_size, sN], name='answer')
+            tf.int32, [None, sN, sL], name='passage')
+        self.p_len = tf.placeholder(tf.int32, [None, sN], name='p_len')
+        self.query = tf.placeholder(tf.int32, [None, qL], name='query')
+        self.q_len = tf.placeholder(tf.int32, [None], name='q_len')
+        self.answer = tf.placeholder(tf.int64, [None, sN], name='answer')
 
         self.p_wt = tf.placeholder(
-            tf.float32, [batch_size, sN, sL], name='p_idf')
-        self.q_wt = tf.placeholder(tf.float32, [batch_size, qL], name='q_idf')
+            tf.float32, [None, sN, sL], name='p_idf')
+        self.q_wt = tf.placeholder(tf.float32, [None, qL], name='q_idf')
 
-        self.dropout = tf.placeholder(tf.float32, name='dropout_rate')
+        self.dropout = tf.placeholder(dtype, name='dropout_rate')
+
+    def lookup(self, ids, name, dtype=tf.float32):
+        """rows of self.emb in the compute precision"""
+        embed = tf.nn.embedding_lookup(self.emb, ids, name=name)
+        if dtype != tf.float32:
+            embed = tf.cast(embed, dtype, name=name + '_cast')
+        return embed
+
+    def compute_gradients(self, loss, dtype=tf.float32, loss_scale=128.0):
+        """
+        gradients of loss. In reduced precision the loss is scaled up before
+        the backward pass so small gradients do not flush to zero
+        """
+        return scaled_gradients(self.optim, loss, dtype, loss_scale)
 
     def apply_attention(self, _type, hidden_size, sN, p_rep, q_rep, layer=3):
         print '  Using attention %s' % _type
@@ -212,9 +229,11 @@ class BaseModel(object):
             atten = tf.reduce_sum(atten * Ws, 2, name='attention')  # N, sN
             return atten
 
-    def get_optimizer(self, _type, learning_rate):
+    def get_optimizer(self, _type, learning_rate, sparse_grads=True):
         if _type == 'Adam':
-            optim = tf.train.AdamOptimizer(learning_rate)
+            # RMSProp and SGD already update only the rows of a sparse gradient
+            adam = LazyAdamOptimizer if sparse_grads else tf.train.AdamOptimizer
+            optim = adam(learning_rate)
         elif _type == 'SGD':
             optim = tf.train.GradientDescentOptimizer(learning_rate)
         elif _type == 'RMS':
@@ -223,6 +242,27 @@ class BaseModel(object):
             raise ValueError(_type)
         return optim
 
+    def clip_gradients(self, gvs, max_norm, sparse_grads=True):
+        """clip every gradient to max_norm, sparse_grads keeps IndexedSlices sparse"""
+        clip = clip_gradient if sparse_grads else tf.clip_by_norm
+        with tf.name_scope('clip_norm'):
+            return [(clip(g, max_norm), v) for g, v in gvs]
+
+    def apply_gradients(self, gvs, global_step, max_norm, sparse_grads=True, accumulate=1):
+        """
+        the train op of the unclipped gvs, clipped into self.gvs. With
+        accumulate K it only adds up gvs, apply_op applies their sum clipped
+        after every K train_op
+        """
+        self.apply_op = None
+        self.gvs = self.clip_gradients(gvs, max_norm, sparse_grads)
+        if accumulate <= 1:
+            return self.optim.apply_gradients(self.gvs, global_step=global_step, name='train_op')
+        clip = clip_gradient if sparse_grads else tf.clip_by_norm
+        accumulator = GradientAccumulator(gvs)
+        self.apply_op = accumulator.apply_op(self.optim, lambda g: clip(g, max_norm), global_step)
+        return accumulator.accumulate_op(name='train_op')
+
     def create_summary(self, add_gv_sum=True):
         self.align_his = tf.histogram_summary('alignment', self.alignment)
 
@@ -243,6 +283,8 @@ class BaseModel(object):
             v_his = tf.histogram_summary("I_{}-var".format(v.name), v)
 
             if g is not None:
+                # the touched rows of a sparse gradient, not a dense copy
+                g = summary_tensor(g)
                 g_sum = tf.scalar_summary(
                     "I_{}-grad/mean".format(v.name), tf.reduce_mean(g))
                 zero_frac = tf.scalar_summary(
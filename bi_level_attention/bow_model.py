@@ -1,6 +1,7 @@
 import tensorflow as tf
 from tensorflow.python.ops import rnn_cell
 from base import BaseModel
+from utils import encode
 
 
 class BoW_Attention(BaseModel):
@@ -14,7 +15,12 @@ class BoW_Attention(BaseModel):
                  attention_layer=3,
                  glove=False,
                  train_glove=False,
-                 max_norm=1.5):
+                 max_norm=1.5,
+                 precision='float32',
+                 loss_scale=128.0,
+                 sparse_grads=True,
+                 rnn_kernel='cell',
+                 accumulate=1):
         """
         sN: sentence number 
         sL: sentence length
@@ -29,9 +35,13 @@ class BoW_Attention(BaseModel):
         # q_idf   [batch_size, qL]
         # answer  [batch_size, sN]
         # dropout scalar
+
+        precision float16 runs the encoders in float16, build it under a
+        float32_master custom getter to keep float32 weights
         """
+        dtype = tf.as_dtype(precision)
 
-        self.create_placeholder(batch_size, sN, sL, qL)
+        self.create_placeholder(batch_size, sN, sL, qL, dtype=dtype)
 
         # feat = self.stat_attention(hidden_size)
 
@@ -42,30 +52,24 @@ class BoW_Attention(BaseModel):
 
         self.emb = tf.get_variable(
             "emb", [vocab_size, embed_size], trainable=(not glove or train_glove))
-        embed_p = tf.nn.embedding_lookup(
-            self.emb, self.passage, name='embed_p')  # N,sN,sL,E
-        embed_q = tf.nn.embedding_lookup(
-            self.emb, self.query, name='embed_q')  # N,qL,E
+        embed_p = self.lookup(self.passage, 'embed_p', dtype)  # N,sN,sL,E
+        embed_q = self.lookup(self.query, 'embed_q', dtype)  # N,qL,E
         self.embed_sum = tf.histogram_summary("embed", self.emb)
 
         # query_token = tf.unpack(embed_q, axis=1)
         query_token = embed_q
         with tf.variable_scope("query_represent"):
-            q_rep, final_state = tf.nn.bidirectional_dynamic_rnn(
-                rnn_cell.LSTMCell(
-                    hidden_size, forget_bias=0.0, state_is_tuple=True),
-                rnn_cell.LSTMCell(
-                    hidden_size, forget_bias=0.0, state_is_tuple=True),
-                query_token,
-                sequence_length=self.q_len,
-                dtype=tf.float32)
+            q_rep, final_state = encode(
+                'LSTM', rnn_kernel, hidden_size,
+                query_token, self.q_len,
+                dtype=dtype, forget_bias=0.0)
 
             ffinal = tf.reduce_max(q_rep[0], [1])
             bfinal = tf.reduce_max(q_rep[1], [1])
             q_rep = tf.concat(1, [ffinal, bfinal])
 
         with tf.name_scope('BoW'):
-            wt = tf.expand_dims( self.p_wt, -1 )
+            wt = tf.expand_dims( tf.cast(self.p_wt, dtype), -1 )
             bow_p = tf.reduce_sum( embed_p*wt, 2, name='bow' )
 
         sN_mask = tf.to_float(self.p_len > 0, name='sN_mask')  # N, sN
@@ -77,14 +81,10 @@ class BoW_Attention(BaseModel):
 
         sentence = bow_p  # N, sN, E
         with tf.variable_scope("passage_represent"):
-            p_rep, final_state = tf.nn.bidirectional_dynamic_rnn(
-                rnn_cell.LSTMCell(
-                    hidden_size, forget_bias=0.0, state_is_tuple=True),
-                rnn_cell.LSTMCell(
-                    hidden_size, forget_bias=0.0, state_is_tuple=True),
-                sentence,
-                sequence_length=sN_count,
-                dtype=tf.float32,
+            p_rep, final_state = encode(
+                'LSTM', rnn_kernel, hidden_size,
+                sentence, sN_count,
+                dtype=dtype, forget_bias=0.0,
                 # initial_state_fw=final_state_fw,
                 # initial_state_bw=final_state_bw,
             )
@@ -94,6 +94,10 @@ class BoW_Attention(BaseModel):
             q_rep = tf.nn.dropout(q_rep, self.dropout)
             p_rep = tf.nn.dropout(p_rep, self.dropout)
 
+        # query independent, fed from a cache when evaluating
+        p_rep = tf.identity(p_rep, name='p_rep')
+        self.doc_rep = p_rep
+
         # p_rep = bow_p
         # # print p_rep.get_shape()
         # # assert False
@@ -101,6 +105,7 @@ class BoW_Attention(BaseModel):
         atten = self.apply_attention(
             attention_type, hidden_size, sN, p_rep, q_rep, layer=attention_layer)
 
+        atten = tf.cast(atten, tf.float32)
         atten = atten - tf.reduce_min(atten, [1], keep_dims=True)
         atten = tf.mul(atten, sN_mask, name='unnormalized_attention')
 
@@ -117,13 +122,10 @@ class BoW_Attention(BaseModel):
         self.accuracy = tf.reduce_mean(
             tf.cast(self.correct_prediction, tf.float32), name='accuracy')
 
-        self.optim = self.get_optimizer(optim_type, learning_rate)
-        gvs = self.optim.compute_gradients(self.loss)
-        with tf.name_scope('clip_norm'):
-            self.gvs = [(tf.clip_by_norm(g, max_norm), v) for g, v in gvs]
-
-        self.train_op = self.optim.apply_gradients(
-            self.gvs, global_step=global_step, name='train_op')
+        self.optim = self.get_optimizer(optim_type, learning_rate, sparse_grads)
+        gvs = self.compute_gradients(self.loss, dtype, loss_scale)
+        self.train_op = self.apply_gradients(gvs, global_step, max_norm,
+                                             sparse_grads, accumulate)
         self.check_op = tf.add_check_numerics_ops()
 
         tsum, vsum = self.create_summary()
@@ -10,6 +10,7 @@ from collections import namedtuple
 import json
 import pickle as pk
 from mdu import id_load
+from utils import define_resources
 import sys
 
 batch_size = 128
@@ -248,7 +249,7 @@ def evaluate(sess, tensor_dict,
             else:
                 prediction = rslt.argmax(1)
                 answer = data[-1]
-                correct = (answer[range(batch_size), prediction] == 1)
+                correct = (answer[range(len(prediction)), prediction] == 1)
                 acc += correct.mean()
 
         print "accuracy: %.4f, loss: %.4f" % (acc / (i + 1), loss / (i + 1))
@@ -282,10 +283,10 @@ def evaluate(sess, tensor_dict,
 
 def main():
     load_path = sys.argv[1]
-    gpu = 1
+    threads = 0
     if len(sys.argv) > 2:
-        gpu = int(sys.argv[2])
-    os.environ['CUDA_VISIBLE_DEVICES'] = str(gpu)
+        threads = int(sys.argv[2])
+    config, plan = define_resources(threads)
 
     with open(os.path.join(load_path, 'Flags.js'), 'r') as f:
         old_flag = json.load(f)
@@ -293,7 +294,7 @@ def main():
     batch_size = old_flag['batch_size']
     print 'batch_size', batch_size
 
-    with tf.Session() as sess:
+    with tf.Session(config=config) as sess:
 
         if os.path.isdir(load_path):
             ckfiles = choose_ckpt(os.path.join(load_path, 'ckpts'))
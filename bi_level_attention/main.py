@@ -6,20 +6,28 @@ import time
 import json
 import numpy as np
 from utils import pp
-from mdu import batchIter
+from mdu import batchIter, pad_all
 from mdu import restruct_glove_embedding
 from mdu import prepare_data
 from tensorflow.contrib.layers import l2_regularizer
 from base import orthogonal_initializer
 # from eval_tool import norm
-from utils import define_gpu
+from utils import define_resources, DocCache, doc_key, StepProfiler, AsyncCheckpointer
+from utils import reserve_cores, launch_validator, stop_validator
+from utils import Throughput, padded_tokens, float32_master
+from utils import follow_checkpoints, checkpoint_step, scalar_summary, fixed_sample, ValidationSet
 
 flags = tf.app.flags
 
-flags.DEFINE_integer("gpu", 1, "the number of gpus to use")
+flags.DEFINE_integer("threads", 0, "Intra op threads, 0 takes a share of the idle cores")
+flags.DEFINE_integer("inter_threads", 0, "Inter op threads, 0 uses one per socket")
+flags.DEFINE_integer("jobs", 1, "Number of jobs sharing the idle cores of this box")
+flags.DEFINE_boolean("pin", False, "Pin the process to the planned cores")
 flags.DEFINE_integer("data_size", None, "Number of files to train on")
 flags.DEFINE_float("eval_every", 100.0, "Eval every step")
 flags.DEFINE_float("save_every", 500.0, "Eval every step")
+flags.DEFINE_boolean("background_save", True, "Write checkpoints on a background thread")
+flags.DEFINE_integer("snapshot_every", 0, "Also write weights only snapshots every that many steps, 0 never")
 flags.DEFINE_string("log_dir", "log", "Directory name to save the log [log]")
 flags.DEFINE_string("dataset", "squad", "Data")
 flags.DEFINE_string("load_path", None, "The path to old model.")
@@ -43,6 +51,16 @@ flags.DEFINE_string("model", 'bow', "Model")
 flags.DEFINE_string("init", 'ort', "xav, ort, non, ran")
 flags.DEFINE_boolean("glove", False, "whether use glove embedding")
 flags.DEFINE_boolean("tg", False, "whether train glove embedding")
+flags.DEFINE_string("precision", "float32", "float32, or float16 activations with float32 master weights")
+flags.DEFINE_float("loss_scale", 128.0, "Loss scale used with float16")
+flags.DEFINE_boolean("sparse_grads", True, "Clip and update only the looked up embedding rows")
+flags.DEFINE_string("rnn_kernel", "cell", "RNN implementation: cell, block or fused")
+flags.DEFINE_integer("accumulate", 1, "Apply the summed gradients of that many batches as one step")
+flags.DEFINE_string("profile_steps", None, "Trace these training steps, e.g. 100-110")
+flags.DEFINE_integer("doc_cache", 0, "Validate with an LRU of this many encoded passages, 0 to disable")
+flags.DEFINE_integer("validator", 0, "Cores of a process validating the checkpoints, 0 validates inline")
+flags.DEFINE_string("follow", None, "Validate the checkpoints of this log dir as they are written")
+flags.DEFINE_integer("validate_mb", 256, "Memory cap of the validation set, a fixed smaller sample beyond it, 0 no cap")
 
 
 
@@ -68,6 +86,8 @@ def initialize(sess, saver, load_path=None):
             fname = load_path
         print "  Load from %s" % fname
         saver.restore(sess, fname)
+    # gradient accumulators, never in a checkpoint
+    sess.run(tf.initialize_local_variables())
 
 
 def create_logger(track_dir, to_console=True):
@@ -91,6 +111,87 @@ def create_logger(track_dir, to_console=True):
 
     return logger
 
+def validation_set(D, W, size, grouped=False):
+    """
+    a fixed sample of size questions of D, W, padded once and capped by
+    --validate_mb. grouped puts the questions on one passage next to each
+    other, so they share batches of the passage cache
+    """
+    start = time.time()
+    row_bytes = 4 * (2 * sN * sL + 2 * sN + 2 * qL + 1)
+    idxs = fixed_sample(len(D), size, row_bytes, FLAGS.validate_mb)
+    if grouped:
+        idxs = sorted(idxs, key=lambda i: str(D[i][0]))
+    vset = ValidationSet(pad_all([D[i] for i in idxs], [W[i] for i in idxs],
+                                 sN, sL, qL, stop_id=stop_id, add_stop=False))
+    print '  Validation set of %d questions, %.1fMB, padded in %.2fs' % \
+        (len(vset), vset.nbytes / 2.0 ** 20, time.time() - start)
+    return vset
+
+
+def validate(sess, model, vset, cache=None):
+    """
+    loss and accuracy over vset. With a DocCache the passage representation
+    of a passage seen before is fed instead of recomputed
+    """
+    _accuracy = 0.0
+    _loss = 0.0
+    start = time.time()
+
+    for batch_idx, P, p_wt, p_len, Q, q_wt, q_len, A in vset.batches(FLAGS.batch_size):
+        feed_dict = {
+            model.p_len: p_len,
+            model.query: Q,
+            model.q_len: q_len,
+            model.q_wt: q_wt,
+            model.answer: A,
+            model.dropout: 1.0,
+        }
+        if cache is None:
+            feed_dict[model.passage] = P
+            feed_dict[model.p_wt] = p_wt
+        else:
+            keys = [doc_key(P[i], p_wt[i], p_len[i]) for i in range(P.shape[0])]
+
+            def encode(rows):
+                return sess.run(model.doc_rep, feed_dict={
+                    model.passage: P[rows],
+                    model.p_wt: p_wt[rows],
+                    model.p_len: p_len[rows],
+                    model.dropout: 1.0,
+                })
+            feed_dict[model.doc_rep] = cache.lookup(keys, encode)
+
+        loss, accuracy = sess.run([model.loss, model.accuracy], feed_dict=feed_dict)
+
+        _accuracy += accuracy * len(Q)
+        _loss += loss.sum()
+
+    n = float(max(len(vset), 1))
+    return _loss / n, _accuracy / n, time.time() - start
+
+
+def follow(sess, model, log_dir, vset, interval=10):
+    """
+    validate every checkpoint written to log_dir/ckpts on vset, in a
+    process of its own, see shared/follow.py
+    """
+    saver = tf.train.Saver()
+    writer = tf.train.SummaryWriter(os.path.join(log_dir, 'validation'))
+    for fname in follow_checkpoints(os.path.join(log_dir, 'ckpts'), interval):
+        try:
+            saver.restore(sess, fname)
+        except tf.errors.NotFoundError:
+            print '  %s was removed before it was validated' % fname
+            continue
+        _loss, _accuracy, elapsed = validate(sess, model, vset)
+        writer.add_summary(scalar_summary(V_loss=_loss, V_accuracy=_accuracy),
+                           checkpoint_step(fname))
+        writer.flush()
+        print '  %s Evaluation: time: %4.4f, loss: %.8f, accuracy: %.8f' % \
+            (fname, elapsed, _loss, _accuracy)
+
+
 def create_model(FLAGS, sN=sN, sL=sL, qL=qL):
     
     if FLAGS.model == 'bow':
@@ -120,7 +221,12 @@ def create_model(FLAGS, sN=sN, sL=sL, qL=qL):
         print 'l2 to ', w.name
         return l2(w)
 
-    with tf.variable_scope('model', initializer=initializer, regularizer = reg):
+    getter = None
+    if FLAGS.precision != 'float32':
+        getter = float32_master(tf.as_dtype(FLAGS.precision))
+
+    with tf.variable_scope('model', initializer=initializer, regularizer = reg,
+                           custom_getter=getter):
 
         model = Net(FLAGS.batch_size, sN, sL, qL, FLAGS.vocab_size, FLAGS.embed_size, FLAGS.hidden_size,
                     learning_rate=FLAGS.learning_rate,
@@ -130,6 +236,11 @@ def create_model(FLAGS, sN=sN, sL=sL, qL=qL):
                     glove=FLAGS.glove,
                     train_glove=FLAGS.tg,
                     max_norm=FLAGS.clip_norm,
+                    precision=FLAGS.precision,
+                    loss_scale=FLAGS.loss_scale,
+                    sparse_grads=FLAGS.sparse_grads,
+                    rnn_kernel=FLAGS.rnn_kernel,
+                    accumulate=FLAGS.accumulate,
                     )
 
     return model
@@ -182,16 +293,28 @@ def main(_):
     assert FLAGS.vocab_size!=0, FLAGS.__flags
     pp.pprint(FLAGS.__flags)
 
+    if FLAGS.follow:
+        # a launched follower is already pinned to its cores
+        config, plan = define_resources(FLAGS.threads, FLAGS.inter_threads, pin=FLAGS.pin)
+        with tf.Session(config=config) as sess:
+            model = create_model(FLAGS)
+            data = prepare_data(data_path, wt_path,
+                                data_size=FLAGS.data_size, val_rate=val_rate)
+            vset = validation_set(*data[2:])
+            follow(sess, model, FLAGS.follow, vset)
+        return
+
     go = raw_input('Do you want to go with these setting? ')
     if go not in ['Yes', 'y', 'Y', 'yes']:
         exit(2)
 
-    if FLAGS.gpu is not None:
-        gpu_list  = define_gpu(FLAGS.gpu)
-        print('  Using GPU:%s' % gpu_list)
-        # os.environ['CUDA_VISIBLE_DEVICES'] = str(FLAGS.gpu)
+    reserved = ()
+    if FLAGS.validator:
+        reserved = reserve_cores(FLAGS.validator)
+    config, plan = define_resources(FLAGS.threads, FLAGS.inter_threads,
+                                    jobs=FLAGS.jobs, pin=FLAGS.pin, exclude=reserved)
 
-    with tf.Session() as sess:
+    with tf.Session(config=config) as sess:
         model = create_model(FLAGS)
         print '  Model Built'
 
@@ -229,8 +352,36 @@ def main(_):
             json.dump(FLAGS.__flags, f, indent=4)
         print '  Writing log to %s' % log_dir
 
-        vcounter = 1
+        validator = None
+        if FLAGS.validator:
+            validator = launch_validator(sys.argv + ['--follow=%s' % log_dir, '--validator=0',
+                                                     '--threads=%d' % len(reserved)], reserved)
+
         writer = tf.train.SummaryWriter(log_dir, sess.graph)
+
+        checkpointer = AsyncCheckpointer(saver, save_dir, max_to_keep=5,
+                                         background=FLAGS.background_save)
+        snapshotter = None
+        if FLAGS.snapshot_every:
+            weights = tf.trainable_variables()
+            snapshotter = AsyncCheckpointer(tf.train.Saver(weights), os.path.join(log_dir, 'weights'),
+                                            var_list=weights, prefix='weights', max_to_keep=5,
+                                            background=FLAGS.background_save)
+
+        cache = None
+        plain_time = None
+        if FLAGS.doc_cache:
+            if getattr(model, 'doc_rep', None) is None:
+                print '  Model %s has no doc_rep, passage cache disabled' % FLAGS.model
+            else:
+                cache = DocCache(max(FLAGS.doc_cache, FLAGS.batch_size))
+        vset = None
+        if not FLAGS.validator:
+            vset = validation_set(validate_data, validate_wt, vsize, grouped=cache is not None)
+        profiler = StepProfiler(log_dir, FLAGS.profile_steps)
+        # the batches of the 20 steps between two logs
+        meter = Throughput(log_dir, writer, every=20 * FLAGS.accumulate)
+        counter = 0
         start_time = time.time()
         running_acc = 0.0
         running_loss = 0.0
@@ -249,8 +400,10 @@ def main(_):
                               sN, sL, qL, stop_id=stop_id, add_stop=False)
             tstep = titer.next()
 
-            for batch_idx, P, p_wt, p_len, Q, q_wt, q_len, A in titer:
+            for batch_idx, P, p_wt, p_len, Q, q_wt, q_len, A in meter.wait(titer):
 
+                run_args = profiler.before_run(counter)
+                run_start = time.time()
                 rslt = sess.run(
                     [
                         model.global_step,
@@ -277,17 +430,29 @@ def main(_):
                         model.q_wt: q_wt,
                         model.answer: A,
                         model.dropout: FLAGS.dropout,
-                    })
+                    },
+                    **run_args)
+                run_time = time.time() - run_start
+                profiler.after_run(counter, run_args)
+                counter += 1
 
                 gstep, loss, accuracy, _, sum_str = rslt[:5]
+                p_tokens, p_slots = padded_tokens(p_len, sL)
+                q_tokens, q_slots = padded_tokens(q_len, qL)
+                meter.add(gstep, run_time, len(A), p_tokens + q_tokens, p_slots + q_slots)
                 rslt = rslt[5:]
 
                 score, align = rslt[:2]
                 rslt = rslt[2:]
 
                 loss = loss.mean()
-                running_acc += accuracy
-                running_loss += loss
+                running_acc += accuracy / FLAGS.accumulate
+                running_loss += loss / FLAGS.accumulate
+                if model.apply_op is not None:
+                    # a step is accumulate batches, the rest runs once per step
+                    if counter % FLAGS.accumulate:
+                        continue
+                    sess.run(model.apply_op)
                 writer.add_summary(sum_str, gstep)
 
 
@@ -300,44 +465,32 @@ def main(_):
                     # sess.run(model.learning_rate)
 
                 if (gstep + 1) % FLAGS.save_every == 0:
-                    fname = os.path.join(save_dir, 'model')
-                    print "  Saving Model..."
-                    saver.save(sess, fname, global_step=gstep)
-
-                if (gstep + 1) % FLAGS.eval_every == 0:
-
-                    _accuracy = 0.0
-                    _loss = 0.0
-                    idxs = np.random.choice(len(validate_data), size=vsize)
-                    D = [validate_data[idx] for idx in idxs]
-                    W = [validate_wt[idx]  for idx in idxs]
-                    viter = batchIter(FLAGS.batch_size, D, W,
-                                sN, sL, qL, stop_id=stop_id, add_stop=False)
-                    vstep = float(viter.next())
-
-                    for batch_idx, P, p_wt, p_len, Q, q_wt, q_len, A in viter:
-                        loss, accuracy, sum_str = sess.run(
-                            [model.loss, model.accuracy, model.validate_summary],
-                            feed_dict={
-                                model.passage: P,
-                                model.p_len: p_len,
-                                model.p_wt: p_wt,
-                                model.query: Q,
-                                model.q_len: q_len,
-                                model.q_wt: q_wt,
-                                model.answer: A,
-                                model.dropout: 1.0,
-                            })
-
-                        loss = loss.mean()
-                        _accuracy += accuracy
-                        _loss += loss
-                        vcounter += 1
-                        writer.add_summary(sum_str, vcounter)
+                    checkpointer.save(sess, gstep)
+                if FLAGS.snapshot_every and (gstep + 1) % FLAGS.snapshot_every == 0:
+                    snapshotter.save(sess, gstep)
+
+                if not FLAGS.validator and (gstep + 1) % FLAGS.eval_every == 0:
+
+                    if cache is not None:
+                        # the weights changed since the last evaluation
+                        cache.clear()
+                    _loss, _accuracy, elapsed = validate(sess, model, vset, cache)
+                    writer.add_summary(scalar_summary(V_loss=_loss, V_accuracy=_accuracy), gstep)
 
                     print '  Evaluation: time: %4.4f, loss: %.8f, accuracy: %.8f' % \
-                        (time.time() - start_time, _loss / vstep, _accuracy / vstep)
-                    vcounter += int(vstep / 4.0)  # add gap
+                        (time.time() - start_time, _loss, _accuracy)
+
+                    if cache is not None:
+                        if plain_time is None:
+                            plain_time = validate(sess, model, vset)[-1]
+                        print '  Passage cache hit rate %.4f, %.2fs vs %.2fs uncached, speedup %.2fx' % \
+                            (cache.hit_rate, elapsed, plain_time, plain_time / elapsed)
+
+        checkpointer.join()
+        if snapshotter is not None:
+            snapshotter.join()
+        if validator is not None:
+            stop_validator(log_dir, validator)
 
 
 
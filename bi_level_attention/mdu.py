@@ -373,12 +373,9 @@ def batchIter(batch_size, data, idf, sN=10, sL=50, qL=15, stop_id=2, add_stop=Tr
     for idx in range(steps):
         start = idx * batch_size
         end = (idx + 1) * batch_size
-        if end > N:
-            batch_data = data[start:] + data[:end - N]
-            batch_idf  = idf[start:] + idf[:end - N]
-        else:
-            batch_data = data[start:end]
-            batch_idf = idf[start:end]
+        batch_data = data[start:end]
+        batch_idf = idf[start:end]
+        n = len(batch_data)
 
         P.fill(1)
         Q.fill(1)
@@ -388,7 +385,7 @@ def batchIter(batch_size, data, idf, sN=10, sL=50, qL=15, stop_id=2, add_stop=Tr
         p_len.fill(0)
         q_len.fill(0)
 
-        for i in range(batch_size):
+        for i in range(n):
             sens, q, sid, answer = batch_data[i]
             senidf, qidf = batch_idf[i]
             for j in range(min(sN, len(sens))):
@@ -402,7 +399,13 @@ def batchIter(batch_size, data, idf, sN=10, sL=50, qL=15, stop_id=2, add_stop=Tr
                 if a < sN:
                     A[i][a] = 1
 
-        yield idx, P, P_idf, p_len, Q, Q_idf, q_len, A
+        yield idx, P[:n], P_idf[:n], p_len[:n], Q[:n], Q_idf[:n], q_len[:n], A[:n]
+
+def pad_all(data, idf, sN=10, sL=50, qL=15, stop_id=2, add_stop=True):
+    """the arrays of batchIter over all of data at once"""
+    batches = batchIter(max(len(data), 1), data, idf, sN, sL, qL, stop_id, add_stop)
+    batches.next()
+    return batches.next()[1:]
 
 def id_save(_fname, _data):
     with open(_fname, 'w') as f:
@@ -1,6 +1,7 @@
 import tensorflow as tf
 from tensorflow.python.ops import rnn_cell
 from base import BaseModel
+from utils import encode
 
 class RRNN_Attention(BaseModel):
 
@@ -13,7 +14,12 @@ class RRNN_Attention(BaseModel):
                  attention_layer=3,
                  glove=False,
                  train_glove=False,
-                 max_norm=1.5):
+                 max_norm=1.5,
+                 precision='float32',
+                 loss_scale=128.0,
+                 sparse_grads=True,
+                 rnn_kernel='cell',
+                 accumulate=1):
         """
         sN: sentence number 
         sL: sentence length
@@ -28,9 +34,13 @@ class RRNN_Attention(BaseModel):
         # q_idf   [batch_size, qL]
         # answer  [batch_size, sN]
         # dropout scalar
+
+        precision float16 runs the encoders in float16, build it under a
+        float32_master custom getter to keep float32 weights
         """
+        dtype = tf.as_dtype(precision)
         
-        self.create_placeholder(batch_size, sN, sL, qL)
+        self.create_placeholder(batch_size, sN, sL, qL, dtype=dtype)
 
         global_step = tf.Variable(0, name='global_step', trainable=False)
         learning_rate = tf.train.exponential_decay(
@@ -39,23 +49,17 @@ class RRNN_Attention(BaseModel):
 
         self.emb = tf.get_variable(
             "emb", [vocab_size, embed_size], trainable=(not glove or train_glove))
-        embed_p = tf.nn.embedding_lookup(
-            self.emb, self.passage, name='embed_p')  # N,sN,sL,E
-        embed_q = tf.nn.embedding_lookup(
-            self.emb, self.query, name='embed_q')  # N,qL,E
+        embed_p = self.lookup(self.passage, 'embed_p', dtype)  # N,sN,sL,E
+        embed_q = self.lookup(self.query, 'embed_q', dtype)  # N,qL,E
         self.embed_sum = tf.histogram_summary("embed", self.emb)
 
         # query_token = tf.unpack(embed_q, axis=1)
         query_token = embed_q
         with tf.variable_scope("query_represent"):
-            q_rep, final_state = tf.nn.bidirectional_dynamic_rnn(
-                rnn_cell.LSTMCell(
-                    hidden_size, forget_bias=0.0, state_is_tuple=True),
-                rnn_cell.LSTMCell(
-                    hidden_size, forget_bias=0.0, state_is_tuple=True),
-                query_token,
-                sequence_length=self.q_len,
-                dtype=tf.float32)
+            q_rep, final_state = encode(
+                'LSTM', rnn_kernel, hidden_size,
+                query_token, self.q_len,
+                dtype=dtype, forget_bias=0.0)
 
             ffinal = tf.reduce_max(q_rep[0], [1])
             bfinal = tf.reduce_max(q_rep[-1], [1])
@@ -65,20 +69,18 @@ class RRNN_Attention(BaseModel):
         sen_len  = tf.unpack(self.p_len, axis=1) # [N]*sN
         sentence_rep = []
         with tf.variable_scope("sentence_represent") as scope:
-            gru_cell = rnn_cell.GRUCell(hidden_size)
-            
             for i, tokens in enumerate(sentence):
                 if i > 0:
                     scope.reuse_variables()
 
-                # _p, _ = tf.nn.dynamic_rnn(  # N, sL, H 
-                _p, _ = tf.nn.rnn(  # N, sL, H 
-                    gru_cell, tf.unpack(tokens, axis=1), 
-                    # sequence_length=mask,
-                    dtype=tf.float32)
+                # zero past the sentence length. With the cell kernel this is
+                # dynamic_rnn, no longer the unrolled tf.nn.rnn masked after
+                # the fact: a different graph, the same variables and outputs
+                _p, _ = encode(  # N, sL, H
+                    'GRU', rnn_kernel, hidden_size,
+                    tokens, sen_len[i],
+                    bidirectional=False, dtype=dtype)
 
-                mask = tf.sequence_mask(sen_len[i], sL, dtype=tf.float32)
-                _p = tf.pack(_p, 1) * tf.expand_dims(mask, -1)
                 sentence_rep.append( tf.reduce_max(_p, 1) )  # [N, H] * sL
                 
             sentence = tf.pack(sentence_rep, 1)
@@ -91,14 +93,10 @@ class RRNN_Attention(BaseModel):
         self.sN_count = sN_count
 
         with tf.variable_scope("passage_represent"):
-            p_rep, final_state = tf.nn.bidirectional_dynamic_rnn(
-                rnn_cell.LSTMCell(
-                    hidden_size, forget_bias=0.0, state_is_tuple=True),
-                rnn_cell.LSTMCell(
-                    hidden_size, forget_bias=0.0, state_is_tuple=True),
-                sentence,
-                sequence_length=sN_count,
-                dtype=tf.float32,
+            p_rep, final_state = encode(
+                'LSTM', rnn_kernel, hidden_size,
+                sentence, sN_count,
+                dtype=dtype, forget_bias=0.0,
             )
             p_rep = tf.concat(2, p_rep)
 
@@ -111,6 +109,7 @@ class RRNN_Attention(BaseModel):
         p_rep = tf.unpack(p_rep, axis=1)
         atten = self.apply_attention(attention_type, hidden_size, sN, p_rep, q_rep, layer=attention_layer)
 
+        atten = tf.cast(atten, tf.float32)
         atten = atten - tf.reduce_min(atten, [1], keep_dims=True)
         atten = tf.mul(atten, sN_mask, name='unnormalized_attention')
 
@@ -125,13 +124,10 @@ class RRNN_Attention(BaseModel):
         self.accuracy = tf.reduce_mean(
             tf.cast(self.correct_prediction, tf.float16))
 
-        self.optim = self.get_optimizer(optim_type, learning_rate )
-        gvs = self.optim.compute_gradients(self.loss)
-        with tf.name_scope('clip_norm'):
-            self.gvs = [ ( tf.clip_by_norm(g, max_norm), v ) for g,v in gvs ]
-
-        self.train_op = self.optim.apply_gradients(
-            self.gvs, global_step=global_step)
+        self.optim = self.get_optimizer(optim_type, learning_rate, sparse_grads)
+        gvs = self.compute_gradients(self.loss, dtype, loss_scale)
+        self.train_op = self.apply_gradients(gvs, global_step, max_norm,
+                                             sparse_grads, accumulate)
         self.check_op = tf.add_check_numerics_ops()
 
         # summary ==========================
@@ -13,11 +13,17 @@ class Attention(BaseModel):
                  attention_layer=3,
                  glove=False,
                  train_glove=False,
-                 max_norm=6):
+                 max_norm=6,
+                 precision='float32',
+                 loss_scale=128.0,
+                 sparse_grads=True,
+                 rnn_kernel='cell',
+                 accumulate=1):
         """
         sN: sentence number 
         sL: sentence length
         qL: query length
+        rnn_kernel is taken for the other models, this one has no rnn
 
         Placeholders
         # passage [batch_size, sN, sL]
@@ -29,8 +35,9 @@ class Attention(BaseModel):
         # answer  [batch_size, sN]
         # dropout scalar
         """
+        dtype = tf.as_dtype(precision)
 
-        self.create_placeholder(batch_size, sN, sL, qL)
+        self.create_placeholder(batch_size, sN, sL, qL, dtype=dtype)
 
         global_step = tf.Variable(0, name='global_step', trainable=False)
         learning_rate = tf.train.exponential_decay(
@@ -39,20 +46,18 @@ class Attention(BaseModel):
 
         self.emb = tf.get_variable(
             "emb", [vocab_size, embed_size], trainable=(not glove or train_glove))
-        embed_p = tf.nn.embedding_lookup(
-            self.emb, self.passage, name='embed_p')  # N,sN,sL,E
-        embed_q = tf.nn.embedding_lookup(
-            self.emb, self.query, name='embed_q')  # N,qL,E
+        embed_p = self.lookup(self.passage, 'embed_p', dtype)  # N,sN,sL,E
+        embed_q = self.lookup(self.query, 'embed_q', dtype)  # N,qL,E
         self.embed_sum = tf.histogram_summary("embed", self.emb)
 
         with tf.name_scope('BoW'):
-            wt_p = tf.expand_dims( self.p_wt, -1 )
+            wt_p = tf.expand_dims( tf.cast(self.p_wt, dtype), -1 )
             bow_p = tf.reduce_sum( embed_p*wt_p, 2, name='bow_p' ) # N, sN, E
             epsilon = 1e-5
             denominator = tf.to_float(tf.expand_dims( self.p_len, -1 )) + epsilon
             # bow_p = tf.div( bow_p, denominator, name= 'true_bow_p' ) # N, sN, 1
 
-            wt_q = tf.expand_dims( self.q_wt, -1 ) 
+            wt_q = tf.expand_dims( tf.cast(self.q_wt, dtype), -1 ) 
             bow_q = tf.reduce_sum( embed_q*wt_q, 1, name='bow_q') # N, E
             denominator = tf.to_float(tf.expand_dims( self.q_len, -1 )) + epsilon
             # bow_q = tf.div( bow_q, denominator, name='true_bow_q' ) # N, 1
@@ -75,6 +80,7 @@ class Attention(BaseModel):
         atten = self.apply_attention(
             attention_type, embed_size/2, sN, p_rep, q_rep, layer=attention_layer)
 
+        atten = tf.cast(atten, tf.float32)
         atten = atten - tf.reduce_min(atten, [1], keep_dims=True)
         atten = tf.mul(atten, sN_mask, name='unnormalized_attention')
 
@@ -91,13 +97,10 @@ class Attention(BaseModel):
         self.accuracy = tf.reduce_mean(
             tf.cast(self.correct_prediction, tf.float32), name='accuracy')
 
-        self.optim = self.get_optimizer(optim_type, learning_rate)
-        gvs = self.optim.compute_gradients(self.loss)
-        with tf.name_scope('clip_norm'):
-            self.gvs = [(tf.clip_by_norm(g, max_norm), v) for g, v in gvs]
-
-        self.train_op = self.optim.apply_gradients(
-            self.gvs, global_step=global_step, name='train_op')
+        self.optim = self.get_optimizer(optim_type, learning_rate, sparse_grads)
+        gvs = self.compute_gradients(self.loss, dtype, loss_scale)
+        self.train_op = self.apply_gradients(gvs, global_step, max_norm,
+                                             sparse_grads, accumulate)
         self.check_op = tf.add_check_numerics_ops()
 
         tsum, vsum = self.create_summary(add_gv_sum=True)
@@ -1,14 +1,24 @@
-from GPU_availability import GPU_availability as GPU
-from data_utils import *
-from mdu import *
-import pprint
 import os
-pp = pprint.PrettyPrinter()
+import sys
+import pprint
+# the modules both trees share, in <repo>/shared
+_root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+if _root not in sys.path:
+    sys.path.append(_root)
 
-def define_gpu(num):
-    gpu_list = GPU()[:num]
-    gpu_str = ','.join(map(str, gpu_list))
-    os.environ['CUDA_VISIBLE_DEVICES'] = gpu_str
-    return gpu_list
+from data_utils import *
+from mdu import *
 
+from shared.doc_cache import *
+from shared.resources import *
+from shared.step_profile import *
+from shared.sparse import *
+from shared.checkpoint import *
+from shared.follow import *
+from shared.validation import *
+from shared.encoders import *
+from shared.accumulate import *
+from shared.precision import *
+from shared.throughput import *
 
+pp = pprint.PrettyPrinter()
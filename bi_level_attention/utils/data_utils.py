@@ -230,10 +230,8 @@ def data_iter(flist, max_nstep, max_query_step, batch_size=None, vocab_size=2645
     for s in range(steps):
         head = s * batch_size
         end = (s + 1) * batch_size
-        if end <= len(flist):
-            files = flist[head:end]
-        else:
-            files = flist[head:] + flist[:end - len(flist)]
+        files = flist[head:end]
+        n = len(files)
 
         if shuffle_data:
             random.shuffle(files)
@@ -265,7 +263,7 @@ def data_iter(flist, max_nstep, max_query_step, batch_size=None, vocab_size=2645
 
             y[idx][int(answer)] = 1
 
-        yield s, ds, d_length, qs, q_length, y
+        yield s, ds[:n], d_length[:n], qs[:n], q_length[:n], y[:n]
 
 
 def load_dataset(data_dir, dataset_name, vocab_size, batch_size, max_nstep, max_query_step, split_rate=0.9, size=None, shuffle_data=True):
@@ -0,0 +1,6 @@
+"""
+Modules shared by attentive-reader and bi_level_attention. The utils
+package of each tree star-imports them, so they are used as
+
+    from utils import encode, GradientAccumulator
+"""
@@ -0,0 +1,86 @@
+"""
+Gradient accumulation.
+
+A batch of K*b rows may not fit in memory when one of b does. The
+GradientAccumulator adds the unclipped gradients of K steps of b rows to
+non trainable variables, then applies their sum clipped once, as
+combine_gradients does for K towers. Losses are summed over rows, so the K
+micro-batches take the step of one batch of K*b, clipping included.
+
+    acc = GradientAccumulator(grads_and_vars)
+    train_op = acc.accumulate_op()
+    apply_op = acc.apply_op(optim, clip)
+    for i, batch in enumerate(batches):
+        sess.run(train_op, feed(batch))
+        if (i + 1) % K == 0:
+            sess.run(apply_op)
+
+The accumulators are local variables, checkpoints leave them out and
+tf.initialize_local_variables() initializes them. A sparse gradient is added
+to its rows and applied as the rows that are not zero, so the update stays
+as sparse as the one of the whole batch.
+"""
+import tensorflow as tf
+
+
+class GradientAccumulator(object):
+
+    def __init__(self, grads_and_vars, name='accumulate'):
+        self.grads_and_vars = grads_and_vars
+        self.accumulators = []
+        with tf.name_scope(name):
+            for g, v in grads_and_vars:
+                if g is None:
+                    self.accumulators.append(None)
+                    continue
+                with tf.device(v.device):
+                    acc = tf.Variable(tf.zeros(v.get_shape().as_list(), v.dtype.base_dtype),
+                                      trainable=False, name=v.op.name.replace('/', '_'),
+                                      collections=[tf.GraphKeys.LOCAL_VARIABLES])
+                self.accumulators.append(acc)
+
+    def accumulate_op(self, name='accumulate_op'):
+        """adds the gradients to the accumulators"""
+        adds = []
+        for acc, (g, v) in zip(self.accumulators, self.grads_and_vars):
+            if acc is None:
+                continue
+            if isinstance(g, tf.IndexedSlices):
+                adds.append(tf.scatter_add(acc, g.indices, g.values))
+            else:
+                adds.append(tf.assign_add(acc, g))
+        return tf.group(*adds, name=name)
+
+    def apply_op(self, optim, clip=None, global_step=None, name='apply_op'):
+        """applies the accumulated gradients, clipped by clip, and zeroes them"""
+        gvs = []
+        rows = []
+        for acc, (g, v) in zip(self.accumulators, self.grads_and_vars):
+            if acc is None:
+                gvs.append((None, v))
+                rows.append(None)
+                continue
+            if isinstance(g, tf.IndexedSlices):
+                flat = tf.reshape(acc, [int(acc.get_shape()[0]), -1])
+                idx = tf.to_int32(tf.reshape(tf.where(tf.reduce_any(tf.not_equal(flat, 0), 1)), [-1]))
+                total = tf.IndexedSlices(tf.gather(acc, idx), idx, g.dense_shape)
+            else:
+                idx = None
+                total = acc.value()
+            if clip is not None:
+                total = clip(total)
+            gvs.append((total, v))
+            rows.append(idx)
+
+        update = optim.apply_gradients(gvs, global_step=global_step)
+        resets = []
+        with tf.control_dependencies([update]):
+            for acc, idx in zip(self.accumulators, rows):
+                if acc is None:
+                    continue
+                if idx is None:
+                    resets.append(tf.assign(acc, tf.zeros_like(acc)))
+                else:
+                    zeros = tf.zeros(tf.concat(0, [tf.shape(idx), tf.shape(acc)[1:]]), acc.dtype.base_dtype)
+                    resets.append(tf.scatter_update(acc, idx, zeros))
+        return tf.group(*resets, name=name)
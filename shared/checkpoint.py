@@ -0,0 +1,141 @@
+"""
+Checkpoints written off the training thread.
+
+save() copies the variables to numpy with one sess.run, which is all the
+training loop waits for, and queues the copy. A writer thread loads it
+into a graph of its own and saves it under a temporary name. The files
+are renamed into place before the checkpoint state is updated, so readers
+never see half a checkpoint. At most max_pending copies wait for the
+writer, a save beyond that blocks until one is written.
+
+The .meta of every checkpoint is the training graph exported with the
+saver_def of saver, so import_meta_graph + restore work as with
+Saver.save. Given a Saver over tf.trainable_variables() the same class
+writes weights only snapshots, without the optimizer slots.
+"""
+import os
+import time
+import shutil
+import threading
+import Queue
+from glob import glob
+import tensorflow as tf
+
+
+class AsyncCheckpointer(object):
+
+    def __init__(self, saver, save_dir, var_list=None, prefix='model',
+                 max_to_keep=5, max_pending=1, background=True):
+        self.save_dir = save_dir
+        self.tmp_dir = os.path.join(save_dir, '.tmp')
+        if os.path.exists(self.tmp_dir):
+            # left by a writer killed mid save
+            shutil.rmtree(self.tmp_dir)
+        os.makedirs(self.tmp_dir)
+
+        self.var_list = var_list or tf.all_variables()
+        self.prefix = prefix
+        self.max_to_keep = max_to_keep
+        self.background = background
+        self.meta = tf.train.export_meta_graph(
+            saver_def=saver.saver_def).SerializeToString()
+        self.build_writer()
+
+        self.kept = self.previous()
+        self.stalls = []
+        self.error = None
+        self.queue = Queue.Queue(maxsize=max_pending)
+        if background:
+            self.thread = threading.Thread(target=self.run)
+            self.thread.daemon = True
+            self.thread.start()
+
+    def previous(self):
+        """
+        checkpoints of prefix a former run left in save_dir, oldest first, so
+        a resumed run keeps them in the state file and prunes them
+        """
+        state = tf.train.get_checkpoint_state(self.save_dir)
+        if state is None:
+            return []
+        kept = []
+        for p in state.all_model_checkpoint_paths:
+            name = os.path.basename(p)
+            if name == self.prefix or name.startswith(self.prefix + '-'):
+                kept.append(os.path.join(self.save_dir, name))
+        return kept
+
+    def build_writer(self):
+        """variables of the same names in a separate graph, fed from numpy"""
+        self.graph = tf.Graph()
+        with self.graph.as_default():
+            self.holders = []
+            inits = []
+            saved = {}
+            for v in self.var_list:
+                holder = tf.placeholder(v.dtype.base_dtype, v.get_shape())
+                w = tf.Variable(holder, trainable=False, collections=[])
+                self.holders.append(holder)
+                inits.append(w.initializer)
+                saved[v.op.name] = w
+            self.load = tf.group(*inits)
+            self.writer = tf.train.Saver(saved, max_to_keep=0)
+        self.sess = tf.Session(graph=self.graph, config=tf.ConfigProto(
+            intra_op_parallelism_threads=1, inter_op_parallelism_threads=1))
+
+    def save(self, sess, global_step=None):
+        """snapshot the variables and queue the write, returns the stall in seconds"""
+        if self.error is not None:
+            raise self.error
+        start = time.time()
+        values = sess.run(self.var_list)
+        name = self.prefix if global_step is None else '%s-%d' % (self.prefix, global_step)
+        path = os.path.join(self.save_dir, name)
+        if self.background:
+            self.queue.put((values, path))
+        else:
+            self.write(values, path)
+        stall = time.time() - start
+        self.stalls.append(stall)
+        print(" [*] Checkpoint %s, training stalled %.1fms" % (path, 1000 * stall))
+        return stall
+
+    def run(self):
+        while True:
+            values, path = self.queue.get()
+            try:
+                self.write(values, path)
+            except Exception as e:
+                self.error = e
+            finally:
+                self.queue.task_done()
+
+    def write(self, values, path):
+        start = time.time()
+        self.sess.run(self.load, feed_dict=dict(zip(self.holders, values)))
+        tmp = os.path.join(self.tmp_dir, os.path.basename(path))
+        self.writer.save(self.sess, tmp, write_meta_graph=False)
+        with open(tmp + '.meta', 'wb') as f:
+            f.write(self.meta)
+
+        for f in glob(tmp + '*'):
+            os.rename(f, path + f[len(tmp):])
+        self.kept = [_ for _ in self.kept if _ != path] + [path]
+        while self.max_to_keep and len(self.kept) > self.max_to_keep:
+            old = self.kept.pop(0)
+            for f in [old] + glob(old + '.*'):
+                if os.path.exists(f):
+                    os.remove(f)
+        tf.train.update_checkpoint_state(self.save_dir, path, self.kept)
+        print(" [*] Wrote %s in %.2fs" % (path, time.time() - start))
+
+    def join(self):
+        """wait for the queued writes"""
+        if self.background:
+            self.queue.join()
+        if self.error is not None:
+            raise self.error
+        if self.stalls:
+            print(" [*] %d checkpoints to %s, stalled %.1fms on average, %.1fms at most" % (
+                len(self.stalls), self.save_dir,
+                1000 * sum(self.stalls) / len(self.stalls), 1000 * max(self.stalls)))
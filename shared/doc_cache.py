@@ -0,0 +1,85 @@
+import hashlib
+import numpy as np
+from collections import OrderedDict
+
+
+def doc_key(*arrays):
+    """hash of the arrays describing one document"""
+    h = hashlib.md5()
+    for a in arrays:
+        h.update(np.ascontiguousarray(a).tostring())
+    return h.hexdigest()
+
+
+class DocCache(object):
+    """
+    LRU of query independent document encodings.
+
+    The encodings depend on the weights, so clear() it whenever another
+    checkpoint is loaded.
+    """
+
+    def __init__(self, capacity=128):
+        self.capacity = capacity
+        self.data = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.data)
+
+    def get(self, key):
+        value = self.data.pop(key, None)
+        if value is not None:
+            self.data[key] = value
+        return value
+
+    def put(self, key, value):
+        self.data.pop(key, None)
+        self.data[key] = value
+        while len(self.data) > self.capacity:
+            self.data.popitem(last=False)
+
+    def lookup(self, keys, encode):
+        """
+        stacked encodings of every key. encode(rows) runs the document
+        encoder on those rows of the batch and is called once, with one row
+        per document missing in the cache. If it returns a list of arrays,
+        a list of stacked arrays is returned
+        """
+        found = {}
+        missing = []
+        for i, k in enumerate(keys):
+            if k in found:
+                continue
+            value = self.get(k)
+            if value is None:
+                found[k] = None
+                missing.append(i)
+            else:
+                found[k] = value
+
+        if missing:
+            values = encode(missing)
+            if isinstance(values, (list, tuple)):
+                values = zip(*values)
+            for i, value in zip(missing, values):
+                found[keys[i]] = value
+                self.put(keys[i], value)
+
+        self.misses += len(missing)
+        self.hits += len(keys) - len(missing)
+        values = [found[k] for k in keys]
+        if isinstance(values[0], tuple):
+            return [np.stack(_) for _ in zip(*values)]
+        return np.stack(values)
+
+    @property
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return self.hits / float(total) if total else 0.0
+
+    def clear(self):
+        self.data.clear()
+        self.hits = 0
+        self.misses = 0
@@ -0,0 +1,212 @@
+"""
+Recurrent encoders with a choice of kernel.
+
+    h_t, final_state = encode('LSTM', 'fused', size, inputs, seq_length)
+
+kernel
+  cell   rnn_cell.LSTMCell / GRUCell under dynamic_rnn, a graph of small
+         matmuls and elementwise ops for every step
+  block  LSTMBlockCell / GRUBlockCell, one fused op per step
+  fused  LSTMBlockFusedCell, one op for the whole sequence. There is no
+         fused GRU, a GRU gets the block kernel
+
+Whatever the kernel, the results are those of dynamic_rnn and
+bidirectional_dynamic_rnn: batch major outputs, zero past seq_length, the
+backward direction running over the valid part of each row only, and
+the final states taken at seq_length. The block and fused kernels only
+have float32 CPU implementations.
+
+memory, what backprop keeps of the steps
+  keep       the activations of every step, as dynamic_rnn does
+  swap       the same with swap_memory on the while loops, they move from
+             the GPU to host memory during the forward pass. On a CPU they
+             are in host memory already and nothing changes
+  recompute  an LSTM keeping its state every segment steps only. The
+             gradient of a segment runs its forward again from that state,
+             so about one more forward pass of the encoder buys keeping the
+             inputs and outputs of the steps instead of all their gates.
+             Any kernel, float32, a static number of steps
+"""
+import functools
+import weakref
+import tensorflow as tf
+from tensorflow.python.framework import function
+from tensorflow.python.ops import rnn_cell
+
+KERNELS = ('cell', 'block', 'fused')
+MEMORY = ('keep', 'swap', 'recompute')
+
+
+def make_cell(cell_type, kernel, size, forget_bias=1.0):
+    if cell_type == 'LSTM' and kernel == 'cell':
+        return rnn_cell.LSTMCell(size, forget_bias=forget_bias, state_is_tuple=True)
+    elif cell_type == 'LSTM':
+        return tf.contrib.rnn.LSTMBlockCell(size, forget_bias=forget_bias)
+    elif cell_type == 'GRU' and kernel == 'cell':
+        return rnn_cell.GRUCell(size)
+    elif cell_type == 'GRU':
+        return tf.contrib.rnn.GRUBlockCell(size)
+    raise ValueError(cell_type)
+
+
+def stacked_cell(cell_type, kernel, size, forget_bias=1.0, layers=1, keep_prob=None):
+    cell = make_cell(cell_type, kernel, size, forget_bias)
+    if keep_prob is not None:
+        cell = rnn_cell.DropoutWrapper(cell, output_keep_prob=keep_prob)
+    if layers > 1:
+        cell = rnn_cell.MultiRNNCell([cell] * layers)
+    return cell
+
+
+def fused_lstm(size, inputs, seq_length, forget_bias=1.0, reverse=False):
+    """one direction of LSTMBlockFusedCell over batch major inputs"""
+    seq_length = tf.to_int32(seq_length)
+    x = tf.transpose(inputs, [1, 0, 2])  # T, N, E
+    if reverse:
+        x = tf.reverse_sequence(x, tf.to_int64(seq_length), seq_dim=0, batch_dim=1)
+    cell = tf.contrib.rnn.LSTMBlockFusedCell(size, forget_bias=forget_bias)
+    h, (c, final_h) = cell(x, dtype=tf.float32, sequence_length=seq_length)
+    mask = tf.sequence_mask(seq_length, tf.shape(x)[0], dtype=tf.float32)  # N, T
+    h = tf.transpose(h, [1, 0, 2]) * tf.expand_dims(mask, -1)  # N, T, H
+    if reverse:
+        h = tf.reverse_sequence(h, tf.to_int64(seq_length), seq_dim=1, batch_dim=0)
+    return h, rnn_cell.LSTMStateTuple(c, final_h)
+
+
+def lstm_steps(x, mask, c, h, w, b, forget_bias, steps):
+    """steps LSTM steps from the state c, h. x: steps, N, E; mask: steps, N"""
+    outputs = []
+    for x_t, m_t in zip(tf.unpack(x, num=steps), tf.unpack(mask, num=steps)):
+        i, j, f, o = tf.split(1, 4, tf.matmul(tf.concat(1, [x_t, h]), w) + b)
+        new_c = c * tf.sigmoid(f + forget_bias) + tf.sigmoid(i) * tf.tanh(j)
+        new_h = tf.tanh(new_c) * tf.sigmoid(o)
+        # rows past their length keep their state and output zeros
+        m_t = tf.expand_dims(m_t, 1)
+        c = m_t * new_c + (1 - m_t) * c
+        h = m_t * new_h + (1 - m_t) * h
+        outputs.append(m_t * new_h)
+    return tf.pack(outputs), c, h
+
+
+_segments = weakref.WeakKeyDictionary()
+
+
+def segment_function(steps, forget_bias):
+    """
+    lstm_steps as a function of the graph, the steps inside it are not
+    kept for backprop. Its gradient runs them again
+    """
+    cache = _segments.setdefault(tf.get_default_graph(), {})
+    key = (steps, forget_bias)
+    if key in cache:
+        return cache[key]
+
+    def grad(op, *grads):
+        # wait for the gradient of the segment, or every segment would be
+        # recomputed as soon as backprop starts
+        with tf.control_dependencies([g for g in grads if g is not None]):
+            inputs = [tf.identity(t) for t in op.inputs]
+        outputs = lstm_steps(*(inputs + [forget_bias, steps]))
+        grads = [tf.zeros_like(o) if g is None else g for g, o in zip(grads, op.outputs)]
+        return tf.gradients(outputs, inputs, grad_ys=grads)
+
+    def run(x, mask, c, h, w, b):
+        return lstm_steps(x, mask, c, h, w, b, forget_bias, steps)
+
+    cache[key] = function.Defun(*[tf.float32] * 6, func_name='RecomputeLSTM_%d' % len(cache),
+                                python_grad_func=grad)(run)
+    return cache[key]
+
+
+def recompute_lstm(size, inputs, seq_length, forget_bias=1.0, reverse=False, segment=50):
+    """one direction of an LSTM over batch major inputs, run segment steps at a time"""
+    seq_length = tf.to_int32(seq_length)
+    x = tf.transpose(inputs, [1, 0, 2])  # T, N, E
+    if reverse:
+        x = tf.reverse_sequence(x, tf.to_int64(seq_length), seq_dim=0, batch_dim=1)
+    nsteps, _, input_size = x.get_shape().as_list()
+    if nsteps is None:
+        raise ValueError('recompute needs a static number of steps')
+    segment = min(segment, nsteps)
+    mask = tf.transpose(tf.sequence_mask(seq_length, nsteps, dtype=tf.float32))  # T, N
+    pad = -nsteps % segment
+    if pad:
+        x = tf.pad(x, [[0, pad], [0, 0], [0, 0]])
+        mask = tf.pad(mask, [[0, pad], [0, 0]])
+
+    w = tf.get_variable('W', [input_size + size, 4 * size], dtype=tf.float32)
+    b = tf.get_variable('B', [4 * size], dtype=tf.float32, initializer=tf.zeros_initializer)
+    run = segment_function(segment, forget_bias)
+    c = h = tf.zeros(tf.pack([tf.shape(x)[1], size]))
+    outputs = []
+    for t in range(0, nsteps + pad, segment):
+        h_seg, c, h = run(x[t:t + segment], mask[t:t + segment], c, h, w, b)
+        h_seg.set_shape([segment, None, size])
+        c.set_shape([None, size])
+        h.set_shape([None, size])
+        outputs.append(h_seg)
+    h_t = tf.transpose(tf.concat(0, outputs)[:nsteps], [1, 0, 2])  # N, T, H
+    if reverse:
+        h_t = tf.reverse_sequence(h_t, tf.to_int64(seq_length), seq_dim=1, batch_dim=0)
+    return h_t, rnn_cell.LSTMStateTuple(c, h)
+
+
+def lstm_stack(direction, name, size, inputs, seq_length, forget_bias=1.0, layers=1,
+               keep_prob=None, reverse=False):
+    """layers of direction, fused_lstm or recompute_lstm"""
+    state = []
+    h = inputs
+    for i in range(layers):
+        with tf.variable_scope('Cell%d' % i if layers > 1 else name):
+            h, s = direction(size, h, seq_length, forget_bias, reverse)
+        if keep_prob is not None:
+            h = tf.nn.dropout(h, keep_prob)
+        state.append(s)
+    return h, tuple(state) if layers > 1 else state[0]
+
+
+def encode(cell_type, kernel, size, inputs, seq_length, bidirectional=True,
+           dtype=tf.float32, forget_bias=1.0, layers=1, keep_prob=None,
+           memory='keep', segment=50):
+    """
+    outputs and final states as returned by bidirectional_dynamic_rnn, or
+    by dynamic_rnn without bidirectional. layers cells of size are stacked
+    per direction, keep_prob drops out the outputs of every layer. memory
+    and segment, see above
+    """
+    cell_type = cell_type.upper()
+    if kernel not in KERNELS:
+        raise ValueError(kernel)
+    if memory not in MEMORY:
+        raise ValueError(memory)
+    if memory == 'recompute' and cell_type != 'LSTM':
+        raise ValueError('recompute runs an LSTM only, not %s' % cell_type)
+    if (kernel != 'cell' or memory == 'recompute') and tf.as_dtype(dtype) != tf.float32:
+        raise ValueError('the %s kernel runs in float32 only, not %s' % (
+            'recompute' if memory == 'recompute' else kernel, tf.as_dtype(dtype).name))
+
+    if memory == 'recompute' or (kernel == 'fused' and cell_type == 'LSTM'):
+        if memory == 'recompute':
+            direction, name = functools.partial(recompute_lstm, segment=segment), 'RecomputeLSTM'
+        else:
+            direction, name = fused_lstm, 'LSTMBlockFusedCell'
+        args = (direction, name, size, inputs, seq_length, forget_bias, layers, keep_prob)
+        if not bidirectional:
+            with tf.variable_scope('RNN'):
+                return lstm_stack(*args)
+        with tf.variable_scope('BiRNN'):
+            with tf.variable_scope('FW'):
+                h_fw, s_fw = lstm_stack(*args)
+            with tf.variable_scope('BW'):
+                h_bw, s_bw = lstm_stack(*args, reverse=True)
+        return (h_fw, h_bw), (s_fw, s_bw)
+
+    if kernel == 'fused':
+        kernel = 'block'
+    swap = memory == 'swap'
+    cell = lambda: stacked_cell(cell_type, kernel, size, forget_bias, layers, keep_prob)
+    if bidirectional:
+        return tf.nn.bidirectional_dynamic_rnn(cell(), cell(), inputs, sequence_length=seq_length,
+                                               dtype=dtype, swap_memory=swap)
+    return tf.nn.dynamic_rnn(cell(), inputs, sequence_length=seq_length, dtype=dtype,
+                             swap_memory=swap)
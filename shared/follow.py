@@ -0,0 +1,71 @@
+"""
+Validation in a process of its own, following the checkpoints of a trainer.
+
+    ./main.py --validator 2
+reserves 2 cores, starts the same command with --follow <log_dir> on them
+and trains on the other cores without validating inline. The follower
+restores every checkpoint that shows up in <log_dir>/ckpts and evaluates
+it on a validation set read once. When training is done the trainer
+touches <log_dir>/training_done, the follower validates what is left and
+exits.
+"""
+import os
+import re
+import sys
+import time
+import subprocess
+import tensorflow as tf
+from resources import pin_process
+
+DONE = 'training_done'
+
+
+def checkpoint_step(path):
+    """'ckpts/model-1500' -> 1500, None without a step"""
+    m = re.search(r'-(\d+)$', path)
+    return int(m.group(1)) if m else None
+
+
+def follow_checkpoints(ckpt_dir, interval=10, timeout=0):
+    """
+    yields every checkpoint listed in ckpt_dir once, oldest first, as they
+    are written. Stops once the trainer is done and the last one was
+    yielded, or after timeout seconds without a new one, 0 waits forever
+    """
+    done = os.path.join(os.path.dirname(os.path.normpath(ckpt_dir)), DONE)
+    seen = set()
+    last = time.time()
+    while True:
+        # looked at before the listing, so the last checkpoint is not missed
+        finished = os.path.exists(done)
+        state = tf.train.get_checkpoint_state(ckpt_dir)
+        paths = list(state.all_model_checkpoint_paths) if state else []
+        new = [p for p in paths if p not in seen]
+        for p in new:
+            seen.add(p)
+            yield p
+        if new:
+            last = time.time()
+        elif finished or (timeout and time.time() - last > timeout):
+            return
+        else:
+            time.sleep(interval)
+
+
+def scalar_summary(**values):
+    """Summary proto of python floats, for writing outside of the graph"""
+    return tf.Summary(value=[tf.Summary.Value(tag=k, simple_value=float(v))
+                             for k, v in sorted(values.items())])
+
+
+def launch_validator(argv, cores):
+    """run `python argv` pinned to cores, returns the Popen"""
+    return subprocess.Popen([sys.executable] + list(argv),
+                            preexec_fn=lambda: pin_process(cores))
+
+
+def stop_validator(log_dir, proc):
+    """tell the follower training is done and wait for it to finish"""
+    open(os.path.join(log_dir, DONE), 'w').close()
+    print(" [*] Waiting for the validator to finish")
+    return proc.wait()
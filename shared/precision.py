@@ -0,0 +1,45 @@
+"""
+Reduced precision training with float32 master weights.
+
+    with tf.variable_scope('model', custom_getter=float32_master(tf.float16)):
+        ...
+    gvs = scaled_gradients(optim, loss, tf.float16, loss_scale=128.0)
+
+The variables are stored and updated in float32, the graph reads copies cast
+to the training dtype. The loss is scaled up before the backward pass so small
+gradients do not flush to zero, and the gradients scaled back down before
+they are clipped and applied.
+"""
+import tensorflow as tf
+
+
+def float32_master(dtype, keep=('emb',)):
+    """
+    custom getter: every variable is stored in float32, the model reads a
+    copy cast to dtype. Variables named in keep are returned as they are
+    """
+    def getter(_getter, name, *args, **kwargs):
+        kwargs['dtype'] = tf.float32
+        var = _getter(name, *args, **kwargs)
+        if name.split('/')[-1] in keep:
+            return var
+        return tf.cast(var, dtype)
+    return getter
+
+
+def scaled_gradients(optim, loss, dtype, loss_scale=128.0):
+    """
+    optim.compute_gradients(loss), with the loss scaled by loss_scale and the
+    gradients scaled back when dtype is not float32
+    """
+    if dtype == tf.float32:
+        return optim.compute_gradients(loss)
+    gvs = optim.compute_gradients(loss * loss_scale)
+    return [(None if g is None else scale_gradient(g, 1.0 / loss_scale), v)
+            for g, v in gvs]
+
+
+def scale_gradient(g, scale):
+    if isinstance(g, tf.IndexedSlices):
+        return tf.IndexedSlices(g.values * scale, g.indices, g.dense_shape)
+    return g * scale
@@ -0,0 +1,160 @@
+"""
+CPU planning for the tf.Session of one job.
+
+Several jobs usually share a box, and the default thread pools of every
+session size themselves to all cores. plan_resources looks at the cores
+this process may run on and how busy they are, and gives the job its share
+of the idle ones:
+
+    config, plan = define_resources(jobs=2, pin=True)
+    with tf.Session(config=config) as sess:
+"""
+import os
+import time
+import subprocess
+import multiprocessing
+from collections import namedtuple
+import tensorflow as tf
+
+Plan = namedtuple('Plan', ['cores', 'intra', 'inter', 'pinned'])
+
+
+def parse_cpu_list(s):
+    """'0-3,8,10-11' -> [0, 1, 2, 3, 8, 10, 11]"""
+    cores = []
+    for part in s.strip().split(','):
+        if '-' in part:
+            head, end = part.split('-')
+            cores.extend(range(int(head), int(end) + 1))
+        elif part:
+            cores.append(int(part))
+    return cores
+
+
+def allowed_cores():
+    """logical cores in the affinity mask of this process"""
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('Cpus_allowed_list:'):
+                    return parse_cpu_list(line.split(':', 1)[1])
+    except IOError:
+        pass
+    return range(multiprocessing.cpu_count())
+
+
+def cpu_topology():
+    """{logical core: (socket, physical core)} from /proc/cpuinfo"""
+    topology = {}
+    try:
+        with open('/proc/cpuinfo') as f:
+            text = f.read()
+    except IOError:
+        return dict((c, (0, c)) for c in range(multiprocessing.cpu_count()))
+
+    for block in text.strip().split('\n\n'):
+        info = {}
+        for line in block.split('\n'):
+            if ':' in line:
+                k, v = line.split(':', 1)
+                info[k.strip()] = v.strip()
+        if 'processor' not in info:
+            continue
+        c = int(info['processor'])
+        topology[c] = (int(info.get('physical id', 0)), int(info.get('core id', c)))
+    return topology
+
+
+def _cpu_times():
+    times = {}
+    with open('/proc/stat') as f:
+        for line in f:
+            name = line.split(' ', 1)[0]
+            if name.startswith('cpu') and name != 'cpu':
+                v = [int(_) for _ in line.split()[1:]]
+                # idle and iowait
+                times[int(name[3:])] = (sum(v), v[3] + (v[4] if len(v) > 4 else 0))
+    return times
+
+
+def core_load(interval=0.2):
+    """{logical core: busy fraction} over interval seconds"""
+    try:
+        before = _cpu_times()
+        time.sleep(interval)
+        after = _cpu_times()
+    except IOError:
+        # no per core counters, spread the load average evenly
+        load = os.getloadavg()[0] / multiprocessing.cpu_count()
+        return dict((c, min(load, 1.0)) for c in range(multiprocessing.cpu_count()))
+
+    load = {}
+    for c, (total, idle) in after.items():
+        if c not in before:
+            continue
+        dt = total - before[c][0]
+        di = idle - before[c][1]
+        load[c] = 1.0 - di / float(dt) if dt > 0 else 0.0
+    return load
+
+
+def plan_resources(threads=0, inter_threads=0, jobs=1, busy=0.5, exclude=()):
+    """
+    threads: intra op threads, 0 takes this job's share of the idle cores
+    inter_threads: 0 uses one per socket the cores span
+    jobs: number of jobs about to share the idle cores
+    busy: a core is taken above this load
+    exclude: cores left to another process, see reserve_cores
+
+    returns Plan(cores, intra, inter, pinned), cores are the least loaded
+    allowed ones, one per intra op thread
+    """
+    cores = [c for c in allowed_cores() if c not in exclude] or allowed_cores()
+    load = core_load()
+    idle = [c for c in cores if load.get(c, 0.0) < busy]
+    if not threads:
+        threads = max(1, len(idle) // jobs)
+    threads = min(threads, len(cores))
+
+    chosen = sorted(cores, key=lambda c: load.get(c, 0.0))[:threads]
+    if not inter_threads:
+        topology = cpu_topology()
+        inter_threads = len(set(topology.get(c, (0, c))[0] for c in chosen))
+    return Plan(sorted(chosen), threads, max(1, inter_threads), False)
+
+
+def reserve_cores(n):
+    """the n least loaded allowed cores, for a helper process next to the job"""
+    load = core_load()
+    return sorted(sorted(allowed_cores(), key=lambda c: load.get(c, 0.0))[:n])
+
+
+def pin_process(cores, pid=None):
+    """restrict pid (this process by default) to cores, True on success"""
+    pid = pid or os.getpid()
+    if hasattr(os, 'sched_setaffinity'):
+        os.sched_setaffinity(pid, cores)
+        return True
+    with open(os.devnull, 'w') as null:
+        cmd = ['taskset', '-pc', ','.join(map(str, cores)), str(pid)]
+        try:
+            return subprocess.call(cmd, stdout=null, stderr=null) == 0
+        except OSError:
+            return False
+
+
+def session_config(plan):
+    return tf.ConfigProto(intra_op_parallelism_threads=plan.intra,
+                          inter_op_parallelism_threads=plan.inter,
+                          allow_soft_placement=True)
+
+
+def define_resources(threads=0, inter_threads=0, jobs=1, pin=False, exclude=()):
+    """plan, optionally pin, and return (ConfigProto, Plan)"""
+    plan = plan_resources(threads, inter_threads, jobs, exclude=exclude)
+    if pin:
+        plan = plan._replace(pinned=pin_process(plan.cores))
+    print(' [*] Using %d intra op and %d inter op threads on cores %s%s' %
+          (plan.intra, plan.inter, ','.join(map(str, plan.cores)),
+           ' (pinned)' if plan.pinned else ''))
+    return session_config(plan), plan
@@ -0,0 +1,64 @@
+"""
+Keeping the embedding gradient sparse.
+
+embedding_lookup gives an IndexedSlices gradient with one row per looked
+up token. tf.clip_by_norm and the summary ops turn it into a dense
+vocab x size tensor, and Adam then decays the moments of every row. The
+helpers here work on the rows of the batch only.
+"""
+import tensorflow as tf
+
+
+def sum_duplicates(g):
+    """IndexedSlices with every index once"""
+    unique, idx = tf.unique(g.indices)
+    values = tf.unsorted_segment_sum(g.values, idx, tf.shape(unique)[0])
+    return tf.IndexedSlices(values, unique, g.dense_shape)
+
+
+def clip_gradient(g, max_norm):
+    """tf.clip_by_norm, which keeps an IndexedSlices sparse"""
+    if not isinstance(g, tf.IndexedSlices):
+        return tf.clip_by_norm(g, max_norm)
+    # the norm of the dense gradient needs the duplicates summed
+    g = sum_duplicates(g)
+    norm = tf.sqrt(tf.reduce_sum(tf.square(g.values)))
+    scale = max_norm / tf.maximum(norm, max_norm)
+    return tf.IndexedSlices(g.values * scale, g.indices, g.dense_shape)
+
+
+def summary_tensor(g):
+    """what the gradient summaries look at, the touched rows of a sparse one"""
+    if isinstance(g, tf.IndexedSlices):
+        return g.values
+    return g
+
+
+class LazyAdamOptimizer(tf.train.AdamOptimizer):
+    """
+    Adam which only updates the moments and weights of the rows in a sparse
+    gradient. The other rows keep their moments until they are looked up
+    again, the same as the sparse RMSProp and momentum updates do. Dense
+    gradients are updated as by Adam
+    """
+
+    def _apply_sparse(self, grad, var):
+        grad = sum_duplicates(grad)
+        dtype = var.dtype.base_dtype
+        beta1 = tf.cast(self._beta1_t, dtype)
+        beta2 = tf.cast(self._beta2_t, dtype)
+        epsilon = tf.cast(self._epsilon_t, dtype)
+        beta1_power = tf.cast(self._beta1_power, dtype)
+        beta2_power = tf.cast(self._beta2_power, dtype)
+        lr = tf.cast(self._lr_t, dtype) * tf.sqrt(1 - beta2_power) / (1 - beta1_power)
+
+        idx = grad.indices
+        m = self.get_slot(var, 'm')
+        v = self.get_slot(var, 'v')
+        m_rows = beta1 * tf.gather(m, idx) + (1 - beta1) * grad.values
+        v_rows = beta2 * tf.gather(v, idx) + (1 - beta2) * tf.square(grad.values)
+        m_t = tf.scatter_update(m, idx, m_rows, use_locking=self._use_locking)
+        v_t = tf.scatter_update(v, idx, v_rows, use_locking=self._use_locking)
+        var_t = tf.scatter_sub(var, idx, lr * m_rows / (tf.sqrt(v_rows) + epsilon),
+                               use_locking=self._use_locking)
+        return tf.group(var_t, m_t, v_t)
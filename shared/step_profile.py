@@ -0,0 +1,142 @@
+"""
+Traces a window of training steps.
+
+    profiler = StepProfiler(log_dir, '100-110')
+    for data in train_iter:
+        kwargs = profiler.before_run(counter)
+        sess.run(fetch, feed_dict, **kwargs)
+        profiler.after_run(counter, kwargs)
+
+Steps in the window run with a full trace. Each one is dumped as a Chrome
+trace (chrome://tracing) to <log_dir>/timeline/step_<n>.json. After the
+last one the op times are ranked, and the wall time of every step is split
+into input wait (python between two runs: batching, padding, summaries),
+session overhead (feeding and fetching) and graph execution.
+"""
+import os
+import time
+from collections import defaultdict
+import tensorflow as tf
+from tensorflow.python.client import timeline
+
+
+def parse_window(window):
+    """'100-110' -> (100, 110), None -> None"""
+    if not window:
+        return None
+    head, _, end = str(window).partition('-')
+    head = int(head)
+    return head, int(end) if end else head + 10
+
+
+def op_type(node):
+    """op type from the timeline label 'name = Type(inputs)'"""
+    label = node.timeline_label
+    if ' = ' in label:
+        return label.split(' = ', 1)[1].split('(', 1)[0]
+    return node.node_name
+
+
+class StepProfiler(object):
+
+    def __init__(self, log_dir, window, part_of=None, top=25):
+        """
+        window: 'first-last' steps, last excluded, None disables tracing
+        part_of: {op name: part of the model}, ops not in it are grouped
+                 by their top name scope
+        """
+        self.window = parse_window(window)
+        self.trace_dir = os.path.join(log_dir, 'timeline')
+        self.part_of = part_of or {}
+        self.top = top
+        self.by_type = defaultdict(float)
+        self.by_part = defaultdict(float)
+        self.calls = defaultdict(int)
+        self.steps = []
+        self.last = None
+
+    def active(self, step):
+        return self.window is not None and self.window[0] <= step < self.window[1]
+
+    def before_run(self, step):
+        """sess.run keyword arguments for step"""
+        now = time.time()
+        self.wait = now - self.last if self.last is not None else 0.0
+        self.start = now
+        if not self.active(step):
+            return {}
+        return dict(options=tf.RunOptions(trace_level=tf.RunOptions.FULL_TRACE),
+                    run_metadata=tf.RunMetadata())
+
+    def after_run(self, step, kwargs):
+        now = time.time()
+        if kwargs:
+            stats = kwargs['run_metadata'].step_stats
+            self.dump(step, stats)
+            graph = self.collect(stats)
+            self.steps.append((step, self.wait, now - self.start, graph))
+            if step == self.window[1] - 1:
+                self.report()
+        # the input wait of the next step leaves out the tracing above
+        self.last = time.time()
+
+    def part(self, name):
+        grad = ''
+        if 'gradients/' in name:
+            # [scope/]gradients/<forward op>_grad/..., charged to the forward op
+            fwd = name.split('gradients/', 1)[1].split('/')
+            for i, p in enumerate(fwd):
+                if p.endswith('_grad'):
+                    name = '/'.join(fwd[:i] + [p[:-len('_grad')]])
+                    break
+            grad = ' (grad)'
+        if name in self.part_of:
+            return self.part_of[name] + grad
+        return name.split('/')[0] + grad
+
+    def dump(self, step, stats):
+        if not os.path.exists(self.trace_dir):
+            os.makedirs(self.trace_dir)
+        trace = timeline.Timeline(stats).generate_chrome_trace_format()
+        with open(os.path.join(self.trace_dir, 'step_%d.json' % step), 'w') as f:
+            f.write(trace)
+
+    def collect(self, stats):
+        """add the op times of one step, returns its graph execution time"""
+        head, end = None, None
+        for dev in stats.dev_stats:
+            for node in dev.node_stats:
+                if node.node_name in ('_SOURCE', '_SINK'):
+                    continue
+                ms = node.all_end_rel_micros / 1e3
+                self.by_type[op_type(node)] += ms
+                self.by_part[self.part(node.node_name)] += ms
+                self.calls[op_type(node)] += 1
+                node_end = node.all_start_micros + node.all_end_rel_micros
+                head = node.all_start_micros if head is None else min(head, node.all_start_micros)
+                end = node_end if end is None else max(end, node_end)
+        return (end - head) / 1e6 if head is not None else 0.0
+
+    def table(self, times, title, calls=None):
+        n = float(max(len(self.steps), 1))
+        total = sum(times.values()) or 1.0
+        lines = ['%-40s %10s %7s%s' % (title, 'ms/step', '%', ' %8s' % 'calls' if calls else '')]
+        for name, ms in sorted(times.items(), key=lambda _: -_[1])[:self.top]:
+            line = '%-40s %10.2f %6.1f%%' % (name[:40], ms / n, 100 * ms / total)
+            if calls:
+                line += ' %8d' % (calls[name] / n)
+            lines.append(line)
+        return lines
+
+    def report(self):
+        lines = [' [*] Profiled steps %d-%d, op times summed over threads' % self.window, '']
+        lines += self.table(self.by_type, 'op type', self.calls) + ['']
+        lines += self.table(self.by_part, 'part') + ['']
+        lines.append('%6s %10s %10s %10s %10s' % ('step', 'input ms', 'session ms', 'graph ms', 'total ms'))
+        for step, wait, run, graph in self.steps:
+            lines.append('%6d %10.1f %10.1f %10.1f %10.1f' % (
+                step, 1e3 * wait, 1e3 * (run - graph), 1e3 * graph, 1e3 * (wait + run)))
+        text = '\n'.join(lines)
+        print(text)
+        with open(os.path.join(self.trace_dir, 'hot_ops.txt'), 'w') as f:
+            f.write(text + '\n')
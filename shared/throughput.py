@@ -0,0 +1,118 @@
+"""
+Training throughput over logging intervals.
+
+    meter = Throughput(log_dir, writer, every=10)
+    for data in meter.wait(train_iter):
+        start = time.time()
+        sess.run(fetch, feed_dict)
+        tokens, slots = padded_tokens(d_end, max_nsteps)
+        meter.add(counter, time.time() - start, len(d_end), tokens, slots)
+
+Every `every` steps it reports examples/sec and tokens/sec over the wall
+time of the interval, tokens being the ones within the lengths and slots all
+the positions fed, padding included. The wall time is split into time
+blocked on the batch iterator, time in sess.run and the rest (summaries,
+validation, checkpoints). The resident and peak memory of the process
+close the record.
+
+Records go to TensorBoard as scalars and, one json object per line, to
+<log_dir>/throughput.jsonl.
+"""
+import os
+import json
+import time
+import resource
+import numpy as np
+
+from follow import scalar_summary
+
+
+def rss_mb():
+    """resident memory of this process, the peak where /proc is missing"""
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmRSS'):
+                    return int(line.split()[1]) / 1024.0
+    except IOError:
+        pass
+    return peak_mb()
+
+
+def peak_mb():
+    """peak resident memory of this process"""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+
+def padded_tokens(lengths, width):
+    """(tokens within lengths, positions fed) of rows padded to width"""
+    lengths = np.asarray(lengths)
+    return int(np.minimum(lengths, width).sum()), lengths.size * width
+
+
+class Throughput(object):
+
+    def __init__(self, log_dir, writer=None, every=10, fname='throughput.jsonl'):
+        self.path = os.path.join(log_dir, fname)
+        self.writer = writer
+        self.every = every
+        self.start = None
+        self.reset()
+
+    def reset(self):
+        self.steps = 0
+        self.examples = 0
+        self.tokens = 0
+        self.slots = 0
+        self.waited = 0.0
+        self.ran = 0.0
+
+    def wait(self, batches):
+        """yields the items of batches, timing how long each one blocks"""
+        batches = iter(batches)
+        while True:
+            now = time.time()
+            if self.start is None:
+                self.start = now
+            try:
+                item = next(batches)
+            except StopIteration:
+                return
+            self.waited += time.time() - now
+            yield item
+
+    def add(self, step, run_seconds, examples, tokens, slots):
+        """one sess.run of step, reports if it closes an interval"""
+        if self.start is None:
+            self.start = time.time() - run_seconds
+        self.steps += 1
+        self.ran += run_seconds
+        self.examples += examples
+        self.tokens += tokens
+        self.slots += slots
+        if self.steps >= self.every:
+            return self.report(step)
+
+    def report(self, step):
+        now = time.time()
+        wall = max(now - self.start, 1e-9)
+        values = {'examples_per_sec': self.examples / wall,
+                  'tokens_per_sec': self.tokens / wall,
+                  'padding': 1.0 - self.tokens / float(max(self.slots, 1)),
+                  'input_wait': self.waited / wall,
+                  'run_time': self.ran / wall,
+                  'rss_mb': rss_mb()}
+        if self.writer is not None:
+            self.writer.add_summary(scalar_summary(**values), step)
+
+        record = dict(values, step=step, time=now, steps=self.steps, seconds=wall,
+                      wait_seconds=self.waited, run_seconds=self.ran,
+                      max_rss_mb=peak_mb())
+        with open(self.path, 'a') as f:
+            f.write(json.dumps(record, sort_keys=True) + '\n')
+        print(" [*] %.1f examples/s, %.0f tokens/s, %.1f%% padding, input wait %.1f%%, run %.1f%%, RSS %dMB"
+              % (values['examples_per_sec'], values['tokens_per_sec'], 100 * values['padding'],
+                 100 * values['input_wait'], 100 * values['run_time'], values['rss_mb']))
+        self.reset()
+        self.start = now
+        return record
@@ -0,0 +1,52 @@
+"""
+Validation data read once.
+
+Every evaluation used to draw a new random sample of the validation data,
+then read and pad it again. A ValidationSet holds a fixed sample as padded,
+contiguous arrays, so evaluations skip the parsing and run on the same
+questions, and their results compare.
+
+    idx = fixed_sample(len(data), size, row_bytes, max_mb=256)
+    vset = ValidationSet(pad(data[idx]))
+    for batch in vset.batches(batch_size):
+"""
+import numpy as np
+
+
+def fixed_sample(n, size, row_bytes=0, max_mb=0, seed=1234):
+    """
+    sorted indices of size of n items, the same ones for a seed. Rows of
+    row_bytes beyond max_mb are left out, from the end of the same
+    permutation, so a lower cap gives a subset of the sample of a higher one
+    """
+    perm = np.random.RandomState(seed).permutation(n)
+    size = min(size, n)
+    if max_mb and row_bytes:
+        fit = max(1, int(max_mb * 2 ** 20 // row_bytes))
+        if fit < size:
+            print(" [*] Validation set of %d rows is over %dMB, using %d" % (size, max_mb, fit))
+            size = fit
+    return np.sort(perm[:size])
+
+
+class ValidationSet(object):
+
+    def __init__(self, arrays):
+        """arrays: padded arrays with one row per question"""
+        self.arrays = [np.ascontiguousarray(a) for a in arrays]
+
+    def __len__(self):
+        return self.arrays[0].shape[0]
+
+    @property
+    def nbytes(self):
+        return sum(a.nbytes for a in self.arrays)
+
+    def steps(self, batch_size):
+        return int(np.ceil(len(self) / float(batch_size)))
+
+    def batches(self, batch_size):
+        """[s, rows of every array] for every batch, views, not copies"""
+        for s in range(self.steps(batch_size)):
+            head = s * batch_size
+            yield [s] + [a[head:head + batch_size] for a in self.arrays]